@@ -0,0 +1,72 @@
+# benchmarks/filtros_memoria.py
+# Pico de memoria (tracemalloc) de cada cambio de filtro con los pivots ya en
+# caché, comparado con el tamaño de la vista resultante. Sin copias
+# defensivas el pico debe quedar del orden de la vista: si algún cambio
+# supera PICO_MAX_VISTA veces la vista (más HOLGURA_MB) el script termina con
+# código 1. Uso:
+#     python -m benchmarks.filtros_memoria [productos] [tiendas]
+import sys
+import tracemalloc
+
+from benchmarks.pivot_benchmark import inventario_sintetico
+from components.services.inventory_service import InventoryService, VISTAS_PIVOT
+
+# Pico admitido por cambio de filtro: con copias defensivas era 1.1-2.5x la
+# vista; sin ellas queda en 0.1-1.0x. La holgura absorbe las vistas pequeñas.
+PICO_MAX_VISTA = 1.5
+HOLGURA_MB = 2.0
+
+# (descripción, opcion, kwargs de aplicar_filtros)
+CAMBIOS = [
+    ("sin filtros", "Todo", {}),
+    ("excluir marca", "Todo", {"exclude_list": ["AB"]}),
+    ("solo promoción", "Todo", {"solo_1": True}),
+    ("duplicados", "Solo Sucursales", {"desc_dup_var": True}),
+    ("sólo duplicados", "Solo Sucursales", {"desc_dup_var": True, "filter_mode": "dup"}),
+    ("casa matriz 1..11", "Solo Casa Matriz", {"solo_matriz_exist_1_11": True}),
+]
+
+
+def _aplicar(service: InventoryService, opcion: str, kwargs: dict):
+    args = dict(region="Todas", referencia="", exclude_list=[], solo_1=False, promo_var=False,
+                desc_dup_var=False, filter_solo_coincide=False, filter_solo_no_coincide=False,
+                filter_mode=None)
+    args.update(kwargs)
+    return service.aplicar_filtros(opcion, **args)
+
+
+def main(n_productos: int = 20_000, n_tiendas: int = 40) -> int:
+    service = InventoryService(None)
+    service.establecer_dataset(inventario_sintetico(n_productos, n_tiendas))
+    # pivots de las tres vistas en caché (sin el hilo de precalentado de por medio)
+    service.pivot_service.precalentar = lambda *args, **kwargs: None
+    for opcion in VISTAS_PIVOT:
+        _aplicar(service, opcion, {})
+
+    print(f"{'cambio':<20} {'vista MB':>9} {'pico MB':>9} {'pico/vista':>11}")
+    excedidos = []
+    tracemalloc.start()
+    for nombre, opcion, kwargs in CAMBIOS:
+        tracemalloc.reset_peak()
+        antes = tracemalloc.get_traced_memory()[0]
+        vista = _aplicar(service, opcion, kwargs)
+        pico = tracemalloc.get_traced_memory()[1] - antes
+        tam = vista.memory_usage(deep=True).sum()
+        excede = pico > PICO_MAX_VISTA * tam + HOLGURA_MB * 2**20
+        if excede:
+            excedidos.append(nombre)
+        print(f"{nombre:<20} {tam / 2**20:9.1f} {pico / 2**20:9.1f} {pico / max(tam, 1):11.2f}"
+              f"{'  EXCEDE' if excede else ''}")
+        del vista
+    tracemalloc.stop()
+
+    if excedidos:
+        print(f"Pico por encima de {PICO_MAX_VISTA}x la vista (+{HOLGURA_MB} MB) en: {', '.join(excedidos)}")
+        return 1
+    print(f"Todos los picos dentro de {PICO_MAX_VISTA}x la vista (+{HOLGURA_MB} MB)")
+    return 0
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    sys.exit(main(*argumentos))
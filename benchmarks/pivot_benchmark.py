@@ -0,0 +1,142 @@
+# benchmarks/pivot_benchmark.py
+# Compara el pivot "Todo" con pivot_table + apply por fila (implementación
+# anterior) contra el motor de components/pivot_engine.py, sobre un
+# inventario sintético. Uso:
+#     python -m benchmarks.pivot_benchmark [productos] [tiendas]
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from components.campofijos import CAMPOS_FIJOS
+from components.esquema_inventario import aplicar_esquema
+from components.modelo_inventario import ModeloInventario
+from components.pivot_existencias import pivot_existencias, completar_pivot_existencias
+
+
+def inventario_sintetico(n_productos: int = 20_000, n_tiendas: int = 40, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    tiendas = [
+        (f"{'Casa Matriz' if i % 5 == 0 else 'Sucursales'} {i % 4}", f"Tienda {i:03d}")
+        for i in range(n_tiendas)
+    ]
+    por_producto = rng.integers(1, n_tiendas + 1, n_productos)
+    prod = np.repeat(np.arange(n_productos), por_producto)
+    tienda = np.concatenate([rng.choice(n_tiendas, k, replace=False) for k in por_producto])
+    ref = np.array([f"R{p:06d}" for p in range(n_productos)])[prod]
+    marca = np.array(["AB", "CD", "EF", "GH"])[prod % 4]
+    df = pd.DataFrame({
+        'Concatenar': np.char.add(ref, marca),
+        'Referencia': ref,
+        'CodigoMarca': marca,
+        'NombreMarca': np.char.add("Marca ", marca),
+        'Nombre': np.char.add("Producto ", ref),
+        'Fabricante': np.array(["F0", "F1", "F2"])[prod % 3],
+        'CodigoSubLinea': np.array(["S1", "S2", "S3", "S4"])[prod % 4],
+        'Linea': np.array(["L1", "L2"])[prod % 2],
+        'Encargado': np.array(["Raul", "Jesenia", "Dairo"])[prod % 3],
+        'Descuento': np.array(["0%", "10%", "25%"])[rng.integers(0, 3, len(prod))],
+        'Promocion': rng.integers(0, 2, len(prod)),
+        'NombreCategoria': np.array(["C0", "C1", "C2", "C3", "C4"])[prod % 5],
+        'Fecha': "01/01/2024",
+        'Region': np.array([t[0] for t in tiendas])[tienda],
+        'NombreTienda': np.array([t[1] for t in tiendas])[tienda],
+        'Existencia_Total': rng.integers(0, 30, len(prod)),
+    })
+    return aplicar_esquema(df)
+
+
+def pivot_referencia(df: pd.DataFrame) -> pd.DataFrame:
+    """"Todo" con pivot_table + merge + apply por fila (implementación anterior)."""
+    df_fijos = df[CAMPOS_FIJOS].drop_duplicates(subset=['Concatenar'])
+    etiqueta = df['Region'].astype(str) + ' - ' + df['NombreTienda'].astype(str)
+    df_pivot = df.assign(NombreTiendaDetallado=etiqueta).pivot_table(
+        index='Concatenar', columns='NombreTiendaDetallado', values='Existencia_Total',
+        aggfunc='sum', observed=True,
+    )
+    df_pivot.columns = df_pivot.columns.astype(str)
+    df_pivot = df_pivot.reset_index()
+    resultado = pd.merge(df_fijos, df_pivot, on='Concatenar', how='left')
+    cm = sorted(c for c in df_pivot.columns if 'Casa Matriz' in c)
+    su = sorted(c for c in df_pivot.columns if 'Sucursales' in c)
+    resultado['Casa_matriz_Total'] = resultado[cm].sum(axis=1)
+    resultado['Sucursal_Total'] = resultado[su].sum(axis=1)
+    resultado['Total_Existencia'] = resultado['Casa_matriz_Total'] + resultado['Sucursal_Total']
+    for col, parte in (('Porcentaje_Existencia_CasaMatriz', 'Casa_matriz_Total'),
+                       ('Porcentaje_Existencia_Sucursales', 'Sucursal_Total')):
+        resultado[col] = resultado.apply(
+            lambda row: round((row[parte] / row['Total_Existencia']) * 100, 2)
+            if row['Total_Existencia'] > 0 else 0,
+            axis=1,
+        ).astype(str) + '%'
+    resultado = resultado[CAMPOS_FIJOS + cm + su + ['Sucursal_Total', 'Casa_matriz_Total',
+                                                    'Porcentaje_Existencia_CasaMatriz',
+                                                    'Porcentaje_Existencia_Sucursales']]
+    for col in cm + su:
+        resultado[col] = resultado[col].fillna(0)
+    return resultado[~((resultado['Casa_matriz_Total'] == 0) & (resultado['Sucursal_Total'] == 0))]
+
+
+def pivot_referencia_sucursales(df: pd.DataFrame) -> pd.DataFrame:
+    """"Solo Sucursales" con drop_duplicates + pivot_table + merge (implementación anterior)."""
+    sucursales = df[df['Region'].str.contains('Sucursales')]
+    df_fijos = sucursales[CAMPOS_FIJOS].drop_duplicates()
+    df_pivot = sucursales.pivot_table(index='Concatenar', columns='NombreTienda', values='Existencia_Total',
+                                      aggfunc='sum', observed=True).reset_index()
+    resultado = pd.merge(df_fijos, df_pivot, on='Concatenar', how='left')
+    cols = sorted(c for c in resultado.columns if c not in CAMPOS_FIJOS)
+    for col in cols:
+        resultado[col] = resultado[col].fillna(0)
+    resultado['Sucursal_Total'] = resultado[cols].sum(axis=1)
+    resultado = resultado[resultado['Sucursal_Total'] > 0]
+    return resultado[CAMPOS_FIJOS + cols + ['Sucursal_Total']]
+
+
+def pivot_referencia_casa_matriz(df: pd.DataFrame) -> pd.DataFrame:
+    """"Solo Casa Matriz" con drop_duplicates + pivot_table + merge (implementación anterior)."""
+    matriz = df[df['Region'].str.contains('Casa Matriz', na=False)]
+    df_fijos = matriz[CAMPOS_FIJOS].drop_duplicates()
+    df_pivot = matriz.pivot_table(index='Concatenar', columns='Region', values='Existencia_Total',
+                                  aggfunc='sum', fill_value=0, observed=True).reset_index()
+    resultado = pd.merge(df_fijos, df_pivot, on='Concatenar', how='left')
+    cols = sorted(c for c in df_pivot.columns if c != 'Concatenar')
+    for col in cols:
+        resultado[col] = resultado[col].fillna(0)
+    resultado['Casa_matriz_Total'] = resultado[cols].sum(axis=1)
+    total = resultado['Casa_matriz_Total'].sum()
+    resultado['Porcentaje_Existencia_CasaMatriz'] = resultado['Casa_matriz_Total'].apply(
+        lambda x: round((x / total) * 100, 2) if total > 0 else 0
+    ).astype(str) + '%'
+    resultado = resultado[resultado['Casa_matriz_Total'] > 0]
+    return resultado[CAMPOS_FIJOS + cols + ['Casa_matriz_Total']]
+
+
+def _cronometrar(nombre: str, funcion, repeticiones: int = 3) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    mejor = min(tiempos)
+    print(f"  {nombre:<38} {mejor * 1000:9.1f} ms")
+    return mejor
+
+
+def main(n_productos: int = 20_000, n_tiendas: int = 40):
+    df = inventario_sintetico(n_productos, n_tiendas)
+    modelo = ModeloInventario.desde_dataframe(df)
+    print(f"Inventario sintético: {len(df):,} filas, {n_productos:,} productos, {n_tiendas} tiendas")
+
+    def _modelo():
+        resultado, columnas = modelo.pivot("Todo", modelo.hechos)
+        return completar_pivot_existencias(resultado, columnas)
+
+    base = _cronometrar("pivot_table + apply (anterior)", lambda: pivot_referencia(df))
+    nuevo = _cronometrar("pivot_existencias (bincount)", lambda: pivot_existencias(df.copy()))
+    mod = _cronometrar("ModeloInventario.pivot (bincount)", _modelo)
+    print(f"  aceleración: x{base / nuevo:.1f} (DataFrame largo), x{base / mod:.1f} (modelo)")
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    main(*argumentos)
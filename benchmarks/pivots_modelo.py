@@ -0,0 +1,214 @@
+# benchmarks/pivots_modelo.py
+# Comprobación de regresión sobre un inventario sintético con productos cuyos
+# campos descriptivos (Nombre, Fecha, CodigoMarca, CodigoSubLinea) varían
+# entre códigos de barras:
+#   - los pivots de DataFrame (pivot_existencias,
+#     pivot_existencias_sucursales_detallado,
+#     pivot_existencias_casa_matriz_filtrado) y el pivot directo de
+#     ModeloInventario, iguales a la implementación anterior con
+#     drop_duplicates + pivot_table (benchmarks/pivot_benchmark.py);
+#   - las vistas derivadas de la matriz maestra y las recalculadas por un
+#     refresco incremental, iguales al pivot directo de cada vista;
+#   - las vistas de aplicar_filtros con el modelo (matriz maestra, filtros
+#     empujados antes del pivot e índice de filtros del pivot cacheado),
+#     iguales a las de los pivots de DataFrame.
+# Termina con código 1 si alguna difiere. Uso:
+#     python -m benchmarks.pivots_modelo [productos] [tiendas]
+import sys
+import pandas as pd
+
+from benchmarks.pivot_benchmark import (
+    inventario_sintetico, pivot_referencia, pivot_referencia_sucursales, pivot_referencia_casa_matriz,
+)
+from components.esquema_inventario import aplicar_esquema
+from components.pivot_existencias import pivot_existencias
+from components.pivot_existencias_casa_matriz_filtrado import pivot_existencias_casa_matriz_filtrado
+from components.pivot_sucursales import pivot_existencias_sucursales_detallado
+from components.services.inventory_service import InventoryService, VISTAS_PIVOT
+
+# (descripción, kwargs de aplicar_filtros)
+CASOS = [
+    ("sin filtros", {}),
+    ("excluir marca", {"exclude_list": ["AB"]}),
+    ("excluir marca variante", {"exclude_list": ["ZZ"]}),
+    ("excluir sublínea variante", {"exclude_sublineas": ["S9"]}),
+    ("referencia", {"referencia": "R000013, R000026, R000070"}),
+    ("solo promoción", {"solo_1": True}),
+    ("sólo duplicados", {"desc_dup_var": True, "filter_mode": "dup"}),
+    ("sin duplicados + marca", {"desc_dup_var": True, "filter_mode": "unique", "exclude_list": ["ZZ"]}),
+]
+AÑOS = (None, 2023)
+
+# vista -> (pivot de DataFrame, implementación anterior)
+PIVOTS = {
+    "Todo": (pivot_existencias, pivot_referencia),
+    "Solo Sucursales": (pivot_existencias_sucursales_detallado, pivot_referencia_sucursales),
+    "Solo Casa Matriz": (pivot_existencias_casa_matriz_filtrado, pivot_referencia_casa_matriz),
+}
+
+
+def inventario_con_variantes(n_productos: int = 2_000, n_tiendas: int = 12) -> pd.DataFrame:
+    """
+    inventario_sintetico con un segundo "código de barras" (filas alternas de
+    un producto) cuyos campos descriptivos difieren del primero.
+    """
+    df = inventario_sintetico(n_productos, n_tiendas)
+    df = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    producto = df['Referencia'].str[1:].astype(int).to_numpy()
+    segunda = df.groupby('Concatenar').cumcount().to_numpy() % 2 == 1
+    cambios = [
+        ('Nombre', 7, df['Nombre'] + " (2)"),
+        ('Fecha', 11, "15/06/2023"),
+        ('CodigoMarca', 13, "ZZ"),
+        ('CodigoSubLinea', 17, "S9"),
+    ]
+    for col, cada, valor in cambios:
+        df[col] = df[col].mask((producto % cada == 0) & segunda, valor)
+    return aplicar_esquema(df)
+
+
+def _servicio(df: pd.DataFrame, con_modelo: bool) -> InventoryService:
+    service = InventoryService(None)
+    service.establecer_dataset(df)
+    if not con_modelo:
+        service._establecer_modelo(None)
+    # sin el hilo de precalentado: cada vista se construye en el momento
+    service.pivot_service.precalentar = lambda *args, **kwargs: None
+    return service
+
+
+def _aplicar(service: InventoryService, opcion: str, exclude_year, kwargs: dict) -> pd.DataFrame:
+    args = dict(region="Todas", referencia="", exclude_list=[], solo_1=False, promo_var=False,
+                desc_dup_var=False, filter_solo_coincide=False, filter_solo_no_coincide=False,
+                filter_mode=None, exclude_year=exclude_year)
+    args.update(kwargs)
+    return _densa(service.aplicar_filtros(opcion, **args))
+
+
+def _densa(vista: pd.DataFrame) -> pd.DataFrame:
+    """`vista` sin índice y con las columnas dispersas (pivot cacheado) como densas: mismo valor."""
+    vista = vista.reset_index(drop=True)
+    dispersas = {c: vista[c].sparse.to_dense() for c in vista.columns
+                 if isinstance(vista[c].dtype, pd.SparseDtype)}
+    return vista.assign(**dispersas) if dispersas else vista
+
+
+def _diferencia(a: pd.DataFrame, b: pd.DataFrame):
+    try:
+        pd.testing.assert_frame_equal(a, b)
+    except AssertionError as e:
+        return str(e).splitlines()[0]
+    return None
+
+
+def _comprobar_pivots(referencia: InventoryService, modelo: InventoryService) -> int:
+    """Pivots sobre la base pre-pivot de cada vista y año; devuelve el número de diferencias."""
+    fallos = 0
+    for opcion, (pivot_df, pivot_anterior) in PIVOTS.items():
+        for año in AÑOS:
+            base = referencia._preparar_base(opcion, año)
+            esperado = pivot_anterior(base).reset_index(drop=True)
+            obtenidos = {
+                "pivot de DataFrame": pivot_df(base),
+                "pivot del modelo": modelo.pivot_service._construir_modelo(
+                    opcion, modelo._preparar_base(opcion, año)),
+            }
+            for nombre, obtenido in obtenidos.items():
+                diferencia = _diferencia(obtenido.reset_index(drop=True), esperado)
+                if diferencia is not None:
+                    fallos += 1
+                    print(f"  DIFIERE {nombre} {opcion} / año {año}: {diferencia}")
+    total = len(PIVOTS) * len(AÑOS) * 2
+    print(f"{total - fallos} de {total} pivots iguales a la implementación anterior")
+    return fallos
+
+
+def _comprobar_derivadas(df: pd.DataFrame, modelo: InventoryService) -> int:
+    """
+    Vistas derivadas de la matriz maestra y vistas cacheadas tras un
+    refresco incremental (aplicar_delta), contra el pivot directo de cada
+    vista; devuelve el número de diferencias.
+    """
+    fallos, total = 0, 0
+
+    def _comparar(nombre, service, opcion, año, obtenido):
+        nonlocal fallos, total
+        total += 1
+        directo = service.pivot_service._construir_modelo(opcion, service._preparar_base(opcion, año))
+        diferencia = _diferencia(_densa(obtenido), _densa(directo))
+        if diferencia is not None:
+            fallos += 1
+            print(f"  DIFIERE {nombre} {opcion} / año {año}: {diferencia}")
+
+    def _vista(service, opcion, año):
+        return service.pivot_service.get_pivot(
+            opcion, None, huella=service._huella_pre_pivot(año),
+            base_maestra=lambda: service._preparar_base("Todo", año))
+
+    # productos cambiados: existencias nuevas y un Nombre distinto en su primera fila
+    texto = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+    cambiados = set(texto['Concatenar'].drop_duplicates().iloc[[7, 13, 14, 77]])
+    en_delta = texto['Concatenar'].isin(cambiados)
+    delta = texto[en_delta].assign(Existencia_Total=texto.loc[en_delta, 'Existencia_Total'] + 3)
+    delta.loc[~delta['Concatenar'].duplicated(), 'Nombre'] = "Producto renombrado"
+    delta = aplicar_esquema(delta.reset_index(drop=True))
+
+    for año in AÑOS:
+        modelo.clear_cache()
+        for opcion in VISTAS_PIVOT:
+            _comparar("matriz maestra", modelo, opcion, año, _vista(modelo, opcion, año))
+
+        refrescado = _servicio(df, con_modelo=True)
+        for opcion in VISTAS_PIVOT:
+            _vista(refrescado, opcion, año)
+        refrescado.aplicar_delta((cambiados, delta, None, None))
+        for opcion in VISTAS_PIVOT:
+            if not refrescado.pivot_service.en_cache(opcion, refrescado._huella_pre_pivot(año)):
+                fallos += 1
+                print(f"  el refresco incremental descartó {opcion} / año {año}")
+            _comparar("refresco incremental", refrescado, opcion, año, _vista(refrescado, opcion, año))
+
+    print(f"{total - fallos} de {total} vistas derivadas iguales al pivot directo")
+    return fallos
+
+
+def _comprobar_vistas(referencia: InventoryService, modelo: InventoryService) -> int:
+    """Vistas de aplicar_filtros con y sin el modelo; devuelve el número de diferencias."""
+    fallos = 0
+    for opcion in VISTAS_PIVOT:
+        for año in AÑOS:
+            for nombre, kwargs in CASOS:
+                esperado = _aplicar(referencia, opcion, año, kwargs)
+                # sin pivot en caché (filtros empujados / matriz maestra) y con
+                # la vista completa en caché (índice de filtros)
+                modelo.clear_cache()
+                for ronda in ("sin caché", "en caché"):
+                    if ronda == "en caché":
+                        _aplicar(modelo, opcion, año, {})
+                    modelo._filtrada = None
+                    diferencia = _diferencia(_aplicar(modelo, opcion, año, kwargs), esperado)
+                    if diferencia is not None:
+                        fallos += 1
+                        print(f"  DIFIERE {opcion} / año {año} / {nombre} / {ronda}: {diferencia}")
+
+    total = len(VISTAS_PIVOT) * len(AÑOS) * len(CASOS) * 2
+    print(f"{total - fallos} de {total} vistas iguales a las de los pivots de DataFrame")
+    return fallos
+
+
+def main(n_productos: int = 2_000, n_tiendas: int = 12) -> int:
+    df = inventario_con_variantes(n_productos, n_tiendas)
+    variantes = df.drop_duplicates(subset=['Concatenar', 'Nombre', 'Fecha', 'CodigoMarca', 'CodigoSubLinea'])
+    print(f"Inventario: {len(df):,} filas, {df['Concatenar'].nunique():,} productos, "
+          f"{len(variantes) - df['Concatenar'].nunique():,} variantes extra")
+
+    referencia = _servicio(df, con_modelo=False)
+    modelo = _servicio(df, con_modelo=True)
+    fallos = (_comprobar_pivots(referencia, modelo) + _comprobar_derivadas(df, modelo)
+              + _comprobar_vistas(referencia, modelo))
+    return 1 if fallos else 0
+
+
+if __name__ == "__main__":
+    argumentos = [int(a) for a in sys.argv[1:3]]
+    sys.exit(main(*argumentos))
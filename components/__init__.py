@@ -0,0 +1,7 @@
+# components/__init__.py
+import pandas as pd
+
+# Los pivots y el pipeline de filtros no hacen copias defensivas: se apoyan en
+# Copy-on-Write (siempre activo desde pandas 3.0; en pandas 2.x se activa aquí).
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
@@ -1,7 +1,10 @@
-from components.pivot_existencias import pivot_existencias
-from components.pivot_sucursales import pivot_existencias_sucursales_detallado
+from components.pivot_existencias import pivot_existencias, completar_pivot_existencias
+from components.pivot_sucursales import pivot_existencias_sucursales_detallado, completar_pivot_sucursales
 from components.pivot_casa_matriz import pivot_existencias_casa_matriz
-from components.pivot_existencias_casa_matriz_filtrado import pivot_existencias_casa_matriz_filtrado
+from components.pivot_existencias_casa_matriz_filtrado import (
+    pivot_existencias_casa_matriz_filtrado,
+    completar_pivot_casa_matriz,
+)
 
 # Expones todo en un solo lugar
 
@@ -9,5 +12,8 @@ __all__ = [
     "pivot_existencias",
     "pivot_existencias_sucursales_detallado",
     "pivot_existencias_casa_matriz",
-    "pivot_existencias_casa_matriz_filtrado"
+    "pivot_existencias_casa_matriz_filtrado",
+    "completar_pivot_existencias",
+    "completar_pivot_sucursales",
+    "completar_pivot_casa_matriz",
 ]
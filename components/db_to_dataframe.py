@@ -1,4 +1,58 @@
+import time
+import threading
+import numbers
+import decimal
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Tamaños por defecto para la lectura por bloques
+CHUNK_FILAS = 50_000      # filas por DataFrame parcial
+FETCH_SIZE = 5_000        # filas por viaje al servidor (cursor.arraysize)
+
+
+class ImportacionCancelada(Exception):
+    """Se lanza cuando una lectura por bloques se aborta con Cancelacion.cancelar()."""
+
+
+class Cancelacion:
+    """
+    Señal de cancelación compartida entre el hilo de la UI y el hilo que lee SQL.
+    `cancelar()` marca la señal y aborta la sentencia en curso (cursor.cancel()).
+    """
+
+    def __init__(self):
+        self._evento = threading.Event()
+        self._cursor = None
+        self._lock = threading.Lock()
+
+    @property
+    def cancelada(self) -> bool:
+        return self._evento.is_set()
+
+    def registrar_cursor(self, cursor):
+        with self._lock:
+            self._cursor = cursor
+        if self.cancelada:
+            self._cancelar_cursor()
+
+    def cancelar(self):
+        self._evento.set()
+        self._cancelar_cursor()
+
+    def verificar(self):
+        if self.cancelada:
+            raise ImportacionCancelada("Importación cancelada por el usuario.")
+
+    def _cancelar_cursor(self):
+        with self._lock:
+            cursor = self._cursor
+        if cursor is not None and hasattr(cursor, "cancel"):
+            try:
+                cursor.cancel()
+            except Exception as e:
+                print(f"[Cancelacion] cursor.cancel() falló: {e}")
+
 
 def cargar_tabla_completa(table_name, engine):
     """
@@ -6,3 +60,189 @@ def cargar_tabla_completa(table_name, engine):
     """
     query = f"SELECT * FROM {table_name}"
     return pd.read_sql(query, con=engine)
+
+
+def leer_sql_por_bloques(query, engine, chunksize=CHUNK_FILAS, fetch_size=FETCH_SIZE, params=None,
+                         cancelacion=None, preparar=None):
+    """
+    Ejecuta `query` con un cursor DBAPI de sólo avance y entrega DataFrames
+    de hasta `chunksize` filas, sin materializar todo el resultado en el cliente.
+
+    En SQL Server (pyodbc) el conjunto de resultados por defecto ya es un
+    cursor de servidor "firehose": las filas se reciben a medida que se leen.
+    `fetch_size` fija `cursor.arraysize`, es decir, cuántas filas se piden por
+    cada `fetchmany()`.
+
+    Con `cancelacion` (Cancelacion) la lectura puede abortarse desde otro hilo:
+    la sentencia en curso se cancela y se lanza ImportacionCancelada.
+
+    `preparar(cursor)` (opcional) se ejecuta en la MISMA conexión antes de la
+    consulta, p. ej. para llenar una tabla temporal que la consulta usa.
+    """
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.arraysize = fetch_size
+        if cancelacion is not None:
+            cancelacion.registrar_cursor(cursor)
+        try:
+            if preparar is not None:
+                preparar(cursor)
+            if params:
+                cursor.execute(query, params)
+            else:
+                cursor.execute(query)
+        except Exception:
+            if cancelacion is not None:
+                cancelacion.verificar()
+            raise
+        columnas = [d[0] for d in cursor.description]
+
+        bloque = []
+        while True:
+            if cancelacion is not None:
+                cancelacion.verificar()
+            try:
+                filas = cursor.fetchmany(fetch_size)
+            except Exception:
+                if cancelacion is not None:
+                    cancelacion.verificar()
+                raise
+            if not filas:
+                break
+            bloque.extend(tuple(f) for f in filas)
+            if len(bloque) >= chunksize:
+                yield pd.DataFrame.from_records(bloque, columns=columnas)
+                bloque = []
+        if bloque:
+            yield pd.DataFrame.from_records(bloque, columns=columnas)
+        cursor.close()
+    finally:
+        raw.close()
+
+
+def inferir_tipos_compactos(df: pd.DataFrame, max_ratio_categorias: float = 0.5) -> dict:
+    """
+    Decide, a partir de un bloque de muestra, el tipo compacto de cada columna:
+      - 'category' para texto con pocas repeticiones distintas
+      - 'integer' / 'float' para numéricos (se reducen con downcast; un
+        'integer' con decimales reales se queda en float)
+    Las columnas no listadas se dejan tal cual.
+    """
+    tipos = {}
+    n = max(len(df), 1)
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_bool_dtype(s):
+            continue
+        if pd.api.types.is_integer_dtype(s):
+            tipos[col] = 'integer'
+        elif pd.api.types.is_float_dtype(s):
+            tipos[col] = 'float'
+        elif s.dtype == object or pd.api.types.is_string_dtype(s):
+            muestra = s.dropna()
+            # DECIMAL/NUMERIC de SQL Server llegan como objetos Decimal
+            if not muestra.empty and isinstance(muestra.iloc[0], (numbers.Number, decimal.Decimal)):
+                tipos[col] = 'integer'
+            elif s.nunique(dropna=True) / n <= max_ratio_categorias:
+                tipos[col] = 'category'
+    return tipos
+
+
+def _a_entero(s: pd.Series, dtype: str) -> pd.Series:
+    """`s` como entero `dtype`; float64 si hay nulos o decimales; sin cambios si no es numérica."""
+    num = pd.to_numeric(s, errors='coerce')
+    if num.isna().sum() > s.isna().sum():
+        return s
+    if pd.api.types.is_bool_dtype(num):
+        return num.astype(dtype)
+    if num.isna().any() or not (num % 1 == 0).all():
+        return num.astype('float64')
+    info = np.iinfo(dtype)
+    if len(num) and (num.min() < info.min or num.max() > info.max):
+        return num.astype('int64')
+    return num.astype(dtype)
+
+
+def compactar_bloque(df: pd.DataFrame, tipos: dict) -> pd.DataFrame:
+    """
+    Convierte un bloque a los tipos compactos decididos por `inferir_tipos_compactos`
+    o declarados en un esquema (ver components/esquema_inventario.py): además de
+    'category' / 'integer' / 'float' admite un dtype entero concreto ('int32'...).
+    'category' sólo se aplica a columnas de texto.
+    """
+    for col, tipo in tipos.items():
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if tipo == 'category':
+            if isinstance(s.dtype, pd.CategoricalDtype):
+                continue
+            if s.dtype == object or pd.api.types.is_string_dtype(s):
+                df[col] = s.astype('category')
+        elif tipo in ('integer', 'float'):
+            df[col] = pd.to_numeric(s, errors='coerce', downcast=tipo)
+        else:
+            df[col] = _a_entero(s, tipo)
+    return df
+
+
+def concatenar_bloques(bloques) -> pd.DataFrame:
+    """
+    Concatena bloques compactos conservando las categóricas
+    (unión de categorías) y el tipo numérico más ancho de cada columna.
+    """
+    bloques = [b for b in bloques if b is not None]
+    if not bloques:
+        return pd.DataFrame()
+    if len(bloques) == 1:
+        return bloques[0].reset_index(drop=True)
+
+    columnas = {}
+    for col in bloques[0].columns:
+        partes = [b[col] for b in bloques]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in partes):
+            columnas[col] = pd.Series(union_categoricals(partes, ignore_order=True), name=col)
+        else:
+            columnas[col] = pd.concat(partes, ignore_index=True)
+    return pd.DataFrame(columnas)
+
+
+def leer_sql_compacto(query, engine, chunksize=CHUNK_FILAS, fetch_size=FETCH_SIZE, params=None,
+                      on_progress=None, cancelacion=None, preparar=None, tipos=None, esquema=None):
+    """
+    Lee `query` por bloques, compacta cada bloque al llegar y devuelve un único
+    DataFrame columnar. `on_progress(filas, filas_por_seg)` se llama tras cada bloque.
+    `tipos` fuerza los tipos compactos (si no, se infieren del primer bloque).
+    `esquema` (dict) prevalece sobre los tipos inferidos para sus columnas.
+    """
+    inicio = time.time()
+    bloques = []
+    filas = 0
+    for bloque in leer_sql_por_bloques(query, engine, chunksize, fetch_size, params, cancelacion, preparar):
+        if tipos is None:
+            tipos = inferir_tipos_compactos(bloque)
+            if esquema:
+                tipos.update({c: t for c, t in esquema.items() if c in bloque.columns})
+        bloques.append(compactar_bloque(bloque, tipos))
+        filas += len(bloque)
+        if on_progress is not None:
+            transcurrido = max(time.time() - inicio, 1e-6)
+            on_progress(filas, filas / transcurrido)
+    return concatenar_bloques(bloques)
+
+
+def tipos_compactos_de(df: pd.DataFrame) -> dict:
+    """Tipos compactos (formato de inferir_tipos_compactos) de un DataFrame ya compacto."""
+    tipos = {}
+    for col in df.columns:
+        dtype = df[col].dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            tipos[col] = 'category'
+        elif pd.api.types.is_bool_dtype(dtype):
+            continue
+        elif pd.api.types.is_integer_dtype(dtype):
+            tipos[col] = dtype.name   # mismo ancho: los bloques nuevos concatenan sin cambiar el tipo
+        elif pd.api.types.is_float_dtype(dtype):
+            tipos[col] = 'float'
+    return tipos
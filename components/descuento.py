@@ -0,0 +1,52 @@
+# components/descuento.py
+# Descuentos como porcentaje entero. INVENTORY_SQL ya los trae como INT; el
+# Excel y el catálogo, como texto ('15%', '15', '15 %'), que se convierte una
+# vez por valor distinto. El formato 'NN%' sólo se aplica al mostrar o
+# exportar (ver utils/formato.py).
+import numpy as np
+import pandas as pd
+
+
+def _distintos(serie: pd.Series):
+    """(códigos por fila, valores distintos) de `serie`; nulos con código -1."""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(), serie.cat.categories
+    return pd.factorize(serie.to_numpy())
+
+
+def porcentajes(serie: pd.Series) -> np.ndarray:
+    """
+    Porcentaje entero (redondeado) de cada valor de `serie` como float64:
+    NaN si está vacío o no es un número.
+    """
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        return serie.to_numpy(dtype=np.float64, na_value=np.nan).round()
+    codigos, valores = _distintos(serie)
+    texto = pd.Series(valores, dtype=object).astype(str).str.replace('%', '', regex=False).str.strip()
+    numeros = pd.to_numeric(texto, errors='coerce').round().to_numpy(dtype=np.float64)
+    return np.append(numeros, np.nan)[codigos]
+
+
+def descuento_entero(serie: pd.Series) -> pd.Series:
+    """
+    `serie` como porcentaje entero (int16; float64 si hay vacíos). Si algún
+    valor no es un número se deja tal cual (se mostrará como texto).
+    """
+    if pd.api.types.is_numeric_dtype(serie.dtype):
+        return serie
+    pct = porcentajes(serie)
+    if np.isnan(pct).sum() > serie.isna().sum():
+        return serie
+    if np.isnan(pct).any() or np.abs(pct).max(initial=0) > np.iinfo(np.int16).max:
+        return pd.Series(pct, index=serie.index, name=serie.name)
+    return pd.Series(pct.astype(np.int16), index=serie.index, name=serie.name)
+
+
+def formatear_porcentajes(pct: np.ndarray) -> np.ndarray:
+    """'NN%' de cada porcentaje (redondeado; object); None donde es NaN."""
+    pct = np.asarray(pct, dtype=np.float64).round()
+    validos = ~np.isnan(pct)
+    out = np.full(len(pct), None, dtype=object)
+    distintos, pos = np.unique(pct[validos], return_inverse=True)
+    out[validos] = np.array([f"{int(v)}%" for v in distintos], dtype=object)[pos]
+    return out
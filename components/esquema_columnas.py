@@ -0,0 +1,104 @@
+# components/esquema_columnas.py
+# Roles semánticos de las columnas de un DataFrame (existencia, año/fecha,
+# sublínea, total de Casa Matriz, promoción, descuento) resueltos a sus
+# nombres reales. Los encabezados varían entre SQL y Excel, así que se
+# comparan normalizados; la resolución se hace una vez por esquema (tupla
+# de columnas) y queda en caché: detectar columnas no cuesta nada en el
+# camino interactivo.
+import unicodedata
+from functools import lru_cache
+from typing import Optional
+
+# Existencia/stock "base" (pre-pivot), en orden de prioridad (nombre normalizado)
+PRIORIDAD_EXISTENCIA = [
+    "existenciatotal", "existencia",
+    "stocktotal", "stock",
+    "cantidadtotal", "cantidad",
+    "inventariototal", "inventario",
+]
+CLAVES_EXISTENCIA = ("existencia", "stock", "cantidad", "inventario")
+
+# Nombres (strip + lower) aceptados para la columna de sublínea
+CANDIDATOS_SUBLINEA = ["codigosublinea", "codsublinea", "sublinea", "codigo_sublinea"]
+
+# Columna de año numérico / de fecha (strip + lower)
+NOMBRES_ANIO = ("año", "anio", "year")
+NOMBRES_FECHA = ("fechadoc", "date", "fecharegistro")
+
+
+def normalizar_nombre(s) -> str:
+    """Nombre de columna en minúsculas, sin espacios, guiones bajos ni acentos."""
+    if s is None:
+        return ""
+    s = str(s).strip().lower().replace(" ", "").replace("_", "")
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(ch for ch in s if not unicodedata.combining(ch))
+
+
+class EsquemaColumnas:
+    """
+    Columna real de cada rol (None si el esquema no la tiene):
+
+      existencia         existencia/stock/cantidad/inventario (prioridad
+                         exacta, luego por contiene)
+      anio               año numérico ('Año' / 'Anio' / 'Year')
+      fechas             candidatas de fecha por nombre, en orden
+      sublinea           CodigoSubLinea / CodSubLinea / SubLinea
+      total_casa_matriz  columna de pivot estilo 'Casa_matriz_Total'
+      promocion          Promocion
+      descuento          Descuento
+    """
+
+    def __init__(self, columnas: tuple):
+        self.columnas = columnas
+        normalizados = [normalizar_nombre(c) for c in columnas]
+        minusculas = [str(c).strip().lower() for c in columnas]
+
+        self.existencia = None
+        for buscado in PRIORIDAD_EXISTENCIA:
+            self.existencia = self._primera(columnas, normalizados, lambda n: n == buscado)
+            if self.existencia is not None:
+                break
+        if self.existencia is None:
+            self.existencia = self._primera(
+                columnas, normalizados, lambda n: any(k in n for k in CLAVES_EXISTENCIA))
+
+        self.anio = None
+        for buscado in NOMBRES_ANIO:
+            self.anio = self._primera(columnas, minusculas, lambda n: n == buscado)
+            if self.anio is not None:
+                break
+        self.fechas = [c for c, n in zip(columnas, minusculas) if "fecha" in n or n in NOMBRES_FECHA]
+
+        self.sublinea = self._primera(columnas, minusculas, lambda n: n in CANDIDATOS_SUBLINEA)
+        self.total_casa_matriz = self._primera(columnas, normalizados, lambda n: (
+            n in ("casamatriztotal", "totalcasamatriz")
+            or (n.startswith("casamatriz") and any(k in n for k in ("total",) + CLAVES_EXISTENCIA))
+        ))
+        self.promocion = self._canonica(columnas, normalizados, "Promocion")
+        self.descuento = self._canonica(columnas, normalizados, "Descuento")
+
+    @staticmethod
+    def _primera(columnas, nombres, condicion) -> Optional[str]:
+        for col, nombre in zip(columnas, nombres):
+            if condicion(nombre):
+                return col
+        return None
+
+    @classmethod
+    def _canonica(cls, columnas, normalizados, nombre: str) -> Optional[str]:
+        """`nombre` si está tal cual; si no, la primera columna que coincide normalizada."""
+        if nombre in columnas:
+            return nombre
+        buscado = normalizar_nombre(nombre)
+        return cls._primera(columnas, normalizados, lambda n: n == buscado)
+
+
+@lru_cache(maxsize=64)
+def _resolver(columnas: tuple) -> EsquemaColumnas:
+    return EsquemaColumnas(columnas)
+
+
+def resolver_esquema(columnas) -> EsquemaColumnas:
+    """EsquemaColumnas de `columnas` (df.columns), calculado una vez por esquema."""
+    return _resolver(tuple(columnas))
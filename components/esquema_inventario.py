@@ -0,0 +1,53 @@
+# components/esquema_inventario.py
+# Tipos declarados de las columnas de INVENTORY_SQL (y del Excel equivalente).
+#
+#  - 'category': texto que se repite en cada fila de tienda (marcas, regiones,
+#    tiendas, categorías...). Concatenar/Referencia también se repiten una vez
+#    por tienda, así que categóricas ocupan bastante menos que objetos str.
+#  - enteros de numpy: existencias, flags y Descuento (porcentaje entero);
+#    si la columna trae nulos o decimales reales se deja en float64.
+from components.db_to_dataframe import compactar_bloque
+from components.descuento import descuento_entero
+
+ESQUEMA_INVENTARIO = {
+    'Concatenar': 'category',
+    'Referencia': 'category',
+    'CodigoBarra': 'category',
+    'NombreMarca': 'category',
+    'CodigoMarca': 'category',
+    'Nombre': 'category',
+    'Fabricante': 'category',
+    'CodigoSubLinea': 'category',
+    'Linea': 'category',
+    'NombreCategoriaPrincipal': 'category',
+    'NombreCategoria': 'category',
+    'Descuento': 'int16',
+    'Encargado': 'category',
+    'Region': 'category',
+    'NombreTienda': 'category',
+    'Status': 'category',
+    'Fecha': 'category',
+    'Existencia_Total': 'int32',
+    'Existencia_Total_CasaMatriz': 'int32',
+    'Existencia_Total_Sucursales': 'int32',
+    'Promocion': 'int8',
+    'dimID_Tienda': 'int32',
+}
+
+
+def aplicar_esquema(df, esquema=ESQUEMA_INVENTARIO):
+    """
+    Convierte in-place las columnas de `df` presentes en `esquema` y devuelve df.
+    Las columnas que no admiten el tipo (p. ej. texto en una columna numérica
+    de un Excel) se dejan como están. Descuento en texto ('15%') pasa a entero.
+    """
+    if 'Descuento' in df.columns:
+        df['Descuento'] = descuento_entero(df['Descuento'])
+    return compactar_bloque(df, esquema)
+
+
+def uso_memoria_mb(df) -> float:
+    """Memoria de `df` en MB (deep=True: incluye los objetos str)."""
+    if df is None:
+        return 0.0
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
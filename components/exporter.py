@@ -4,6 +4,7 @@ from reportlab.lib.pagesizes import letter, landscape
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet
+from utils.formato import formatear_para_vista
 
 
 def exportar_dataframe_a_excel(df):
@@ -21,7 +22,7 @@ def exportar_dataframe_a_excel(df):
             title="Guardar como"
         )
         if ruta:
-            df.to_excel(ruta, index=False)
+            formatear_para_vista(df).to_excel(ruta, index=False)
             messagebox.showinfo("Exportación", f"Datos exportados correctamente a:\n{ruta}")
     except Exception as e:
         messagebox.showerror("Error", f"No se pudo exportar a Excel:\n{e}")
@@ -56,6 +57,8 @@ def export_pdfs_por_sucursal(df, selected_columns, nombre_archivo=None):
             messagebox.showwarning("Exportación cancelada", "No se seleccionó archivo para guardar PDF.")
             return
 
+    df = formatear_para_vista(df)
+
     print("=== Exportador: columnas para exportar ===")
     print(selected_columns)
     print("Primeras filas de datos:")
@@ -0,0 +1,287 @@
+# components/modelo_inventario.py
+import numpy as np
+import pandas as pd
+from components.campofijos import CAMPOS_FIJOS
+from components.pivot_engine import factorizar, suma_por_celda, matriz_a_columnas
+
+# Campos que varían por tienda dentro de un mismo producto
+CAMPOS_HECHO = ['Existencia_Total', 'Descuento', 'Promocion']
+# Atributos descriptivos del producto. Pueden variar entre las filas de un
+# mismo Concatenar (p. ej. Nombre o Fecha por código de barras): cada
+# combinación distinta es una variante
+CAMPOS_PRODUCTO = [c for c in CAMPOS_FIJOS if c not in CAMPOS_HECHO]
+CAMPOS_TIENDA = ['Region', 'NombreTienda']
+COLUMNAS_REQUERIDAS = CAMPOS_FIJOS + CAMPOS_TIENDA + ['Existencia_Total']
+
+
+class ModeloInventario:
+    """
+    Inventario normalizado en dimensiones + hechos, con claves enteras:
+
+      claves     pd.Index: producto_id -> Concatenar (str)
+      variantes  DataFrame indexado por variante_id: cada combinación
+                 distinta de CAMPOS_PRODUCTO (primera fila de cada una) y
+                 su producto_id
+      productos  DataFrame indexado por producto_id con CAMPOS_PRODUCTO de
+                 su primera variante
+      uniformes  columnas de CAMPOS_PRODUCTO con un solo valor por producto
+                 (en ellas `productos` vale para todas sus filas)
+      tiendas    DataFrame indexado por tienda_id con Region, NombreTienda
+      hechos     DataFrame delgado, una fila por fila del inventario:
+                 producto_id (int32), variante_id (int32), tienda_id (int32),
+                 Existencia_Total, Descuento, Promocion
+
+    Los pivots trabajan sobre `hechos` y sólo al final se unen los campos
+    descriptivos de `variantes`.
+    """
+
+    def __init__(self, claves: pd.Index, variantes: pd.DataFrame, productos: pd.DataFrame,
+                 uniformes: tuple, tiendas: pd.DataFrame, hechos: pd.DataFrame):
+        self.claves = claves
+        self.variantes = variantes
+        self.productos = productos
+        self.uniformes = uniformes
+        self.tiendas = tiendas
+        self.hechos = hechos
+
+    # -----------------------
+    # Construcción
+    # -----------------------
+    @classmethod
+    def desde_dataframe(cls, df: pd.DataFrame, previo: "ModeloInventario" = None):
+        """
+        Normaliza `df` (formato INVENTORY_SQL). Devuelve None si faltan columnas.
+        Con `previo` se conservan sus producto_id (los productos nuevos se
+        agregan al final), de modo que los pivots cacheados siguen siendo válidos.
+        """
+        if df is None or any(c not in df.columns for c in COLUMNAS_REQUERIDAS):
+            return None
+
+        conc = df['Concatenar'].astype('category')
+        codigos = conc.cat.codes.to_numpy()
+        nombres = pd.Index(conc.cat.categories.astype(str))
+        validos = codigos >= 0
+
+        # claves en orden de primera aparición (igual que drop_duplicates)
+        claves = previo.claves if previo is not None else pd.Index([], dtype=object)
+        aparicion = nombres[pd.unique(codigos[validos])]
+        nuevas = aparicion[claves.get_indexer(aparicion) < 0]
+        claves = claves.append(nuevas)
+        pos = claves.get_indexer(nombres).astype('int32')
+        filas = np.flatnonzero(validos)
+        producto_id = pos[codigos[filas]]
+
+        # variantes: combinaciones distintas de CAMPOS_PRODUCTO en orden de
+        # primera aparición (lo que conserva drop_duplicates sobre CAMPOS_FIJOS)
+        variante_id, primera_v = cls._combinaciones(df, filas, CAMPOS_PRODUCTO)
+        variantes = df[CAMPOS_PRODUCTO].iloc[filas[primera_v]]
+        variantes.index = pd.RangeIndex(len(primera_v), name='variante_id')
+        variantes['producto_id'] = producto_id[primera_v]
+
+        # dimensión producto: primera variante de cada producto_id
+        ids, primera = np.unique(variantes['producto_id'].to_numpy(), return_index=True)
+        productos = variantes[CAMPOS_PRODUCTO].iloc[primera]
+        productos.index = pd.Index(ids, name='producto_id')
+        productos = productos.reindex(pd.RangeIndex(len(claves), name='producto_id'))
+        uniformes = cls._uniformes(variantes, len(ids))
+
+        # dimensión tienda: pares (Region, NombreTienda)
+        region = df['Region'].astype('category')
+        tienda = df['NombreTienda'].astype('category')
+        par = (region.cat.codes.to_numpy().astype('int64') * (len(tienda.cat.categories) + 1)
+               + tienda.cat.codes.to_numpy())
+        tienda_id, unicos = pd.factorize(par[filas])
+        primera_t = pd.Series(np.arange(len(filas))).groupby(tienda_id).first().to_numpy()
+        tiendas = pd.DataFrame({
+            'Region': df['Region'].iloc[filas[primera_t]].astype(str).to_numpy(),
+            'NombreTienda': df['NombreTienda'].iloc[filas[primera_t]].astype(str).to_numpy(),
+        }, index=pd.RangeIndex(len(unicos), name='tienda_id'))
+
+        hechos = pd.DataFrame({'producto_id': producto_id, 'variante_id': variante_id.astype('int32'),
+                               'tienda_id': tienda_id.astype('int32')})
+        for col in CAMPOS_HECHO:
+            hechos[col] = df[col].iloc[filas].array
+        return cls(claves, variantes, productos, uniformes, tiendas, hechos)
+
+    @staticmethod
+    def _combinaciones(df: pd.DataFrame, filas: np.ndarray, columnas: list):
+        """
+        (código de la combinación de `columnas` de cada fila de `filas`,
+        posición de su primera aparición). Los nulos son un valor más, como
+        en drop_duplicates. Los códigos por columna se combinan en base mixta
+        y sólo se vuelven a factorizar cuando el int64 se desbordaría.
+        """
+        sel = slice(None) if len(filas) == len(df) else filas
+        codigo = np.zeros(len(filas), dtype=np.int64)
+        rango = 1   # codigo < rango
+        for col in columnas:
+            serie = df[col]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                cod, n = serie.cat.codes.to_numpy()[sel].astype(np.int64) + 1, len(serie.cat.categories) + 1
+            else:
+                cod, valores = pd.factorize(serie.to_numpy()[sel], use_na_sentinel=False)
+                n = max(len(valores), 1)
+            if rango * n >= 2 ** 62:
+                codigo, unicos = pd.factorize(codigo)
+                rango = max(len(unicos), 1)
+            codigo = codigo * n + cod
+            rango *= n
+        codigo, _ = pd.factorize(codigo)
+        # los códigos de factorize siguen el orden de primera aparición
+        primera = np.flatnonzero(~pd.Series(codigo).duplicated().to_numpy())
+        return codigo, primera
+
+    @staticmethod
+    def _uniformes(variantes: pd.DataFrame, n_productos: int) -> tuple:
+        """Columnas de CAMPOS_PRODUCTO con un solo valor en todas las variantes de cada producto."""
+        if len(variantes) == n_productos:
+            return tuple(CAMPOS_PRODUCTO)
+        por_producto = variantes.groupby('producto_id', sort=False)[CAMPOS_PRODUCTO].nunique(dropna=False)
+        return tuple(c for c in CAMPOS_PRODUCTO if (por_producto[c] <= 1).all())
+
+    # -----------------------
+    # Consultas
+    # -----------------------
+    def ids_de(self, concatenar) -> np.ndarray:
+        """producto_id de los Concatenar dados (los desconocidos se omiten)."""
+        pos = self.claves.get_indexer(pd.Index([str(c) for c in concatenar]))
+        return pos[pos >= 0]
+
+    def tiendas_de_region(self, texto: str) -> np.ndarray:
+        """tienda_id cuya Region contiene `texto` ('Sucursales', 'Casa Matriz')."""
+        mask = self.tiendas['Region'].str.contains(texto, na=False).to_numpy()
+        return self.tiendas.index.to_numpy()[mask]
+
+    def etiquetas_tienda(self, opcion: str) -> pd.Series:
+        """Etiqueta de columna de cada tienda_id en el pivot de `opcion`."""
+        if opcion == "Solo Sucursales":
+            return self.tiendas['NombreTienda']
+        if opcion == "Solo Casa Matriz":
+            return self.tiendas['Region']
+        return self.tiendas['Region'] + ' - ' + self.tiendas['NombreTienda']
+
+    # -----------------------
+    # Pivot
+    # -----------------------
+    def hechos_de_vista(self, opcion: str, hechos: pd.DataFrame) -> pd.DataFrame:
+        """Filas de `hechos` que entran en la vista `opcion` (por región de la tienda)."""
+        if opcion == "Solo Sucursales":
+            return hechos[hechos['tienda_id'].isin(self.tiendas_de_region('Sucursales'))]
+        if opcion == "Solo Casa Matriz":
+            return hechos[hechos['tienda_id'].isin(self.tiendas_de_region('Casa Matriz'))]
+        return hechos
+
+    def pivot(self, opcion: str, hechos: pd.DataFrame, perfil: tuple = None):
+        """
+        Pivot de `hechos` (ya recortados por región/año y normalizados) para la
+        vista `opcion`. Devuelve (resultado, columnas_tienda): CAMPOS_FIJOS +
+        una columna de existencia por etiqueta, indexado por producto_id, listo
+        para completar_pivot_*.
+
+        Con `perfil` (ver perfil_vista) `hechos` puede ser un subconjunto de
+        productos de la vista: columnas y tipos salen como en el pivot completo.
+        """
+        return self.pivot_desde_maestra(opcion, self.matriz_maestra(hechos), hechos, perfil)
+
+    def perfil_vista(self, opcion: str, hechos: pd.DataFrame) -> tuple:
+        """
+        (tienda_id de la vista, ¿el pivot completo tiene celdas vacías?) para
+        los `hechos` de TODA la vista. Es lo que un pivot sobre una parte de
+        los productos no puede deducir por sí solo.
+        """
+        tienda_id = hechos['tienda_id'].to_numpy()
+        tiendas = np.flatnonzero(np.bincount(tienda_id, minlength=len(self.tiendas)))
+        if len(tiendas) == 0:
+            return tiendas, False
+        grupo, etiquetas = factorizar(self.etiquetas_tienda(opcion).to_numpy()[tiendas])
+        producto_id = hechos['producto_id'].to_numpy()
+        celdas = np.count_nonzero(np.bincount(producto_id)) * len(etiquetas)
+        if len(hechos) < celdas:
+            return tiendas, True   # menos filas que celdas: seguro hay vacías
+        grupo_de = np.full(len(self.tiendas), -1, dtype=np.int64)
+        grupo_de[tiendas] = grupo
+        pares = producto_id.astype(np.int64) * len(etiquetas) + grupo_de[tienda_id]
+        return tiendas, len(np.unique(pares)) < celdas
+
+    def matriz_maestra(self, hechos: pd.DataFrame) -> "MatrizMaestra":
+        """Matriz producto x tienda (todas las tiendas) de la suma de existencias."""
+        filas_cod, ids = pd.factorize(hechos['producto_id'].to_numpy())
+        suma, presentes = suma_por_celda(
+            filas_cod, hechos['tienda_id'].to_numpy(),
+            hechos['Existencia_Total'].to_numpy(dtype=np.float64, na_value=np.nan),
+            len(ids), len(self.tiendas),
+        )
+        return MatrizMaestra(hechos, pd.Index(ids), suma, presentes > 0, hechos['Existencia_Total'].dtype)
+
+    def pivot_desde_maestra(self, opcion: str, maestra: "MatrizMaestra", hechos_vista: pd.DataFrame = None,
+                            perfil: tuple = None):
+        """
+        Deriva la vista `opcion` de la matriz maestra: se toman las columnas de
+        las tiendas de la región y se suman por etiqueta (NombreTienda en
+        Sucursales, Region en Casa Matriz). Ver `pivot` para el resultado.
+        """
+        if hechos_vista is None:
+            hechos_vista = self.hechos_de_vista(opcion, maestra.hechos)
+
+        # tiendas de la vista y su grupo de columna (etiquetas en orden alfabético)
+        if perfil is None:
+            tiendas, con_vacias = np.unique(hechos_vista['tienda_id'].to_numpy()), None
+        else:
+            tiendas, con_vacias = perfil
+        grupo, etiquetas = factorizar(self.etiquetas_tienda(opcion).to_numpy()[tiendas])
+        uno = np.zeros((len(tiendas), len(etiquetas)))
+        uno[np.arange(len(tiendas)), grupo] = 1.0
+        suma = maestra.suma[:, tiendas] @ uno
+        presentes = maestra.presentes[:, tiendas] @ uno
+        fill_value = 0 if opcion == "Solo Casa Matriz" else None
+        columnas = [str(e) for e in np.asarray(etiquetas)]
+
+        resultado = self._fijos(opcion, hechos_vista)
+        filas = maestra.ids.get_indexer(resultado.index.to_numpy())
+        valores = matriz_a_columnas(suma[filas], presentes[filas], maestra.dtype, fill_value, con_vacias)
+        existencias = pd.DataFrame(valores, index=resultado.index, columns=columnas)
+        return pd.concat([resultado, existencias], axis=1), columnas
+
+    def _fijos(self, opcion: str, hechos: pd.DataFrame) -> pd.DataFrame:
+        """
+        CAMPOS_FIJOS de la vista, indexados por producto_id: 'Todo' toma la
+        primera fila por producto (drop_duplicates por Concatenar); las demás
+        vistas, las combinaciones distintas de CAMPOS_FIJOS (variante +
+        Descuento/Promocion), como drop_duplicates() sobre las filas.
+        """
+        if opcion not in ("Solo Sucursales", "Solo Casa Matriz"):
+            fijos = hechos.drop_duplicates(subset=['producto_id'])
+        else:
+            fijos = hechos.drop_duplicates(subset=['variante_id', 'Descuento', 'Promocion'])
+        ids = fijos['producto_id'].to_numpy()
+        variante = fijos['variante_id'].to_numpy()
+
+        resultado = pd.DataFrame(index=pd.Index(ids, name='producto_id'))
+        for col in CAMPOS_FIJOS:
+            origen = fijos[col] if col in CAMPOS_HECHO else self.variantes[col].take(variante)
+            resultado[col] = origen.array
+        return resultado
+
+
+class MatrizMaestra:
+    """
+    Pivot maestro producto x tienda de un conjunto de hechos: de él se derivan
+    las tres vistas por selección y suma de columnas.
+
+      hechos     hechos de origen (todas las regiones)
+      ids        producto_id de cada fila de la matriz
+      suma       float64 (productos x tiendas), 0 en celdas vacías
+      presentes  bool: la celda tiene al menos una fila de origen
+    """
+
+    def __init__(self, hechos: pd.DataFrame, ids: pd.Index, suma: np.ndarray, presentes: np.ndarray, dtype):
+        self.hechos = hechos
+        self.ids = ids
+        self.suma = suma
+        self.presentes = presentes
+        self.dtype = dtype
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.suma.nbytes + self.presentes.nbytes
+                   + self.hechos.memory_usage(deep=True).sum())
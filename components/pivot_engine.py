@@ -0,0 +1,100 @@
+# components/pivot_engine.py
+# Motor de pivot "suma por celda" con NumPy: factoriza filas y columnas una
+# vez y acumula con np.bincount sobre el código combinado fila*n_cols + col.
+# Reproduce pivot_table(aggfunc='sum') (con o sin fill_value) sin el costo
+# del groupby/unstack de pandas.
+import numpy as np
+import pandas as pd
+
+
+def factorizar(valores):
+    """(códigos, etiquetas) ordenadas como pivot_table; los nulos quedan en -1."""
+    return pd.factorize(valores, sort=True)
+
+
+def suma_por_celda(filas, columnas, valores, n_filas: int, n_columnas: int):
+    """
+    Devuelve (suma, presentes): matrices n_filas x n_columnas con la suma de
+    `valores` por celda (float64, nulos = 0) y cuántas filas cayeron en cada una.
+    Las filas con código < 0 en `filas` o `columnas` se ignoran.
+    """
+    filas = np.asarray(filas, dtype=np.int64)
+    columnas = np.asarray(columnas, dtype=np.int64)
+    validos = (filas >= 0) & (columnas >= 0)
+    celda = filas[validos] * n_columnas + columnas[validos]
+    pesos = np.asarray(valores, dtype=np.float64)[validos]
+    pesos = np.where(np.isnan(pesos), 0.0, pesos)
+    tam = n_filas * n_columnas
+    suma = np.bincount(celda, weights=pesos, minlength=tam).reshape(n_filas, n_columnas)
+    presentes = np.bincount(celda, minlength=tam).reshape(n_filas, n_columnas)
+    return suma, presentes
+
+
+def matriz_a_columnas(suma, presentes, dtype, fill_value=None, con_vacias: bool = None):
+    """
+    Convierte la matriz de suma_por_celda a columnas con los tipos de
+    pivot_table: celdas vacías -> NaN (float64) salvo `fill_value`; sin
+    celdas vacías (o con fill_value) se conserva el tipo entero de origen.
+    `con_vacias` fuerza esa decisión (p. ej. cuando la matriz es un recorte
+    de filas de un pivot mayor). Devuelve un array 2D.
+    """
+    vacias = presentes == 0
+    entero = np.issubdtype(np.dtype(dtype), np.integer)
+    if fill_value is not None:
+        out = np.where(vacias, fill_value, suma)
+        return out.astype(dtype) if entero else out
+    if con_vacias is None:
+        con_vacias = bool(vacias.any())
+    if con_vacias:
+        return np.where(vacias, np.nan, suma)
+    return suma.astype(dtype) if entero else suma
+
+
+def pivot_suma(df: pd.DataFrame, index: str, columns: str, values: str, fill_value=None) -> pd.DataFrame:
+    """
+    Equivalente a
+        df.pivot_table(index=index, columns=columns, values=values,
+                       aggfunc='sum', fill_value=fill_value, observed=True)
+          .reset_index()
+    con las etiquetas de columna como str.
+    """
+    cod_f, etq_f = factorizar(df[index])
+    cod_c, etq_c = factorizar(df[columns])
+    suma, presentes = suma_por_celda(cod_f, cod_c, df[values].to_numpy(dtype=np.float64, na_value=np.nan),
+                                     len(etq_f), len(etq_c))
+    # como pivot_table: sólo filas/columnas con al menos una fila de origen
+    con_f = presentes.any(axis=1)
+    con_c = presentes.any(axis=0)
+    if not (con_f.all() and con_c.all()):
+        suma, presentes = suma[con_f][:, con_c], presentes[con_f][:, con_c]
+        etq_f, etq_c = etq_f[con_f], etq_c[con_c]
+    matriz = matriz_a_columnas(suma, presentes, df[values].dtype, fill_value)
+
+    out = pd.DataFrame(matriz, columns=pd.Index(etq_c).astype(str))
+    out.insert(0, index, etq_f)
+    return out
+
+
+def a_disperso(df: pd.DataFrame, columnas, densidad_max: float = 0.2) -> pd.DataFrame:
+    """
+    Convierte las `columnas` de existencia (ya sin NaN) a pd.SparseDtype con
+    fill_value=0 cuando su proporción de celdas distintas de 0 es menor a
+    `densidad_max`. Filtrar filas, sumar y mostrar funciona igual sobre ellas.
+    Cada celda guardada ocupa valor + índice int32: con densidad 0.5 una
+    columna apenas ahorra memoria y sí encarece cada filtrado.
+    """
+    if df is None or df.empty:
+        return df
+    convertidas = {}
+    for col in columnas:
+        s = df[col]
+        if isinstance(s.dtype, pd.SparseDtype) or not pd.api.types.is_numeric_dtype(s):
+            continue
+        valores = s.to_numpy()
+        if np.isnan(valores).any() if valores.dtype.kind == 'f' else False:
+            continue
+        if np.count_nonzero(valores) < densidad_max * len(valores):
+            convertidas[col] = pd.arrays.SparseArray(valores, fill_value=0)
+    if not convertidas:
+        return df
+    return df.assign(**convertidas)
@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
 from components.campofijos import CAMPOS_FIJOS
+from components.pivot_engine import pivot_suma
 
 def pivot_existencias(df):
     columnas_necesarias = CAMPOS_FIJOS + ['Region', 'NombreTienda', 'Existencia_Total']
@@ -14,22 +16,37 @@ def pivot_existencias(df):
     df_fijos = df[CAMPOS_FIJOS].drop_duplicates(subset=['Concatenar'])
     # ------------------------------------------------
 
-    # Crear columna única por tienda detallada
-    df['NombreTiendaDetallado'] = df['Region'] + ' - ' + df['NombreTienda']
+    # Columna única por tienda detallada (sin modificar `df`, que puede estar cacheado)
+    detallado = df.assign(NombreTiendaDetallado=df['Region'].astype(str) + ' - ' + df['NombreTienda'].astype(str))
 
     # Pivot detallado por tienda y región combinadas
-    df_pivot = df.pivot_table(
-        index='Concatenar',
-        columns='NombreTiendaDetallado',
-        values='Existencia_Total',
-        aggfunc='sum'
-    ).reset_index()
+    df_pivot = pivot_suma(detallado, index='Concatenar', columns='NombreTiendaDetallado', values='Existencia_Total')
 
     resultado = pd.merge(df_fijos, df_pivot, on='Concatenar', how='left')
 
+    columnas_tienda = [col for col in df_pivot.columns if col != 'Concatenar']
+    return completar_pivot_existencias(resultado, columnas_tienda)
+
+
+def _porcentaje(parte, total, valido):
+    """round(parte / total * 100, 2) donde `valido`, 0 en el resto (como el apply por fila)."""
+    pct = np.round(parte / total * 100, 2)
+    if not valido.all():
+        if not valido.any():
+            return np.zeros(len(parte), dtype=np.int64)
+        pct = np.where(valido, pct, 0.0)
+    return pct
+
+
+def completar_pivot_existencias(resultado, columnas_tienda):
+    """
+    Totales, porcentajes, orden de columnas y filtrado final del pivot "Todo"
+    a partir de CAMPOS_FIJOS + una columna de existencia por tienda
+    ('Region - NombreTienda'). Lo usan el pivot de pandas y el del servidor.
+    """
     # Separar columnas de casa matriz y sucursales
-    casas_matriz_cols = [col for col in df_pivot.columns if 'Casa Matriz' in str(col)]
-    sucursales_cols   = [col for col in df_pivot.columns if 'Sucursales'   in str(col)]
+    casas_matriz_cols = [col for col in columnas_tienda if 'Casa Matriz' in str(col)]
+    sucursales_cols   = [col for col in columnas_tienda if 'Sucursales'   in str(col)]
 
     casas_matriz_cols.sort()
     sucursales_cols.sort()
@@ -41,16 +58,15 @@ def pivot_existencias(df):
         resultado['Casa_matriz_Total'] + resultado['Sucursal_Total']
     )
 
-    # Calcular porcentajes
-    resultado['Porcentaje_Existencia_CasaMatriz'] = resultado.apply(
-        lambda row: round((row['Casa_matriz_Total'] / row['Total_Existencia']) * 100, 2)
-        if row['Total_Existencia'] > 0 else 0,
-        axis=1
+    # Calcular porcentajes (0 si no hay existencia total)
+    total = resultado['Total_Existencia'].to_numpy(dtype=float)
+    hay_total = total > 0
+    divisor = np.where(hay_total, total, 1.0)
+    resultado['Porcentaje_Existencia_CasaMatriz'] = _porcentaje(
+        resultado['Casa_matriz_Total'].to_numpy(dtype=float), divisor, hay_total
     )
-    resultado['Porcentaje_Existencia_Sucursales'] = resultado.apply(
-        lambda row: round((row['Sucursal_Total'] / row['Total_Existencia']) * 100, 2)
-        if row['Total_Existencia'] > 0 else 0,
-        axis=1
+    resultado['Porcentaje_Existencia_Sucursales'] = _porcentaje(
+        resultado['Sucursal_Total'].to_numpy(dtype=float), divisor, hay_total
     )
 
     # Añadir símbolo '%'
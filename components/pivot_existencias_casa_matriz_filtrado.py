@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
 from components.campofijos import CAMPOS_FIJOS
+from components.pivot_engine import pivot_suma
 
 def pivot_existencias_casa_matriz_filtrado(df):
     columnas_necesarias = CAMPOS_FIJOS + ['Region', 'Existencia_Total']
@@ -14,18 +16,20 @@ def pivot_existencias_casa_matriz_filtrado(df):
 
     df_fijos = matriz[CAMPOS_FIJOS].drop_duplicates()
 
-    df_pivot = matriz.pivot_table(
-        index='Concatenar',
-        columns='Region',
-        values='Existencia_Total',
-        aggfunc='sum',
-        fill_value=0
-    ).reset_index()
+    df_pivot = pivot_suma(matriz, index='Concatenar', columns='Region', values='Existencia_Total', fill_value=0)
 
     resultado = pd.merge(df_fijos, df_pivot, on='Concatenar', how='left')
 
     casas_matriz_cols = [col for col in df_pivot.columns if col != 'Concatenar']
-    casas_matriz_cols.sort()
+    return completar_pivot_casa_matriz(resultado, casas_matriz_cols)
+
+
+def completar_pivot_casa_matriz(resultado, casas_matriz_cols):
+    """
+    Rellena, totaliza y ordena el pivot "Solo Casa Matriz" a partir de
+    CAMPOS_FIJOS + una columna de existencia por región de casa matriz.
+    """
+    casas_matriz_cols = sorted(casas_matriz_cols)
 
     for col in casas_matriz_cols:
         resultado[col] = resultado[col].fillna(0)
@@ -36,12 +40,14 @@ def pivot_existencias_casa_matriz_filtrado(df):
     total_global_casa_matriz = resultado['Casa_matriz_Total'].sum()
 
     # Calcula el porcentaje sobre el total global (aunque después filtres)
-    resultado['Porcentaje_Existencia_CasaMatriz'] = resultado['Casa_matriz_Total'].apply(
-        lambda x: round((x / total_global_casa_matriz) * 100, 2) if total_global_casa_matriz > 0 else 0
-    ).astype(str) + '%'
+    if total_global_casa_matriz > 0:
+        pct = np.round(resultado['Casa_matriz_Total'].to_numpy(dtype=float) / total_global_casa_matriz * 100, 2)
+    else:
+        pct = np.zeros(len(resultado), dtype=np.int64)
+    resultado['Porcentaje_Existencia_CasaMatriz'] = pd.Series(pct, index=resultado.index).astype(str) + '%'
 
     # Ahora sí, filtras los que tienen existencia > 0
-    resultado = resultado[resultado['Casa_matriz_Total'] > 0].copy()
+    resultado = resultado[resultado['Casa_matriz_Total'] > 0]
 
     columnas_ordenadas = CAMPOS_FIJOS + casas_matriz_cols + ['Casa_matriz_Total']
 
@@ -1,5 +1,6 @@
 import pandas as pd
 from components.campofijos import CAMPOS_FIJOS
+from components.pivot_engine import pivot_suma
 
 def pivot_existencias_sucursales_detallado(df):
     columnas_necesarias = CAMPOS_FIJOS + ['Region', 'NombreTienda', 'Existencia_Total']
@@ -14,14 +15,20 @@ def pivot_existencias_sucursales_detallado(df):
 
     df_fijos = sucursales[CAMPOS_FIJOS].drop_duplicates()
 
-    df_pivot = sucursales.pivot_table(index='Concatenar',
-                                      columns='NombreTienda',
-                                      values='Existencia_Total',
-                                      aggfunc='sum').reset_index()
+    df_pivot = pivot_suma(sucursales, index='Concatenar', columns='NombreTienda', values='Existencia_Total')
 
     resultado = pd.merge(df_fijos, df_pivot, on='Concatenar', how='left')
 
-    sucursal_cols = sorted([col for col in resultado.columns if col not in CAMPOS_FIJOS and col != 'Concatenar'])
+    sucursal_cols = [col for col in resultado.columns if col not in CAMPOS_FIJOS and col != 'Concatenar']
+    return completar_pivot_sucursales(resultado, sucursal_cols)
+
+
+def completar_pivot_sucursales(resultado, sucursal_cols):
+    """
+    Rellena, totaliza y ordena el pivot "Solo Sucursales" a partir de
+    CAMPOS_FIJOS + una columna de existencia por sucursal.
+    """
+    sucursal_cols = sorted(sucursal_cols)
 
     # Rellenar NaN con 0 en sucursales
     for col in sucursal_cols:
@@ -30,7 +37,7 @@ def pivot_existencias_sucursales_detallado(df):
     resultado['Sucursal_Total'] = resultado[sucursal_cols].sum(axis=1)
 
     # ❗️Eliminar filas donde Sucursal_Total es 0
-    resultado = resultado[resultado['Sucursal_Total'] > 0].copy()
+    resultado = resultado[resultado['Sucursal_Total'] > 0]
 
     # Eliminar columna de porcentaje si no la quieres calcular (opcional)
     # Si deseas dejarla vacía, mantenemos así:
@@ -1,8 +1,35 @@
 # query.py
 # -----------------
 # Aquí se aloja la consulta SQL optimizada (o vista) para el inventario
+#
+# INVENTORY_SQL_TEMPLATE (= INVENTORY_CTES_TEMPLATE + SELECT final) admite dos huecos:
+#   {filtro_productos}: predicados por producto dentro de InvPorTienda
+#                       (alias di/hi/dt/dc); se aplican antes de las ventanas,
+#                       que particionan por producto, así que no alteran totales.
+#   {filtro_filas}:     predicados sobre el resultado final (alias c1).
+# Cada hueco recibe '' o una cadena que empieza por '\n  AND ...'.
+#
+# La fecha del último movimiento (columna 'Fecha') ya no sale de esta
+# consulta: se une en el cliente desde ULTIMO_MOVIMIENTO_SQL (ver
+# components/services/movimiento_service.py).
 
-INVENTORY_SQL = """
+# Región de cada tienda (alias dt = tbDimTiendas)
+REGION_CASE_SQL = """CASE 
+      WHEN dt.dimID_Tienda = 2003 THEN 'Valencia Casa Matriz'
+      WHEN dt.dimID_Tienda = 2005 THEN 'Oriente - Casa Matriz'
+      WHEN dt.dimID_Tienda = 2004 THEN 'Occidente - Casa Matriz'
+      WHEN dt.dimID_Tienda = 2006 THEN 'Margarita - Casa Matriz'
+      WHEN dt.dimID_Tienda IN (1,1002,1004,1006,1009,1010,1011,1012,
+                               1013,1014,1017,1018,1019,1020,1021,1022,
+                               1023,1024) THEN 'Oriente - Sucursales'
+      WHEN dt.dimID_Tienda IN (1026,1027,1028,1029,1030,1031,1037,1038,
+                               1039,1040,1041,1042,1043,1044,1045,1046,
+                               1047,1048,1050,1052,1053,1055,2007) THEN 'Occidente - Sucursales'
+      WHEN dt.dimID_Tienda IN (1032,1033,1034,1035,1036) THEN 'Margarita - Sucursales'
+      ELSE 'Sin region'
+    END"""
+
+INVENTORY_CTES_TEMPLATE = """
 WITH InvPorTienda AS (
   SELECT
     di.Referencia,
@@ -18,20 +45,7 @@ WITH InvPorTienda AS (
     di.NombreCategoria,
     dt.dimID_Tienda,
     dt.Nombre AS NombreTienda,
-    CASE 
-      WHEN dt.dimID_Tienda = 2003 THEN 'Valencia Casa Matriz'
-      WHEN dt.dimID_Tienda = 2005 THEN 'Oriente - Casa Matriz'
-      WHEN dt.dimID_Tienda = 2004 THEN 'Occidente - Casa Matriz'
-      WHEN dt.dimID_Tienda = 2006 THEN 'Margarita - Casa Matriz'
-      WHEN dt.dimID_Tienda IN (1,1002,1004,1006,1009,1010,1011,1012,
-                               1013,1014,1017,1018,1019,1020,1021,1022,
-                               1023,1024) THEN 'Oriente - Sucursales'
-      WHEN dt.dimID_Tienda IN (1026,1027,1028,1029,1030,1031,1037,1038,
-                               1039,1040,1041,1042,1043,1044,1045,1046,
-                               1047,1048,1050,1052,1053,1055,2007) THEN 'Occidente - Sucursales'
-      WHEN dt.dimID_Tienda IN (1032,1033,1034,1035,1036) THEN 'Margarita - Sucursales'
-      ELSE 'Sin region'
-    END AS Region,
+    {region_case} AS Region,
     SUM(hi.Existencia) AS Existencia,
     MAX(hi.PrecioDetal) AS PrecioDetal,
     MAX(hi.PrecioPromocion) AS PrecioPromocion,
@@ -45,6 +59,7 @@ WITH InvPorTienda AS (
     ON hi.dimid_tienda = dt.dimID_Tienda
   JOIN tbDimCategorias dc
     ON di.dimID_Categoria = dc.dimID_Categoria
+  WHERE 1 = 1{filtro_productos}
   GROUP BY
     di.Referencia,
     di.CodigoMarca,
@@ -83,13 +98,10 @@ Consulta1 AS (
     d.NombreCategoriaPrincipal,
     d.NombreCategoria,
     CASE 
-      WHEN d.PrecioPromocion = 0 THEN '0%'
-      WHEN d.PrecioDetal = 0 THEN '0%'
-      WHEN d.PrecioPromocion = d.PrecioDetal THEN '0%'
-      ELSE CONCAT(
-        CAST(ROUND((1.0 - (d.PrecioPromocion/NULLIF(d.PrecioDetal,0))) * 100, 0) AS INT),
-        '%'
-      )
+      WHEN d.PrecioPromocion = 0 THEN 0
+      WHEN d.PrecioDetal = 0 THEN 0
+      WHEN d.PrecioPromocion = d.PrecioDetal THEN 0
+      ELSE CAST(ROUND((1.0 - (d.PrecioPromocion/NULLIF(d.PrecioDetal,0))) * 100, 0) AS INT)
     END AS Descuento,
     CASE 
       WHEN d.NombreSubLinea IN (
@@ -126,47 +138,16 @@ Consulta1 AS (
   JOIN ReferenciasConPositivo p
     ON p.Referencia = d.Referencia
    AND p.CodigoMarca = d.CodigoMarca
-),
-UltimoMovimiento AS (
-  SELECT
-    CONCAT(I.Referencia, I.CodigoMarca) AS Concatenar,
-    I.CodigoBarra,
-    I.Referencia,
-    I.CodigoMarca,
-    M.Nombre AS Marca,
-    I.Nombre,
-    F.Nombre AS Fabricante,
-    LEFT(C.Codigo, 4) AS CategoriaCodigo,
-    C.Nombre AS CategoriaNombre,
-    CC.Nombre AS Linea,
-    MT.Cantidad AS Cantidad,
-    T.Correccion,
-    MT.Numero AS NumeroTransferencia,
-    CONVERT(VARCHAR, T.Fecha, 103) AS Fecha,
-    T.Observacion,
-    ROW_NUMBER() OVER (
-      PARTITION BY I.Referencia, I.CodigoMarca 
-      ORDER BY T.Fecha DESC, MT.Numero DESC
-    ) AS RN
-  FROM [J101010100_999911].[dbo].[MOVTRANSFERENCIAS] MT
-  RIGHT JOIN [J101010100_999911].[dbo].[INVENTARIO] I ON I.CodigoBarra = MT.CodigoBarra
-  RIGHT JOIN [J101010100_999911].[dbo].[CATEGORIAS] C ON I.Categoria = C.Codigo
-  LEFT JOIN [J101010100_999911].[dbo].[MARCAS] M ON I.CodigoMarca = M.Codigo
-  LEFT JOIN [J101010100_999911].[dbo].[CATEGORIAS] CC ON LEFT(C.Codigo, 4) = CC.Codigo
-  INNER JOIN [J101010100_999911].[dbo].[TRANSFERENCIAS] T ON T.Numero = MT.Numero
-  INNER JOIN [J101010100_999911].[dbo].[SUCURSALES] S ON S.Codigo = T.CodigoRecibe
-  INNER JOIN [J101010100_999911].[dbo].[FABRICANTES] F ON F.Codigo = I.Fabricante
-  --WHERE T.Fecha BETWEEN '20240101' AND GETDATE()
-    --AND T.CodigoRecibe IN ('999999')
-    AND T.Status IN ('2')
-    AND MT.Cantidad NOT IN ('1', '-1')
-    --AND (
-      --T.Observacion NOT LIKE '%MG%'
-      --AND T.Observacion NOT LIKE '%Margarita%'
-      --AND T.Observacion NOT LIKE '%Mgta%'
-      --AND T.Observacion NOT LIKE '%organza%'
-    --)
+)"""
+
+# Orden total de las filas de Consulta1 (alias c1): el cliente toma "la primera
+# fila" de cada producto en este orden, y el pivot del servidor usa el mismo
+# para elegir la suya. Sólo Referencia dejaba el orden dentro de ella al azar.
+ORDEN_FILAS_SQL = (
+    "c1.Referencia, c1.Concatenar, c1.CodigoBarra, c1.Region, c1.NombreTienda, c1.Promocion, c1.Status"
 )
+
+INVENTORY_SELECT_TEMPLATE = """
 SELECT
   c1.Concatenar,
   c1.Referencia,
@@ -187,15 +168,205 @@ SELECT
   c1.Promocion,
   c1.Status,
   c1.Existencia_Total_CasaMatriz,
-  c1.Existencia_Total_Sucursales,
-  c2.Fecha
+  c1.Existencia_Total_Sucursales
 FROM Consulta1 c1
-INNER JOIN UltimoMovimiento c2
-  ON c1.Concatenar = c2.Concatenar
-WHERE c2.RN = 1
-ORDER BY c1.Referencia;
+WHERE 1 = 1{filtro_filas}
+ORDER BY {orden_filas};
+"""
 
+INVENTORY_SQL_TEMPLATE = INVENTORY_CTES_TEMPLATE + INVENTORY_SELECT_TEMPLATE
 
 
+def construir_inventory_sql(filtro_productos: str = "", filtro_filas: str = "") -> str:
+    return INVENTORY_SQL_TEMPLATE.format(
+        region_case=REGION_CASE_SQL,
+        filtro_productos=filtro_productos,
+        filtro_filas=filtro_filas,
+        orden_filas=ORDEN_FILAS_SQL,
+    )
+
+
+INVENTORY_SQL = construir_inventory_sql()
+
+
+# -----------------------
+# Refresco incremental
+# -----------------------
+# Firma por (producto, tienda): si cambia cualquier fila de tbHecInventario o
+# cualquier columna de tbDimInventario / tbDimCategorias / tbDimTiendas que
+# sale en INVENTORY_SQL (CodigoSubLinea, NombreSubLinea -> Linea y Encargado,
+# NombreCategoriaPrincipal, NombreTienda), cambia la firma y el producto se
+# vuelve a leer. Mismos JOIN que InvPorTienda.
+INVENTORY_FIRMAS_SQL = """
+SELECT
+  CONCAT(di.Referencia, di.CodigoMarca) AS Concatenar,
+  hi.dimid_tienda AS dimID_Tienda,
+  CHECKSUM_AGG(BINARY_CHECKSUM(
+    hi.Existencia, hi.PrecioDetal, hi.PrecioPromocion, hi.Promocion, hi.Status,
+    di.CodigoBarra, di.NombreMarca, di.Nombre, di.Fabricante,
+    di.NombreCategoria, di.dimID_Categoria,
+    dc.CodigoSubLinea, dc.NombreSubLinea, dc.Nombre,
+    dt.Nombre
+  )) AS Firma
+FROM tbDimInventario di
+JOIN tbHecInventario hi
+  ON di.dimID_Inventario = hi.dimid_inventario
+ AND hi.Existencia >= 0
+JOIN tbDimTiendas dt
+  ON hi.dimid_tienda = dt.dimID_Tienda
+JOIN tbDimCategorias dc
+  ON di.dimID_Categoria = dc.dimID_Categoria
+GROUP BY
+  di.Referencia,
+  di.CodigoMarca,
+  hi.dimid_tienda;
+"""
+
+# Tabla temporal con los productos a releer (se llena desde el cliente)
+DELTA_TEMP_SQL = """
+IF OBJECT_ID('tempdb..#DeltaConcatenar') IS NOT NULL DROP TABLE #DeltaConcatenar;
+CREATE TABLE #DeltaConcatenar (Concatenar NVARCHAR(200) NOT NULL PRIMARY KEY);
+"""
+DELTA_INSERT_SQL = "INSERT INTO #DeltaConcatenar (Concatenar) VALUES (?)"
+DELTA_FILTRO_PRODUCTOS = (
+    "\n    AND CONCAT(di.Referencia, di.CodigoMarca) IN (SELECT Concatenar FROM #DeltaConcatenar)"
+)
+
+
+# -----------------------
+# Último movimiento por producto
+# -----------------------
+# Fecha de la última transferencia recibida (Status 2, cantidades != ±1) por
+# Concatenar. Equivale a la fila RN = 1 del antiguo CTE UltimoMovimiento
+# (ORDER BY T.Fecha DESC). {filtro_numero} permite leer sólo transferencias
+# con Numero mayor al último visto.
+ULTIMO_MOVIMIENTO_SQL_TEMPLATE = """
+SELECT
+  CONCAT(I.Referencia, I.CodigoMarca) AS Concatenar,
+  MAX(T.Fecha) AS Fecha,
+  MAX(MT.Numero) AS NumeroMax
+FROM [J101010100_999911].[dbo].[MOVTRANSFERENCIAS] MT
+INNER JOIN [J101010100_999911].[dbo].[INVENTARIO] I ON I.CodigoBarra = MT.CodigoBarra
+INNER JOIN [J101010100_999911].[dbo].[CATEGORIAS] C ON I.Categoria = C.Codigo
+INNER JOIN [J101010100_999911].[dbo].[TRANSFERENCIAS] T ON T.Numero = MT.Numero
+INNER JOIN [J101010100_999911].[dbo].[SUCURSALES] S ON S.Codigo = T.CodigoRecibe
+INNER JOIN [J101010100_999911].[dbo].[FABRICANTES] F ON F.Codigo = I.Fabricante
+WHERE T.Status IN ('2')
+  AND MT.Cantidad NOT IN ('1', '-1'){filtro_numero}
+GROUP BY
+  I.Referencia,
+  I.CodigoMarca;
+"""
+
+
+def construir_ultimo_movimiento_sql(incremental: bool = False) -> str:
+    """Con incremental=True la consulta espera un parámetro: el último Numero visto."""
+    filtro = "\n  AND MT.Numero > ?" if incremental else ""
+    return ULTIMO_MOVIMIENTO_SQL_TEMPLATE.format(filtro_numero=filtro)
+
+
+# -----------------------
+# Pivot en el servidor
+# -----------------------
+TIENDAS_SQL = f"""
+SELECT
+  dt.dimID_Tienda,
+  dt.Nombre AS NombreTienda,
+  {REGION_CASE_SQL} AS Region
+FROM tbDimTiendas dt;
 """
 
+# Columnas fijas que devuelve el pivot del servidor (CAMPOS_FIJOS sin 'Fecha',
+# que se une en el cliente).
+PIVOT_CAMPOS_SQL = [
+    'Concatenar', 'Referencia', 'CodigoMarca', 'NombreMarca',
+    'Nombre', 'Fabricante', 'CodigoSubLinea', 'Linea', 'Encargado', 'Descuento', 'Promocion', 'NombreCategoria',
+]
+
+# Etiqueta de columna y región de filas para cada vista (ver components/pivot_*.py)
+PIVOT_ETIQUETA_SQL = {
+    "Todo": "CONCAT(c1.Region, ' - ', c1.NombreTienda)",
+    "Solo Sucursales": "c1.NombreTienda",
+    "Solo Casa Matriz": "c1.Region",
+}
+PIVOT_FILTRO_REGION_SQL = {
+    "Todo": "",
+    "Solo Sucursales": "\n  AND c1.Region LIKE '%Sucursales%'",
+    "Solo Casa Matriz": "\n  AND c1.Region LIKE '%Casa Matriz%'",
+}
+
+
+def _quotename(nombre: str) -> str:
+    return "[" + str(nombre).replace("]", "]]") + "]"
+
+
+def construir_pivot_sql(opcion: str, columnas, filtro_productos: str = "", filtro_filas: str = "") -> str:
+    """
+    Genera un PIVOT dinámico sobre `columnas` (tiendas o regiones) que
+    reproduce en SQL Server el pivot de pandas de cada vista:
+      - Promocion/Descuento se anulan en filas sin stock (como
+        _normalize_discount_and_promo_by_stock).
+      - 'Todo' toma la primera fila de cada Concatenar en ORDEN_FILAS_SQL
+        (la misma que el cliente sobre INVENTORY_SQL); las otras vistas, las
+        combinaciones distintas de campos fijos.
+      - La suma por columna es por Concatenar (no por combinación de fijos).
+    Devuelve una fila por combinación de fijos + una columna por etiqueta,
+    en orden de primera aparición (como drop_duplicates en el cliente).
+    """
+    etiqueta = PIVOT_ETIQUETA_SQL.get(opcion, PIVOT_ETIQUETA_SQL["Todo"])
+    filtro_region = PIVOT_FILTRO_REGION_SQL.get(opcion, "")
+    cols_pivot = ", ".join(_quotename(c) for c in columnas)
+    cols_select = ",\n  ".join(f"p.{_quotename(c)}" for c in columnas)
+    fijos = ", ".join(PIVOT_CAMPOS_SQL)
+    fijos_f = ",\n  ".join(f"f.{c}" for c in PIVOT_CAMPOS_SQL)
+
+    if opcion == "Todo":
+        fijos_cte = f"""Fijos AS (
+  SELECT {fijos}, Orden
+  FROM (
+    SELECT {fijos}, Orden,
+      ROW_NUMBER() OVER (PARTITION BY Concatenar ORDER BY Orden) AS RN
+    FROM Base
+  ) x
+  WHERE x.RN = 1
+)"""
+    else:
+        # GROUP BY agrupa los NULL como DISTINCT; MIN(Orden) = primera aparición
+        fijos_cte = f"""Fijos AS (
+  SELECT {fijos}, MIN(Orden) AS Orden
+  FROM Base
+  GROUP BY {fijos}
+)"""
+
+    ctes = INVENTORY_CTES_TEMPLATE.format(
+        region_case=REGION_CASE_SQL,
+        filtro_productos=filtro_productos,
+    )
+    return f"""{ctes},
+Base AS (
+  SELECT
+    c1.Concatenar, c1.Referencia, c1.CodigoMarca, c1.NombreMarca,
+    c1.Nombre, c1.Fabricante, c1.CodigoSubLinea, c1.Linea, c1.Encargado,
+    CASE WHEN ISNULL(c1.Existencia_Total, 0) <= 0 THEN 0 ELSE c1.Descuento END AS Descuento,
+    CASE WHEN ISNULL(c1.Existencia_Total, 0) <= 0 THEN 0 ELSE c1.Promocion END AS Promocion,
+    c1.NombreCategoria,
+    {etiqueta} AS Columna,
+    c1.Existencia_Total,
+    ROW_NUMBER() OVER (ORDER BY {ORDEN_FILAS_SQL}) AS Orden
+  FROM Consulta1 c1
+  WHERE 1 = 1{filtro_region}{filtro_filas}
+),
+{fijos_cte},
+Piv AS (
+  SELECT Concatenar, {cols_pivot}
+  FROM (SELECT Concatenar, Columna, Existencia_Total FROM Base) s
+  PIVOT (SUM(Existencia_Total) FOR Columna IN ({cols_pivot})) pv
+)
+SELECT
+  {fijos_f},
+  {cols_select}
+FROM Fijos f
+LEFT JOIN Piv p
+  ON p.Concatenar = f.Concatenar
+ORDER BY f.Orden;
+"""
@@ -1,18 +1,244 @@
 # components/services/filter_service.py
+import re
+import numpy as np
 import pandas as pd
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
+from components.esquema_columnas import resolver_esquema
 
-def _find_col_case_insensitive(df: pd.DataFrame, candidates_lower: List[str]) -> Optional[str]:
+
+# Separadores del campo Referencia (varias referencias pegadas de una lista)
+SEPARADORES_REFERENCIA = re.compile(r"[,;\t\r\n]+")
+
+# Máximo de referencias que se envían como parámetros al servidor (SQL Server admite 2100)
+MAX_REFERENCIAS_SQL = 1000
+
+
+def separar_referencias(referencia) -> List[str]:
+    """
+    Referencias normalizadas (strip + lower, sin vacías, sin el placeholder y
+    sin repetir) del campo Referencia. Admite varias separadas por coma,
+    punto y coma, tabulador o salto de línea.
+    """
+    texto = str(referencia) if referencia is not None else ""
+    refs = (r.strip().lower() for r in SEPARADORES_REFERENCIA.split(texto))
+    return list(dict.fromkeys(r for r in refs if r and r != "referencia"))
+
+
+# -------------------------
+# Predicados por columna (sobre una Series; True = la fila se conserva).
+# Los usan apply_filters fila a fila y IndiceFiltros sobre los valores distintos.
+# -------------------------
+def _pred_igual(valor: str):
+    return lambda s: s.astype(str) == valor
+
+
+def _normalizar_referencia(s: pd.Series) -> pd.Series:
+    return s.astype(str).str.strip().str.lower()
+
+
+def _pred_referencias(refs):
+    return lambda s: _normalizar_referencia(s).isin(refs)
+
+
+def _pred_excluir(excluir: set):
+    return lambda s: ~s.astype(str).str.upper().isin(excluir)
+
+
+def _pred_promo_1(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s, errors="coerce").eq(1)
+
+
+class IndiceFiltros:
+    """
+    Índice de las columnas de filtro de un pivot, construido una vez al
+    cachearlo: por columna, el código de cada fila (pd.factorize, los nulos
+    también tienen código) y una fila de muestra por código. Un predicado se
+    evalúa sobre los pocos valores distintos y se expande a las filas con
+    indexado NumPy, en lugar de astype(str)/str.upper() sobre todas las filas.
+    """
+
+    COLUMNAS = ('CodigoMarca', 'CodigoSubLinea', 'Referencia', 'Promocion', 'Encargado')
+
+    def __init__(self, df: pd.DataFrame):
+        self.columnas = pd.Index(df.columns)
+        self.filas = len(df)
+        self._referencias = None   # índice hash de Referencia (se arma en la primera búsqueda)
+        self.codigos, self.valores = {}, {}
+        for col in self.COLUMNAS:
+            if col not in df.columns:
+                continue
+            codigos_col, _ = pd.factorize(df[col], use_na_sentinel=False)
+            _, primera = np.unique(codigos_col, return_index=True)
+            self.codigos[col] = codigos_col.astype(np.int32)
+            self.valores[col] = df[col].iloc[primera].reset_index(drop=True)
+        self.duplicados = self._marcar_duplicados(df)
+
+    def _marcar_duplicados(self, df: pd.DataFrame):
+        """
+        {solo_promo_1: marcas de marcar_duplicados} del pivot: entre todas las
+        filas y entre las de Promocion = 1. None si faltan producto o Descuento
+        o si marca/sublínea/referencia varían dentro de un producto.
+        """
+        producto = clave_producto(df)
+        if producto is None or 'Descuento' not in df.columns:
+            return None
+        # los filtros por producto sólo quitan productos enteros si sus columnas
+        # tienen un valor por producto; si no, se recalcula sobre cada vista
+        cod_p, distintos = pd.factorize(producto, use_na_sentinel=False)
+        for col in FILTROS_PRODUCTO.values():
+            if col in self.codigos:
+                pares = cod_p.astype(np.int64) * len(self.valores[col]) + self.codigos[col]
+                if len(pd.unique(pares)) > len(distintos):
+                    return None
+        todas = marcar_duplicados(producto, df['Descuento'])
+        if 'Promocion' not in self.codigos:
+            return {False: todas, True: todas}
+        promo = self.mascara('Promocion', _pred_promo_1)
+        return {False: todas, True: marcar_duplicados(producto, df['Descuento'], promo)}
+
+    @property
+    def nbytes(self) -> int:
+        duplicados = sum(m.nbytes for m in (self.duplicados or {}).values())
+        return int(sum(c.nbytes for c in self.codigos.values()) + duplicados)
+
+    def duplicados_descuento(self, solo_promo_1: bool):
+        """
+        Marcas de (producto, Descuento) repetido de las filas del índice, o
+        None. Valen para cualquier vista recortada con mascara_filtros: los
+        filtros por producto conservan o quitan todas sus filas juntas y el
+        de 'solo promoción' tiene su propia variante.
+        """
+        if self.duplicados is None:
+            return None
+        return self.duplicados[bool(solo_promo_1)]
+
+    def mascara(self, col: str, predicado) -> np.ndarray:
+        """predicado(Series) evaluado para cada fila de `col`, vía sus valores distintos."""
+        por_valor = np.asarray(predicado(self.valores[col]), dtype=bool)
+        return por_valor[self.codigos[col]]
+
+    def recortar(self, conservar: np.ndarray) -> "IndiceFiltros":
+        """Índice de las filas `conservar` (máscara booleana) del pivot."""
+        codigos = {col: c[conservar] for col, c in self.codigos.items()}
+        recortado = IndiceFiltros.__new__(IndiceFiltros)
+        recortado.columnas = self.columnas
+        recortado.filas = int(np.count_nonzero(conservar))
+        recortado.codigos, recortado.valores = codigos, self.valores
+        recortado.duplicados = (None if self.duplicados is None
+                                else {k: m[conservar] for k, m in self.duplicados.items()})
+        recortado._referencias = None
+        return recortado
+
+    def posiciones_referencias(self, refs) -> np.ndarray:
+        """
+        Posiciones (ordenadas) de las filas cuya Referencia normalizada
+        (strip + lower) está en `refs`: una consulta al índice hash por
+        referencia y una sola pasada vectorizada para juntar las filas.
+        """
+        claves, orden, inicio = self._indice_referencias()
+        if len(refs) <= 16:
+            grupos = np.array([claves.get_loc(r) for r in refs if r in claves], dtype=np.intp)
+        else:
+            grupos = claves.get_indexer(pd.Index(list(refs), dtype=object))
+            grupos = grupos[grupos >= 0]
+        if len(grupos) == 0:
+            return np.empty(0, dtype=np.intp)
+        if len(grupos) == 1:
+            return orden[inicio[grupos[0]]:inicio[grupos[0] + 1]]
+        desde, largo = inicio[grupos], inicio[grupos + 1] - inicio[grupos]
+        total = int(largo.sum())
+        saltos = np.repeat(desde - np.concatenate([[0], np.cumsum(largo)[:-1]]), largo)
+        return np.sort(orden[saltos + np.arange(total)])
+
+    def _indice_referencias(self):
+        """(Index de referencias normalizadas, filas ordenadas por referencia, inicio de cada una)."""
+        if self._referencias is None:
+            grupo, claves = pd.factorize(_normalizar_referencia(self.valores['Referencia']).to_numpy())
+            grupo_fila = grupo[self.codigos['Referencia']]
+            orden = np.argsort(grupo_fila, kind='stable')
+            inicio = np.concatenate([[0], np.cumsum(np.bincount(grupo_fila, minlength=len(claves)))])
+            self._referencias = (pd.Index(claves), orden, inicio)
+        return self._referencias
+
+
+def clave_producto(df: pd.DataFrame):
+    """Clave de producto de cada fila: producto_id (índice) o Concatenar; None si no hay."""
+    if df.index.name == 'producto_id':
+        return df.index
+    return df['Concatenar'] if 'Concatenar' in df.columns else None
+
+
+def marcar_duplicados(producto, descuento, subconjunto: np.ndarray = None) -> np.ndarray:
     """
-    Devuelve el nombre REAL de la primera columna cuyo nombre (lower) coincide
-    con alguno de los candidates_lower. Si no encuentra, retorna None.
+    True en las filas cuyo par (producto, descuento) aparece más de una vez,
+    contando sólo las filas de `subconjunto` (máscara) si se da. Los nulos
+    son un valor más (como DataFrame.duplicated). Un factorize por columna y
+    un bincount de los tamaños de grupo.
     """
-    cols_lower = df.columns.str.strip().str.lower()
-    for idx, real_name in enumerate(df.columns):
-        if cols_lower[idx] in candidates_lower:
-            return real_name
-    return None
+    cod_p, _ = pd.factorize(producto, use_na_sentinel=False)
+    cod_d, valores_d = pd.factorize(descuento, use_na_sentinel=False)
+    grupo, grupos = pd.factorize(cod_p.astype(np.int64) * max(len(valores_d), 1) + cod_d)
+    elegidas = grupo if subconjunto is None else grupo[subconjunto]
+    return np.bincount(elegidas, minlength=len(grupos))[grupo] > 1
+
+
+def mascara_filtros(
+    indice: IndiceFiltros,
+    opcion: str,
+    region: str,
+    marca: str,
+    referencia: str,
+    exclude_marcas: Optional[List[str]] = None,
+    solo_promo_1: bool = False,
+    exclude_sublineas: Optional[List[str]] = None,
+) -> Optional[np.ndarray]:
+    """
+    Máscara de filas que conserva apply_filters (mismos argumentos), calculada
+    con `indice`. None si no hay filtros reales o si alguno no puede
+    resolverse con el índice (región con columna 'Region', sublínea con otro
+    nombre de columna): en ese caso se usa apply_filters.
+    """
+    refs, excluir_m, excluir_s = _normalizar_entradas(referencia, exclude_marcas, exclude_sublineas)
+    if _sin_filtros(region, marca, refs, excluir_m, excluir_s, solo_promo_1):
+        return None
+    if opcion == "Solo Sucursales" and region and region != "Todas" and "Region" in indice.columnas:
+        return None
+
+    conservar = np.ones(indice.filas, dtype=bool)
+    if marca and "CodigoMarca" in indice.codigos:
+        conservar &= indice.mascara("CodigoMarca", _pred_igual(str(marca)))
+    if refs and "Referencia" in indice.codigos:
+        por_referencia = np.zeros(indice.filas, dtype=bool)
+        por_referencia[indice.posiciones_referencias(refs)] = True
+        conservar &= por_referencia
+    if excluir_m and "CodigoMarca" in indice.codigos:
+        conservar &= indice.mascara("CodigoMarca", _pred_excluir({m.upper() for m in excluir_m}))
+    if excluir_s:
+        sub_col = resolver_esquema(indice.columnas).sublinea
+        if sub_col is not None:
+            if sub_col not in indice.codigos:
+                return None
+            conservar &= indice.mascara(sub_col, _pred_excluir({x.upper() for x in excluir_s}))
+    if solo_promo_1 and "Promocion" in indice.codigos:
+        conservar &= indice.mascara("Promocion", _pred_promo_1)
+    return conservar
+
+
+def _normalizar_entradas(referencia, exclude_marcas, exclude_sublineas):
+    refs = separar_referencias(referencia)  # sin el placeholder
+    cleaned_excludes_marcas = [m.strip() for m in (exclude_marcas or []) if m and m.strip()]
+    cleaned_excludes_subs   = [s.strip() for s in (exclude_sublineas or []) if s and s.strip()]
+    return refs, cleaned_excludes_marcas, cleaned_excludes_subs
+
+
+def _sin_filtros(region, marca, refs, excluir_m, excluir_s, solo_promo_1) -> bool:
+    return ((not region or region == "Todas")
+            and not marca
+            and not refs
+            and not excluir_m
+            and not excluir_s
+            and not solo_promo_1)
 
 
 def apply_filters(
@@ -34,29 +260,25 @@ def apply_filters(
       y solo_promo_1=False), devuelve el DataFrame tal cual (estado "sin cambios").
     - Región: sólo cuando opcion == "Solo Sucursales" y existe 'Region' (match exacto).
     - Marca: exacta si existe 'CodigoMarca'.
-    - Referencia: exacta, case-insensitive, si existe 'Referencia'.
+    - Referencia: exacta, case-insensitive, si existe 'Referencia'. Varias
+      referencias separadas por coma / salto de línea: cualquiera de ellas.
     - Excluir marcas: si existe 'CodigoMarca'.
     - Excluir sublíneas: si existe la columna de sublínea (CodigoSubLinea/CodSubLinea/SubLinea).
     - Solo Promoción = 1: si existe 'Promocion'.
+
+    Sobre un pivot cacheado, mascara_filtros da el mismo resultado con su
+    IndiceFiltros.
     """
     if df is None or df.empty:
         return df
 
     # Normalización de entradas
-    ref = (str(referencia).strip() if referencia is not None else "")
-    if ref.lower() == "referencia":  # evita filtrar por placeholder
-        ref = ""
-
-    cleaned_excludes_marcas = [m.strip() for m in (exclude_marcas or []) if m and m.strip()]
-    cleaned_excludes_subs   = [s.strip() for s in (exclude_sublineas or []) if s and s.strip()]
+    refs, cleaned_excludes_marcas, cleaned_excludes_subs = _normalizar_entradas(
+        referencia, exclude_marcas, exclude_sublineas
+    )
 
     # --- Early return (sin filtros "reales") ---
-    if ((not region or region == "Todas")
-        and not marca
-        and not ref
-        and not cleaned_excludes_marcas
-        and not cleaned_excludes_subs
-        and not solo_promo_1):
+    if _sin_filtros(region, marca, refs, cleaned_excludes_marcas, cleaned_excludes_subs, solo_promo_1):
         return df
 
     out = df
@@ -76,14 +298,13 @@ def apply_filters(
     # Filtro por Marca exacta
     # -------------------------
     if marca and "CodigoMarca" in out.columns:
-        out = out[out["CodigoMarca"].astype(str) == str(marca)]
+        out = out[_pred_igual(str(marca))(out["CodigoMarca"])]
 
     # -------------------------
-    # Filtro por Referencia (exacto, case-insensitive)
+    # Filtro por Referencia (exacto, case-insensitive; una o varias)
     # -------------------------
-    if ref and "Referencia" in out.columns:
-        ref_norm = ref.lower()
-        out = out[out["Referencia"].astype(str).str.strip().str.lower() == ref_norm]
+    if refs and "Referencia" in out.columns:
+        out = out[_pred_referencias(refs)(out["Referencia"])]
     # Si no existe 'Referencia', se ignora.
 
     # -------------------------
@@ -92,25 +313,199 @@ def apply_filters(
     if cleaned_excludes_marcas and "CodigoMarca" in out.columns:
         excluir_m = {m.upper() for m in cleaned_excludes_marcas}
         if excluir_m:
-            out = out[~out["CodigoMarca"].astype(str).str.upper().isin(excluir_m)]
+            out = out[_pred_excluir(excluir_m)(out["CodigoMarca"])]
 
     # -------------------------
     # Excluir Sublíneas (flexible en nombre de columna)
     # -------------------------
     if cleaned_excludes_subs:
-        # Buscar columna candidata de sublínea de forma case-insensitive
-        cand_lower = {"codigosublinea", "codsublinea", "sublinea", "codigo_sublinea"}
-        sub_col = _find_col_case_insensitive(out, list(cand_lower))
+        # Columna de sublínea del esquema (case-insensitive)
+        sub_col = resolver_esquema(out.columns).sublinea
         if sub_col is not None:
             excluir_s = {s.upper() for s in cleaned_excludes_subs}
-            out = out[~out[sub_col].astype(str).str.upper().isin(excluir_s)]
+            out = out[_pred_excluir(excluir_s)(out[sub_col])]
         # Si no hay columna compatible, se ignora silenciosamente.
 
     # -------------------------
     # Solo Promoción = 1
     # -------------------------
     if solo_promo_1 and "Promocion" in out.columns:
-        promo_num = pd.to_numeric(out["Promocion"], errors="coerce")
-        out = out[promo_num.eq(1)]
+        out = out[_pred_promo_1(out["Promocion"])]
 
     return out
+
+
+# Filtros de apply_filters que sólo miran un atributo del producto (parámetro -> columna):
+# dan el mismo resultado evaluados antes del pivot, sobre la dimensión producto.
+FILTROS_PRODUCTO = {
+    'marca': 'CodigoMarca',
+    'referencia': 'Referencia',
+    'exclude_marcas': 'CodigoMarca',
+    'exclude_sublineas': 'CodigoSubLinea',
+}
+
+
+class PlanFiltros:
+    """
+    Reparto de los filtros de apply_filters alrededor del pivot.
+
+      productos    kwargs de apply_filters a evaluar sobre la dimensión producto
+                   (antes del pivot; vacío si no se empuja nada)
+      posteriores  kwargs de apply_filters a evaluar sobre el pivot
+      traza        una línea por decisión, para el log
+    """
+
+    def __init__(self, productos: dict, posteriores: dict, traza: List[str]):
+        self.productos = productos
+        self.posteriores = posteriores
+        self.traza = traza
+
+    @property
+    def empuja(self) -> bool:
+        return bool(self.productos)
+
+    def __str__(self):
+        return "; ".join(self.traza)
+
+
+def planificar_filtros(
+    filtros: dict,
+    pivot_en_cache: bool,
+    columnas_producto=(),
+) -> PlanFiltros:
+    """
+    Decide dónde se evalúa cada filtro de `filtros` (kwargs de apply_filters).
+
+    - Los de FILTROS_PRODUCTO bajan por debajo del pivot si su columna está en
+      `columnas_producto` y el pivot de la vista no está en caché (filtrar un
+      pivot cacheado es más barato que pivotear, aunque sea menos).
+    - 'Solo Promoción = 1' es por tienda: queda después del pivot.
+    - Región: sólo actúa si el pivot tiene columna 'Region'; queda después.
+    """
+    activos = {
+        'marca': bool(filtros.get('marca')),
+        'referencia': bool(separar_referencias(filtros.get('referencia'))),
+        'exclude_marcas': any(m and m.strip() for m in (filtros.get('exclude_marcas') or [])),
+        'exclude_sublineas': any(x and x.strip() for x in (filtros.get('exclude_sublineas') or [])),
+    }
+    vacios = {'marca': '', 'referencia': '', 'exclude_marcas': None, 'exclude_sublineas': None}
+
+    productos, posteriores, traza = {}, dict(filtros), []
+    for nombre, columna in FILTROS_PRODUCTO.items():
+        if not activos[nombre]:
+            continue
+        if pivot_en_cache:
+            traza.append(f"{nombre}: sobre el pivot en caché")
+        elif columna not in columnas_producto:
+            traza.append(f"{nombre}: sobre el pivot (la dimensión producto no tiene {columna} único por producto)")
+        else:
+            productos[nombre] = filtros.get(nombre)
+            posteriores[nombre] = vacios[nombre]
+            traza.append(f"{nombre}: antes del pivot (dimensión producto)")
+    if filtros.get('solo_promo_1'):
+        traza.append("solo_promo_1: sobre el pivot (promoción por tienda)")
+    if not traza:
+        traza.append("sin filtros de apply_filters")
+    return PlanFiltros(productos, posteriores, traza)
+
+
+def normalizar_filtros(filtros: dict) -> dict:
+    """
+    Forma comparable de los kwargs de apply_filters (más el booleano
+    'solo_matriz_exist_1_11'), con la misma normalización que apply_filters.
+    """
+    return {
+        'opcion': filtros.get('opcion'),
+        'region': filtros.get('region') or 'Todas',
+        'marca': str(filtros.get('marca') or ''),
+        'referencia': frozenset(separar_referencias(filtros.get('referencia'))),
+        'exclude_marcas': frozenset(m.strip().upper() for m in (filtros.get('exclude_marcas') or [])
+                                    if m and m.strip()),
+        'exclude_sublineas': frozenset(x.strip().upper() for x in (filtros.get('exclude_sublineas') or [])
+                                       if x and x.strip()),
+        'solo_promo_1': bool(filtros.get('solo_promo_1')),
+        'solo_matriz_exist_1_11': bool(filtros.get('solo_matriz_exist_1_11')),
+    }
+
+
+def refinamiento(previos: dict, nuevos: dict) -> Optional[dict]:
+    """
+    Si los filtros `nuevos` sólo restringen a `previos` (ambos de
+    normalizar_filtros), devuelve los predicados agregados como kwargs de
+    apply_filters (+ 'solo_matriz_exist_1_11'); {} si son los mismos.
+    None si alguno se relajó o cambió: hay que recalcular desde el pivot.
+    """
+    for clave in ('opcion', 'region', 'marca'):
+        if previos[clave] != nuevos[clave]:
+            return None
+
+    extra = {}
+    if nuevos['referencia'] != previos['referencia']:
+        # sin referencias o con alguna que antes no estaba: se relajó
+        if not nuevos['referencia'] or (previos['referencia'] and not nuevos['referencia'] <= previos['referencia']):
+            return None
+        extra['referencia'] = ", ".join(sorted(nuevos['referencia']))
+    for clave in ('exclude_marcas', 'exclude_sublineas'):
+        if not previos[clave] <= nuevos[clave]:
+            return None
+        if nuevos[clave] - previos[clave]:
+            extra[clave] = sorted(nuevos[clave] - previos[clave])
+    for clave in ('solo_promo_1', 'solo_matriz_exist_1_11'):
+        if previos[clave] and not nuevos[clave]:
+            return None
+        if nuevos[clave] and not previos[clave]:
+            extra[clave] = True
+    return extra
+
+
+def compilar_filtros_sql(filtros: Optional[dict]) -> Tuple[str, str, list]:
+    """
+    Traduce el dict de FilterPanel.get_filters() a predicados parametrizados
+    para los huecos de INVENTORY_SQL_TEMPLATE.
+
+    Devuelve (filtro_productos, filtro_filas, params), con los params en el
+    mismo orden en que aparecen los '?' en la consulta.
+
+    Sólo se empujan al servidor los filtros que dan exactamente el mismo
+    resultado que apply_filters:
+    - Excluir marcas / sublíneas y Referencia: atributos del producto; se
+      filtran dentro de InvPorTienda (antes de las ventanas por producto).
+      Más de MAX_REFERENCIAS_SQL referencias pegadas se filtran en memoria.
+    'Solo Promoción = 1' (promo por tienda, cambia los totales del pivot), el
+    año a excluir (la Fecha se une en el cliente) y la opción de pivot se
+    quedan en memoria. La opción de pivot como filtro de Region limitaría el
+    dataset importado a las filas de esa vista: al cambiar a otra (o en cada
+    refresco incremental) los totales de Casa Matriz / Sucursales saldrían
+    en 0 como si fueran reales. filtro_filas queda vacío.
+    """
+    if not filtros:
+        return "", "", []
+
+    productos, params_productos = [], []
+
+    marcas = [m.strip().upper() for m in (filtros.get("exclude_marcas") or []) if m and m.strip()]
+    if marcas:
+        marcadores = ", ".join("?" for _ in marcas)
+        productos.append(f"(di.CodigoMarca IS NULL OR UPPER(di.CodigoMarca) NOT IN ({marcadores}))")
+        params_productos.extend(marcas)
+
+    subs = [x.strip().upper() for x in (filtros.get("exclude_sublineas") or []) if x and x.strip()]
+    if subs:
+        marcadores = ", ".join("?" for _ in subs)
+        productos.append(
+            "(dc.CodigoSubLinea IS NULL OR "
+            f"UPPER(CAST(dc.CodigoSubLinea AS NVARCHAR(50))) NOT IN ({marcadores}))"
+        )
+        params_productos.extend(subs)
+
+    refs = separar_referencias(filtros.get("referencia"))
+    if len(refs) == 1:
+        productos.append("LOWER(LTRIM(RTRIM(di.Referencia))) = ?")
+        params_productos.extend(refs)
+    elif 1 < len(refs) <= MAX_REFERENCIAS_SQL:
+        marcadores = ", ".join("?" for _ in refs)
+        productos.append(f"LOWER(LTRIM(RTRIM(di.Referencia))) IN ({marcadores})")
+        params_productos.extend(refs)
+
+    filtro_productos = "".join(f"\n    AND {p}" for p in productos)
+    return filtro_productos, "", params_productos
@@ -1,57 +1,459 @@
 # components/services/inventory_service.py
+import threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-import unicodedata
-from components.query import INVENTORY_SQL
-from components.services.filter_service import apply_filters
+from components.query import (
+    INVENTORY_SQL,
+    INVENTORY_FIRMAS_SQL,
+    DELTA_TEMP_SQL,
+    DELTA_INSERT_SQL,
+    DELTA_FILTRO_PRODUCTOS,
+    construir_inventory_sql,
+)
+from components.db_to_dataframe import (
+    leer_sql_compacto,
+    concatenar_bloques,
+    tipos_compactos_de,
+    CHUNK_FILAS,
+    FETCH_SIZE,
+)
+from components.modelo_inventario import ModeloInventario
+from components.esquema_columnas import resolver_esquema
+from components.descuento import porcentajes, formatear_porcentajes
+from components.esquema_inventario import ESQUEMA_INVENTARIO, aplicar_esquema, uso_memoria_mb
+from components.services.filter_service import (
+    apply_filters,
+    compilar_filtros_sql,
+    planificar_filtros,
+    normalizar_filtros,
+    refinamiento,
+    mascara_filtros,
+    clave_producto,
+    marcar_duplicados,
+    PlanFiltros,
+)
 from components.services.pivot_service import PivotService
+from components.services.snapshot_service import SnapshotService
+from components.services.movimiento_service import UltimoMovimientoService
+
+# Opciones del selector de pivot, en el orden en que se precalientan
+VISTAS_PIVOT = ["Todo", "Solo Sucursales", "Solo Casa Matriz"]
+
+# Resultados de etapas pre-pivot memorizados (región / año / normalización por vista)
+MAX_ETAPAS = 16
+
+# Año de las filas sin fecha (ver InventoryService._anios)
+SIN_ANIO = -1
 
 
 class InventoryService:
-    def __init__(self, engine):
+    def __init__(self, engine, snapshot_service: SnapshotService = None):
         self.engine = engine
+        self.snapshots = snapshot_service or SnapshotService()
+        self.snapshot_meta = None  # metadatos del snapshot del dataset activo (si vino de disco)
+        # Concatenar -> fecha del último movimiento (se une en cliente)
+        self.movimientos = UltimoMovimientoService(engine, self.snapshots)
+        # firmas (Concatenar, dimID_Tienda, Firma) del último import SQL, para el refresco incremental
+        self.firmas = None
+        # filtros empujados al servidor en el último import (None = catálogo completo)
+        self.filtros_servidor = None
         self.df_original = None
         self.df_actual = None
-        self.catalogo_descuento = None
+        # dimensión producto / tienda + hechos con claves enteras (ver ModeloInventario);
+        # None si el dataset no tiene las columnas de INVENTORY_SQL
+        self.modelo = None
+        self.catalogo_descuento = None  # Series int16 (porcentaje) indexada por Concatenar
+        # (catálogo, modelo, porcentaje por producto_id) de la última vista con modelo
+        self._catalogo_ids = None
         self.filter_mode = None  # 'unique', 'dup' o None
-        self.pivot_service = PivotService()
-        # recordar último año excluido para invalidar caché sólo cuando cambie
-        self._last_exclude_year = None
+        self.plan_filtros = None  # PlanFiltros (traza del plan) de la última llamada a aplicar_filtros
+        # última vista filtrada (antes de catálogo y duplicados), para refinarla
+        # si el siguiente cambio de filtros sólo la restringe:
+        # ((opcion, versión, huella), normalizar_filtros(...), DataFrame, IndiceFiltros o None)
+        self._filtrada = None
+        # Etapas pre-pivot memorizadas: (etapa, versión, *parámetros) -> resultado.
+        # La versión es la del PivotService (cambia con cada dataset/delta).
+        self._etapas = OrderedDict()
+        self._etapas_lock = threading.Lock()
+        # esquema (tupla de columnas) -> (columna, ¿es fecha?) o None; ver _columna_anio
+        self._columnas_anio = {}
+        self.pivot_service = PivotService(engine)
 
     # -----------------------
     # Cargas de datos
     # -----------------------
-    def importar_datos_sql(self):
-        self.df_original = pd.read_sql(INVENTORY_SQL, self.engine)
+    def importar_datos_sql(self, chunksize: int = CHUNK_FILAS, fetch_size: int = FETCH_SIZE,
+                           on_progress=None, cancelacion=None, filtros: dict = None):
+        """
+        Importa INVENTORY_SQL y lo deja como dataset activo.
+        Ver cargar_dataset_sql para los parámetros.
+        """
+        df, firmas, movimientos = self.cargar_inventario_sql(chunksize, fetch_size, on_progress, cancelacion, filtros)
+        self.establecer_dataset(df, firmas=firmas, filtros_servidor=filtros, movimientos=movimientos)
+
+    def cargar_inventario_sql(self, chunksize: int = CHUNK_FILAS, fetch_size: int = FETCH_SIZE,
+                              on_progress=None, cancelacion=None, filtros: dict = None):
+        """
+        Lee dataset + firmas y guarda el snapshot local, sin tocar el estado
+        del service. Devuelve (df, firmas, movimientos) para pasarlos a
+        establecer_dataset. Los imports filtrados en el servidor no
+        reemplazan el snapshot.
+        """
+        df, movimientos = self.cargar_dataset_sql(chunksize, fetch_size, on_progress, cancelacion, filtros)
+        firmas = self.cargar_firmas_sql(cancelacion)
+        if not filtros:
+            self._guardar_snapshot(df, firmas)
+        return df, firmas, movimientos
+
+    def cargar_dataset_sql(self, chunksize: int = CHUNK_FILAS, fetch_size: int = FETCH_SIZE,
+                           on_progress=None, cancelacion=None, filtros: dict = None):
+        """
+        Lee INVENTORY_SQL por bloques de `chunksize` filas SIN tocar el estado
+        del service (apto para ejecutarse en un hilo de trabajo). Cada bloque se
+        compacta (categóricas / numéricos reducidos) al llegar, de modo que el
+        pico de memoria queda cerca del tamaño final del DataFrame.
+
+        Devuelve (df, movimientos): `movimientos` es la actualización de la
+        tabla de último movimiento con la que se unió la Fecha; se instala
+        con el dataset (establecer_dataset).
+
+        on_progress(filas, filas_por_seg): opcional, se llama tras cada bloque.
+        cancelacion: opcional (Cancelacion) para abortar la sentencia en curso.
+        filtros: opcional, dict de FilterPanel.get_filters(); los filtros que
+                 admiten pushdown se traducen a un WHERE parametrizado (ver
+                 compilar_filtros_sql) y sólo se descargan esas filas.
+        """
+        if on_progress is None:
+            on_progress = self._log_progreso
+        filtro_productos, filtro_filas, params = compilar_filtros_sql(filtros)
+        df = leer_sql_compacto(
+            construir_inventory_sql(filtro_productos, filtro_filas), self.engine,
+            chunksize=chunksize, fetch_size=fetch_size, params=params,
+            on_progress=on_progress, cancelacion=cancelacion, esquema=ESQUEMA_INVENTARIO,
+        )
         # Normaliza nombres de columnas
-        self.df_original.columns = self.df_original.columns.str.strip()
-        self.df_actual = self.df_original.copy()
+        df.columns = df.columns.str.strip()
+        # Fecha del último movimiento: tabla aparte, refrescada incrementalmente
+        movimientos = self.movimientos.actualizar(cancelacion)
+        return self.movimientos.unir(df, movimientos["lookup"]), movimientos
+
+    def cargar_firmas_sql(self, cancelacion=None) -> pd.DataFrame:
+        """
+        Lee la firma (checksum) por (Concatenar, dimID_Tienda) que usa el
+        refresco incremental para detectar productos modificados.
+        """
+        return leer_sql_compacto(INVENTORY_FIRMAS_SQL, self.engine, cancelacion=cancelacion,
+                                 on_progress=lambda *_: None)
+
+    def establecer_dataset(self, df: pd.DataFrame, snapshot_meta: dict = None, firmas: pd.DataFrame = None,
+                           filtros_servidor: dict = None, movimientos: dict = None):
+        """
+        Sustituye el dataset activo por `df` (ya construido) y reinicia el
+        estado derivado. `movimientos`: actualización de la tabla de último
+        movimiento leída con `df` (ver cargar_dataset_sql).
+        """
+        self.pivot_service.cancelar_precalentado()
+        self.movimientos.confirmar(movimientos)
+        self.snapshot_meta = snapshot_meta
+        self.firmas = firmas
+        self.filtros_servidor = filtros_servidor
+        self.df_original = df
+        self.df_actual = self.df_original
+        self._establecer_modelo(ModeloInventario.desde_dataframe(df))
+        print(f"[InventoryService] dataset: {len(df):,} filas, {uso_memoria_mb(df):.1f} MB")
         self.catalogo_descuento = None
         self.filter_mode = None
-        self._last_exclude_year = None
-        self.pivot_service.clear()
+        self._filtrada = None
+        self.pivot_service.configurar_servidor(None)
 
-    def importar_excel(self, df_excel: pd.DataFrame):
-        self.df_original = df_excel.copy()
-        # Normaliza nombres de columnas
-        self.df_original.columns = self.df_original.columns.str.strip()
-        self.df_actual = self.df_original.copy()
+    def _establecer_modelo(self, modelo):
+        self.modelo = modelo
+        self.pivot_service.modelo = modelo
+
+    # -----------------------
+    # Pivot en SQL Server (sin df_original)
+    # -----------------------
+    def preparar_pivot_servidor(self, opcion: str, on_progress=None, cancelacion=None, filtros: dict = None):
+        """
+        Lee en el hilo de trabajo lo necesario para el modo pivot en servidor:
+        lista de tiendas, fechas de último movimiento y el PIVOT de `opcion`.
+        Devuelve un dict para pasarlo a activar_pivot_servidor en el hilo de Tk.
+        """
+        tiendas = self.pivot_service.cargar_tiendas(cancelacion)
+        movimientos = self.movimientos.actualizar(cancelacion)
+        crudo = self.pivot_service.leer_pivot_servidor(opcion, tiendas, filtros, on_progress, cancelacion)
+        return {"tiendas": tiendas, "filtros": filtros, "crudo": {opcion: crudo}, "movimientos": movimientos}
+
+    def activar_pivot_servidor(self, preparado: dict):
+        """
+        Instala el modo pivot en servidor: no hay df_original; cada vista se
+        pide ya pivotada a SQL Server (la primera viene en `preparado`).
+        """
+        self.movimientos.confirmar(preparado.get("movimientos"))
+        self.snapshot_meta = None
+        self.firmas = None
+        self.filtros_servidor = preparado.get("filtros")
+        self.df_original = None
+        self.df_actual = None
+        self._establecer_modelo(None)
         self.catalogo_descuento = None
         self.filter_mode = None
-        self._last_exclude_year = None
-        self.pivot_service.clear()
+        self._filtrada = None
+        self.pivot_service.configurar_servidor(preparado["tiendas"], self.filtros_servidor)
+        self.pivot_service.crudo.update(preparado.get("crudo") or {})
+
+    def leer_vista_servidor(self, opcion: str, on_progress=None, cancelacion=None) -> dict:
+        """
+        PIVOT de la vista `opcion` con los mismos filtros del import (en el
+        hilo de trabajo; no toca el estado). Se instala con agregar_vistas_servidor.
+        """
+        crudo = self.pivot_service.leer_pivot_servidor(
+            opcion, filtros=self.filtros_servidor, on_progress=on_progress, cancelacion=cancelacion
+        )
+        return {opcion: crudo}
+
+    def agregar_vistas_servidor(self, crudo: dict):
+        """Agrega vistas leídas con leer_vista_servidor (si se sigue en modo pivot en servidor)."""
+        if self.pivot_service.en_servidor:
+            self.pivot_service.crudo.update(crudo)
+
+    def falta_vista_servidor(self, opcion: str) -> bool:
+        """¿Modo pivot en servidor sin la vista `opcion` leída todavía?"""
+        return self.pivot_service.en_servidor and opcion not in self.pivot_service.crudo
+
+    @property
+    def pivot_en_servidor(self) -> bool:
+        return self.pivot_service.en_servidor
+
+    @property
+    def hay_datos(self) -> bool:
+        return self.df_original is not None or self.pivot_service.en_servidor
+
+    def valores_region(self) -> list:
+        """Regiones de sucursales disponibles (de df_original o de la lista de tiendas)."""
+        df = self.df_original if self.df_original is not None else self.pivot_service.tiendas
+        if df is None or 'Region' not in df.columns:
+            return []
+        suc = df[df['Region'].str.contains('Sucursales', na=False)]
+        return sorted(suc['Region'].dropna().unique())
+
+    def valores_referencia(self) -> list:
+        """Referencias disponibles (de df_original o de los pivots ya leídos del servidor)."""
+        if self.df_original is not None:
+            fuentes = [self.df_original]
+        else:
+            fuentes = list(self.pivot_service.crudo.values())
+        refs = set()
+        for df in fuentes:
+            if 'Referencia' in df.columns:
+                refs.update(df['Referencia'].dropna().astype(str).unique())
+        return sorted(refs)
+
+    def _post_pivot_servidor(self, exclude_year):
+        """Fecha (unión en cliente) + exclusión de año sobre el resultado del PIVOT."""
+        def _post(df):
+            if 'Concatenar' not in df.columns:
+                return df
+            df = self.movimientos.unir(df)
+            return self._exclude_year_pre_pivot(df, exclude_year)
+        return _post
+
+    # -----------------------
+    # Snapshot local (arranque en caliente)
+    # -----------------------
+    def _clave_snapshot(self):
+        """Clave por servidor + base + hash del SQL. None si no hay engine."""
+        url = getattr(self.engine, "url", None)
+        if url is None:
+            return None
+        return self.snapshots.clave(url.host, url.database, INVENTORY_SQL)
+
+    def _guardar_snapshot(self, df: pd.DataFrame, firmas: pd.DataFrame = None):
+        clave = self._clave_snapshot()
+        if clave is None or not self.snapshots.disponible:
+            return
+        url = self.engine.url
+        meta = {
+            "server": url.host,
+            "database": url.database,
+            "sql_hash": self.snapshots.hash_sql(INVENTORY_SQL),
+        }
+        self.snapshots.guardar(clave, df, meta)
+        if firmas is not None:
+            meta["firmas_hash"] = self.snapshots.hash_sql(INVENTORY_FIRMAS_SQL)
+            self.snapshots.guardar(clave + "-firmas", firmas, meta)
+
+    def estado_snapshot(self):
+        """Devuelve los metadatos del snapshot de esta conexión (o None) y si sigue vigente."""
+        clave = self._clave_snapshot()
+        meta = self.snapshots.metadatos(clave) if clave else None
+        return meta, self.snapshots.vigente(meta)
+
+    def cargar_desde_snapshot(self, permitir_expirado: bool = False) -> bool:
+        """
+        Instala como dataset activo el snapshot local de esta conexión.
+        Devuelve False si no existe, expiró (salvo permitir_expirado) o no se pudo leer.
+        """
+        clave = self._clave_snapshot()
+        if clave is None:
+            return False
+        cargado = self.snapshots.cargar(clave, permitir_expirado=permitir_expirado)
+        if cargado is None:
+            return False
+        df, meta = cargado
+        firmas = self.snapshots.cargar(clave + "-firmas", permitir_expirado=True)
+        # firmas de otra versión de INVENTORY_FIRMAS_SQL: no son comparables
+        # (todo parecería cambiado); sin firmas, el refresco hace un import completo
+        if firmas and firmas[1].get("firmas_hash") != self.snapshots.hash_sql(INVENTORY_FIRMAS_SQL):
+            firmas = None
+        self.establecer_dataset(df, snapshot_meta=meta, firmas=firmas[0] if firmas else None)
+        return True
+
+    # -----------------------
+    # Refresco incremental (delta)
+    # -----------------------
+    @staticmethod
+    def _productos_cambiados(firmas_previas: pd.DataFrame, firmas_nuevas: pd.DataFrame) -> set:
+        """Concatenar cuya firma cambió, apareció o desapareció en alguna tienda."""
+        claves = ['Concatenar', 'dimID_Tienda']
+        previas = firmas_previas[claves + ['Firma']].astype({'Concatenar': str, 'dimID_Tienda': 'int64'})
+        nuevas = firmas_nuevas[claves + ['Firma']].astype({'Concatenar': str, 'dimID_Tienda': 'int64'})
+        m = previas.merge(nuevas, on=claves, how='outer', suffixes=('_prev', '_nueva'))
+        cambiado = m['Firma_prev'].ne(m['Firma_nueva'])
+        return set(m.loc[cambiado, 'Concatenar'])
+
+    def calcular_delta(self, on_progress=None, cancelacion=None):
+        """
+        Detecta los productos modificados desde el último import (comparando
+        firmas por tienda) y relee SÓLO esos productos, sin tocar el estado del
+        service (apto para un hilo de trabajo).
+
+        Devuelve (cambiados, df_delta, firmas_nuevas, movimientos) para
+        aplicar_delta, o None si no hay firmas previas con las que comparar
+        (hace falta un import completo). `movimientos` es la actualización de
+        la tabla de último movimiento: su marca de agua sólo avanza si el
+        delta se aplica.
+        """
+        if self.df_original is None or self.firmas is None:
+            return None
+        firmas_nuevas = self.cargar_firmas_sql(cancelacion)
+        cambiados = self._productos_cambiados(self.firmas, firmas_nuevas)
+        # productos con un movimiento nuevo (cambia su Fecha o entran al inventario)
+        movimientos = self.movimientos.actualizar(cancelacion)
+        cambiados |= movimientos["cambiados"]
+        if not cambiados:
+            return cambiados, None, firmas_nuevas, movimientos
+
+        def _preparar(cursor):
+            cursor.execute(DELTA_TEMP_SQL)
+            if hasattr(cursor, "fast_executemany"):
+                cursor.fast_executemany = True
+            cursor.executemany(DELTA_INSERT_SQL, [(c,) for c in sorted(cambiados)])
+
+        # mismos filtros de servidor que el dataset activo
+        filtro_productos, filtro_filas, params = compilar_filtros_sql(self.filtros_servidor)
+        df_delta = leer_sql_compacto(
+            construir_inventory_sql(DELTA_FILTRO_PRODUCTOS + filtro_productos, filtro_filas), self.engine,
+            params=params, on_progress=on_progress or self._log_progreso, cancelacion=cancelacion,
+            preparar=_preparar, tipos=tipos_compactos_de(self.df_original),
+        )
+        df_delta.columns = df_delta.columns.str.strip()
+        df_delta = self.movimientos.unir(df_delta, movimientos["lookup"])
+        return cambiados, df_delta, firmas_nuevas, movimientos
+
+    @staticmethod
+    def _orden_delta(original: pd.DataFrame, en_cambiados: np.ndarray, df_delta: pd.DataFrame) -> np.ndarray:
+        """
+        Posición de destino de cada fila de [filas conservadas, df_delta]:
+        las conservadas, la suya en `original`; las releídas, la de la primera
+        fila que tenía su producto (en el orden en que llegan); los productos
+        nuevos, al final. Así el orden (y el de los pivots) es el de
+        `original`, que ya viene en el orden de SQL Server (ORDEN_FILAS_SQL,
+        con la intercalación del servidor).
+        """
+        previas = np.flatnonzero(en_cambiados)
+        primera = pd.Series(previas, index=original['Concatenar'].to_numpy()[previas].astype(str))
+        primera = primera[~primera.index.duplicated()]
+        claves = df_delta['Concatenar'].astype(str).to_numpy()
+        destino = primera.reindex(claves).to_numpy(dtype=np.float64, copy=True)
+        nuevos = np.isnan(destino)
+        destino[nuevos] = len(original) + pd.factorize(claves[nuevos])[0]
+        return np.concatenate([np.flatnonzero(~en_cambiados), destino])
+
+    def aplicar_delta(self, delta) -> set:
+        """
+        Sustituye en df_original las filas de los productos cambiados por las
+        releídas (en la posición que tenía cada producto; los nuevos, al
+        final) y sólo invalida esos Concatenar en las cachés del pivot.
+        """
+        cambiados, df_delta, firmas_nuevas, movimientos = delta
+        self.firmas = firmas_nuevas
+        self.movimientos.confirmar(movimientos)
+        if not cambiados:
+            return cambiados
+
+        self.pivot_service.cancelar_precalentado()
+        original = self.df_original
+        en_cambiados = original['Concatenar'].isin(cambiados).to_numpy()
+        conserva = original[~en_cambiados]
+        if df_delta is None or df_delta.empty:
+            df = conserva.reset_index(drop=True)
+        else:
+            df = concatenar_bloques([conserva, df_delta[list(conserva.columns)]])
+            orden = np.argsort(self._orden_delta(original, en_cambiados, df_delta), kind='stable')
+            df = df.take(orden).reset_index(drop=True)
+
+        self.df_original = df
+        self._establecer_modelo(ModeloInventario.desde_dataframe(df, previo=self.modelo))
+        self.snapshot_meta = None
+        if not self.filtros_servidor:
+            self._guardar_snapshot(df, firmas_nuevas)
+        self.pivot_service.invalidar_productos(
+            cambiados,
+            lambda opc, huella: self._preparar_base(opc, dict(huella).get('exclude_year')),
+        )
+        print(f"[InventoryService] refresco incremental: {len(cambiados)} productos actualizados")
+        return cambiados
+
+    def refrescar_delta(self, on_progress=None, cancelacion=None):
+        """
+        Refresco incremental completo (leer + aplicar). Si no hay firmas previas,
+        hace un import completo. Devuelve el set de Concatenar actualizados
+        (None si hubo import completo).
+        """
+        delta = self.calcular_delta(on_progress, cancelacion)
+        if delta is None:
+            self.importar_datos_sql(on_progress=on_progress, cancelacion=cancelacion)
+            return None
+        return self.aplicar_delta(delta)
+
+    @staticmethod
+    def _log_progreso(filas: int, filas_por_seg: float):
+        print(f"[InventoryService] {filas} filas importadas ({filas_por_seg:,.0f} filas/s)")
+
+    def importar_excel(self, df_excel: pd.DataFrame):
+        # Normaliza nombres de columnas (sin tocar df_excel)
+        df = df_excel.rename(columns=str.strip)
+        self.establecer_dataset(aplicar_esquema(df))
 
     def importar_catalogo_descuento(self, df_catalogo: pd.DataFrame):
         """
         Espera columnas:
           - 'Concatenar'
           - '% Descuento'
+        Queda como Series int16 (porcentaje entero) indexada por Concatenar.
         """
         df_catalogo.columns = df_catalogo.columns.str.strip()
         if 'Concatenar' in df_catalogo.columns and '% Descuento' in df_catalogo.columns:
-            self.catalogo_descuento = pd.DataFrame({
-                'Concatenar': df_catalogo['Concatenar'],
-                'Descuento_Catalogo': df_catalogo['% Descuento']
-            })
+            # porcentaje entero por Concatenar (sin vacíos; si se repite, vale la primera)
+            pct = porcentajes(df_catalogo['% Descuento'])
+            validos = ~np.isnan(pct) & (np.abs(pct) <= np.iinfo(np.int16).max)
+            claves = df_catalogo['Concatenar'].astype(str).to_numpy()[validos]
+            catalogo = pd.Series(pct[validos].astype(np.int16), index=pd.Index(claves),
+                                 name='Descuento_Catalogo')
+            self.catalogo_descuento = catalogo[~catalogo.index.duplicated(keep='first')]
+            self._catalogo_ids = None
         else:
             raise ValueError(
                 "El catálogo de descuentos debe contener las columnas "
@@ -61,95 +463,110 @@ class InventoryService:
     # -----------------------
     # Helper: excluir por AÑO (robusto)
     # -----------------------
-    def _exclude_year_pre_pivot(self, df: pd.DataFrame, exclude_year):
+    def _exclude_year_pre_pivot(self, df: pd.DataFrame, exclude_year, anios: np.ndarray = None):
         """
         Excluye filas cuyo AÑO == exclude_year. Ignora día/mes.
-
-        Soporta:
-          - columna de año: 'Año' / 'Anio' / 'Year'
-          - columna de fecha: cualquier col que contenga 'fecha'
-            o iguale 'fechadoc' / 'date' / 'fecharegistro'
+        `anios` (ver _anios) evita volver a leer la columna de `df`.
         """
         if df is None or df.empty:
             return df
-        if exclude_year is None or str(exclude_year).strip() == "":
+        year = dict(self._huella_pre_pivot(exclude_year))['exclude_year']
+        if year is None:
             return df
-
-        try:
-            year = int(str(exclude_year).strip())
-        except Exception:
+        if anios is None:
+            anios = self._anios(df)
+        if anios is None:
             return df
+        excluir = anios == year
+        return df[~excluir] if excluir.any() else df
 
-        # mapa normalizado -> nombre original
-        norm_map = {c.strip().lower(): c for c in df.columns}
+    def _anios(self, df: pd.DataFrame):
+        """
+        Año de cada fila de `df` como int16 (SIN_ANIO si no tiene) o None si
+        `df` no tiene columna de año/fecha. Las fechas se convierten una vez
+        por valor distinto (Fecha llega como categoría dd/mm/aaaa).
+        """
+        if df is None or df.empty:
+            return None
+        encontrada = self._columna_anio(df)
+        if encontrada is None:
+            return None
+        col, es_fecha = encontrada
+        codigos, valores = self._valores_distintos(df[col])
+        if es_fecha:
+            anios = pd.to_datetime(pd.Series(valores), errors="coerce", dayfirst=True).dt.year
+        else:
+            anios = pd.to_numeric(pd.Series(valores), errors="coerce")
+            anios = anios.where(anios == anios.round())  # 2023.5 no es ningún año
+        por_valor = anios.fillna(SIN_ANIO).to_numpy(dtype=np.int64)
+        por_valor = np.where(np.abs(por_valor) > np.iinfo(np.int16).max, SIN_ANIO, por_valor)
+        por_valor = np.append(por_valor, SIN_ANIO).astype(np.int16)  # código -1 (nulo)
+        return por_valor[codigos]
+
+    def _columna_anio(self, df: pd.DataFrame):
+        """
+        (columna, ¿es fecha?) de donde sale el año de `df`, o None. Se
+        resuelve una vez por esquema (tupla de columnas):
+          - columna de año: 'Año' / 'Anio' / 'Year'
+          - columna de fecha: cualquier col que contenga 'fecha'
+            o iguale 'fechadoc' / 'date' / 'fecharegistro'
+          - último intento: la primera columna que parsee a fecha
+        """
+        clave = tuple(df.columns)
+        if clave in self._columnas_anio:
+            return self._columnas_anio[clave]
+        esquema = resolver_esquema(clave)
+        encontrada = None
 
         # 1) columna de AÑO numérico
-        for key in ("año", "anio", "year"):
-            if key in norm_map:
-                col = norm_map[key]
-                s = pd.to_numeric(df[col], errors="coerce")
-                return df[s.ne(year)]
-
-        # 2) columnas de FECHA (buscar candidatas por nombre)
-        fecha_candidates = []
-        for norm_name, original in norm_map.items():
-            if ("fecha" in norm_name) or (norm_name in ("fechadoc", "date", "fecharegistro")):
-                fecha_candidates.append(original)
-
-        # probar candidatas de fecha hasta que alguna parsee
-        for col in fecha_candidates:
-            years = pd.to_datetime(df[col], errors="coerce", dayfirst=True).dt.year
-            if years.notna().any():
-                return df[years.ne(year)]
+        if esquema.anio is not None:
+            encontrada = (esquema.anio, False)
+
+        # 2) columnas de FECHA (candidatas por nombre), hasta que alguna parsee
+        if encontrada is None:
+            for col in esquema.fechas:
+                if self._proporcion_fechas(df[col]) > 0:
+                    encontrada = (col, True)
+                    break
 
         # 3) último intento: escanear todas las columnas y ver si alguna parsea a fecha
-        for col in df.columns:
-            years = pd.to_datetime(df[col], errors="coerce", dayfirst=True).dt.year
-            if years.notna().mean() >= 0.5:
-                return df[years.ne(year)]
+        if encontrada is None:
+            for col in df.columns:
+                if self._proporcion_fechas(df[col]) >= 0.5:
+                    encontrada = (col, True)
+                    break
 
-        # 4) no se encontró nada compatible
-        return df
+        self._columnas_anio[clave] = encontrada
+        return encontrada
 
-    # -----------------------
-    # Helper: normalización de nombres
-    # -----------------------
     @staticmethod
-    def _norm_name(s: str) -> str:
-        if s is None:
-            return ""
-        s = str(s).strip().lower().replace(" ", "").replace("_", "")
-        # quitar acentos
-        s = unicodedata.normalize("NFKD", s)
-        s = "".join(ch for ch in s if not unicodedata.combining(ch))
-        return s
+    def _valores_distintos(s: pd.Series):
+        """(códigos por fila, valores distintos) de `s`; nulos con código -1."""
+        if isinstance(s.dtype, pd.CategoricalDtype):
+            return s.cat.codes.to_numpy(), s.cat.categories
+        return pd.factorize(s.to_numpy())
+
+    @classmethod
+    def _proporcion_fechas(cls, s: pd.Series) -> float:
+        """Proporción de filas de `s` que parsean a fecha (por valor distinto)."""
+        codigos, valores = cls._valores_distintos(s)
+        if len(codigos) == 0:
+            return 0.0
+        validos = pd.to_datetime(pd.Series(valores, dtype=object), errors="coerce", dayfirst=True).notna()
+        return float(np.append(validos.to_numpy(), False)[codigos].mean())
 
     # -----------------------
     # NUEVO: detectar columna de existencia (nivel “base”)
     # -----------------------
-    def _find_exist_col(self, df: pd.DataFrame):
+    @staticmethod
+    def _find_exist_col(df: pd.DataFrame):
         """
         Detecta una columna plausible de existencia/stock/cantidad/inventario
-        en el dataframe “base” (pre-pivot).
+        en el dataframe “base” (pre-pivot). Ver EsquemaColumnas.
         """
         if df is None or df.empty:
             return None
-        priority = [
-            "existenciatotal", "existencia",
-            "stocktotal", "stock",
-            "cantidadtotal", "cantidad",
-            "inventariototal", "inventario",
-        ]
-        # exactos por prioridad
-        for c in df.columns:
-            if self._norm_name(c) in priority:
-                return c
-        # por contiene
-        for c in df.columns:
-            n = self._norm_name(c)
-            if any(k in n for k in ["existencia", "stock", "cantidad", "inventario"]):
-                return c
-        return None
+        return resolver_esquema(df.columns).existencia
 
     # -----------------------
     # NUEVO: anular promo/desc en filas sin stock (pre-pivot)
@@ -161,26 +578,36 @@ class InventoryService:
         """
         if df is None or df.empty:
             return df
-        out = df.copy()
 
-        exist_col = self._find_exist_col(out)
+        exist_col = self._find_exist_col(df)
         if not exist_col:
-            return out  # si no hay columna de existencia detectable, no tocamos nada
+            return df  # si no hay columna de existencia detectable, no tocamos nada
 
-        exist_vals = pd.to_numeric(out[exist_col], errors="coerce").fillna(0)
+        exist_vals = pd.to_numeric(df[exist_col], errors="coerce").fillna(0)
         no_stock = exist_vals <= 0
+        if not no_stock.any():
+            return df
+
+        # copia superficial: con Copy-on-Write sólo se copian las columnas que cambian
+        out = df.copy(deep=False)
+
+        esquema = resolver_esquema(out.columns)
 
         # Promoción -> 0
-        if 'Promocion' in out.columns:
-            out.loc[no_stock, 'Promocion'] = 0
-
-        # Descuento -> 0 manteniendo estilo (num o "NN%")
-        if 'Descuento' in out.columns:
-            as_text = out['Descuento'].astype(str)
-            if as_text.str.contains('%').any():
-                out.loc[no_stock, 'Descuento'] = "0%"
-            else:
-                out.loc[no_stock, 'Descuento'] = 0
+        if esquema.promocion is not None:
+            out.loc[no_stock, esquema.promocion] = 0
+
+        # Descuento -> 0 (porcentaje entero; "0%" si la columna quedó en texto)
+        col_desc = esquema.descuento
+        if col_desc is not None:
+            desc = out[col_desc]
+            cero = 0
+            if not pd.api.types.is_numeric_dtype(desc.dtype):
+                as_text = pd.Series(desc.unique()).astype(str)
+                cero = "0%" if as_text.str.contains('%').any() else 0
+            if isinstance(desc.dtype, pd.CategoricalDtype) and cero not in desc.cat.categories:
+                out[col_desc] = desc.cat.add_categories([cero])
+            out.loc[no_stock, col_desc] = cero
 
         return out
 
@@ -200,18 +627,11 @@ class InventoryService:
         if df is None or df.empty:
             return df
 
-        # --- 1) Buscar columna de pivot estilo "Casa_matriz_Total" ---
-        normalized = {orig: self._norm_name(orig) for orig in df.columns}
-        candidates = []
-        for orig, n in normalized.items():
-            if n in ("casamatriztotal", "totalcasamatriz"):
-                candidates.append(orig)
-            elif n.startswith("casamatriz") and any(k in n for k in ("total", "existencia", "stock", "cantidad", "inventario")):
-                candidates.append(orig)
-
-        if candidates:
-            col = candidates[0]
-            s = pd.to_numeric(df[col], errors="coerce")
+        esquema = resolver_esquema(df.columns)
+
+        # --- 1) Columna de pivot estilo "Casa_matriz_Total" ---
+        if esquema.total_casa_matriz is not None:
+            s = pd.to_numeric(df[esquema.total_casa_matriz], errors="coerce")
             mask = s.ge(min_val) & s.le(max_val)  # 1..11
             return df[mask]
 
@@ -222,26 +642,7 @@ class InventoryService:
             if out.empty:
                 return out
 
-        def find_exist_col(columns):
-            prio = [
-                "existenciatotal", "existencia",
-                "stocktotal", "stock",
-                "cantidadtotal", "cantidad",
-                "inventariototal", "inventario",
-            ]
-            # exactos por prioridad
-            for wanted in prio:
-                for c in columns:
-                    if self._norm_name(c) == wanted:
-                        return c
-            # por contiene
-            for c in columns:
-                n = self._norm_name(c)
-                if any(k in n for k in ["existencia", "stock", "cantidad", "inventario"]):
-                    return c
-            return None
-
-        exist_col = find_exist_col(out.columns)
+        exist_col = esquema.existencia
         if not exist_col:
             return out
 
@@ -249,9 +650,248 @@ class InventoryService:
         mask = vals.ge(min_val) & vals.le(max_val)
         return out[mask]
 
+    # -----------------------
+    # Base pre-pivot
+    # -----------------------
+    def _preparar_base(self, opc, exclude_year, df: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Aplica sobre `df` (por defecto df_original) las transformaciones previas
+        al pivot: recorte por región según la opción, exclusión de año y
+        anulación de promo/desc en filas sin stock.
+
+        Con ModeloInventario (y sin `df`) trabaja sobre sus hechos: la región
+        se resuelve por tienda_id y el año por variante_id. Sin `df` cada etapa
+        se memoriza por versión del dataset y parámetros (ver _etapa).
+        """
+        if df is None and self.modelo is not None:
+            return self._preparar_hechos(opc, exclude_year)
+        if df is not None:
+            return self._normalize_discount_and_promo_by_stock(
+                self._exclude_year_pre_pivot(self._recortar_region(df, opc), exclude_year)
+            )
+
+        # el año se excluye antes que la región: los años de df_original se
+        # calculan una sola vez por dataset y están alineados con sus filas
+        year = dict(self._huella_pre_pivot(exclude_year))['exclude_year']
+        anios = self._etapa('anios', calcular=lambda: self._anios(self.df_original))
+        sin_year = self._etapa('año', year, calcular=lambda: self._exclude_year_pre_pivot(
+            self.df_original, exclude_year, anios))
+        region = self._etapa('region', opc, year, calcular=lambda: self._recortar_region(sin_year, opc))
+        # <<< NUEVO: anular promo/desc cuando no hay stock (pre-pivot) >>>
+        return self._etapa('normalizado', opc, year,
+                           calcular=lambda: self._normalize_discount_and_promo_by_stock(region))
+
+    @staticmethod
+    def _recortar_region(df_base: pd.DataFrame, opc) -> pd.DataFrame:
+        """Región (si existe) según la opción del pivot."""
+        if 'Region' in df_base.columns:
+            if opc == "Solo Sucursales":
+                df_base = df_base[df_base['Region'].str.contains('Sucursales', na=False)]
+            elif opc == "Solo Casa Matriz":
+                df_base = df_base[df_base['Region'].str.contains('Casa Matriz', na=False)]
+        return df_base
+
+    def _etapa(self, nombre: str, *params, calcular):
+        """
+        Resultado memorizado de la etapa `nombre` para la versión actual del
+        dataset y `params` (hashables); `calcular()` sólo se llama si falta.
+        Al cambiar la versión se descartan las etapas anteriores.
+        """
+        clave = (nombre, self.pivot_service.version) + params
+        with self._etapas_lock:
+            if clave in self._etapas:
+                self._etapas.move_to_end(clave)
+                return self._etapas[clave]
+        valor = calcular()
+        with self._etapas_lock:
+            for vieja in [c for c in self._etapas if c[1] != clave[1]]:
+                del self._etapas[vieja]
+            self._etapas[clave] = valor
+            while len(self._etapas) > MAX_ETAPAS:
+                self._etapas.popitem(last=False)
+        return valor
+
+    @staticmethod
+    def _huella_pre_pivot(exclude_year) -> tuple:
+        """Parámetros que cambian la base pre-pivot, normalizados (clave de caché)."""
+        try:
+            year = int(str(exclude_year).strip()) if exclude_year is not None else None
+        except ValueError:
+            year = None
+        return (('exclude_year', year),)
+
+    def _preparar_hechos(self, opc, exclude_year, normalizar: bool = True) -> pd.DataFrame:
+        modelo = self.modelo
+        year = dict(self._huella_pre_pivot(exclude_year))['exclude_year']
+
+        def _region():
+            hechos = modelo.hechos
+            if opc == "Solo Sucursales":
+                hechos = hechos[hechos['tienda_id'].isin(modelo.tiendas_de_region('Sucursales'))]
+            elif opc == "Solo Casa Matriz":
+                hechos = hechos[hechos['tienda_id'].isin(modelo.tiendas_de_region('Casa Matriz'))]
+            return hechos
+
+        def _sin_year():
+            # el año (Fecha) es un atributo de la variante del producto
+            hechos = self._etapa('region', opc, calcular=_region)
+            anios = self._etapa('anios', calcular=lambda: self._anios(modelo.variantes))
+            if year is None or anios is None:
+                return hechos
+            excluidos = anios == year
+            if not excluidos.any():
+                return hechos
+            return hechos[~excluidos[hechos['variante_id'].to_numpy()]]
+
+        hechos = self._etapa('año', opc, year, calcular=_sin_year)
+        if not normalizar:
+            return hechos
+        return self._etapa('normalizado', opc, year,
+                           calcular=lambda: self._normalize_discount_and_promo_by_stock(hechos))
+
+    def _pivot_productos(self, opc, exclude_year, ids: np.ndarray) -> pd.DataFrame:
+        """
+        Pivot de la vista `opc` sólo para los producto_id `ids` (filtros
+        empujados por debajo del pivot): se recortan los hechos ya
+        normalizados de la vista; columnas y tipos salen de la vista completa.
+        """
+        year = dict(self._huella_pre_pivot(exclude_year))['exclude_year']
+        vista = self._preparar_hechos(opc, exclude_year)
+        perfil = self._etapa('perfil', opc, year, calcular=lambda: self.modelo.perfil_vista(opc, vista))
+        elegidos = np.zeros(len(self.modelo.claves), dtype=bool)
+        elegidos[ids] = True
+        hechos = vista[elegidos[vista['producto_id'].to_numpy()]]
+        return self.pivot_service.pivot_productos(opc, hechos, perfil)
+
+    def _precalentar_vistas(self, opc, exclude_year, huella: tuple, base_maestra, incluir_actual: bool = False):
+        """Encola en PivotService las vistas distintas de `opc` (y `opc` primero si se pide) con el mismo año excluido."""
+        if self.df_original is None:
+            return
+
+        def _base(opcion):
+            return lambda: self._preparar_base(opcion, exclude_year)
+
+        vistas = [(o, _base(o)) for o in VISTAS_PIVOT if o != opc]
+        if incluir_actual:
+            vistas.insert(0, (opc, _base(opc)))
+        self.pivot_service.precalentar(
+            vistas, huella, base_maestra=base_maestra if self.modelo is not None else None
+        )
+
+    def _catalogo_de_vista(self, df_view: pd.DataFrame) -> np.ndarray:
+        """
+        Porcentaje del catálogo de cada fila de df_view (float64, NaN si el
+        producto no está): get_indexer sobre las claves del catálogo, por
+        producto_id (con el modelo) o por valor distinto de Concatenar.
+        """
+        cat = self.catalogo_descuento
+        valores = np.append(cat.to_numpy(dtype=np.float64), np.nan)  # -1 -> NaN
+        if self.modelo is not None and df_view.index.name == 'producto_id':
+            previo = self._catalogo_ids
+            if previo is None or previo[0] is not cat or previo[1] is not self.modelo:
+                por_id = valores[cat.index.get_indexer(self.modelo.claves)]
+                self._catalogo_ids = previo = (cat, self.modelo, por_id)
+            return previo[2][df_view.index.to_numpy()]
+        conc = df_view['Concatenar']
+        if isinstance(conc.dtype, pd.CategoricalDtype):
+            codigos, claves = conc.cat.codes.to_numpy(), conc.cat.categories
+        else:
+            codigos, claves = pd.factorize(conc.to_numpy())
+        por_valor = valores[cat.index.get_indexer(pd.Index(claves).astype(str))]
+        return np.append(por_valor, np.nan)[codigos]
+
     # -----------------------
     # Filtros + composición
     # -----------------------
+    def _filtrar_pivot(self, filtros: dict, solo_matriz_exist_1_11: bool, exclude_year, huella: tuple,
+                       df_base, base_maestra):
+        """
+        Pivot de la vista + filtros de apply_filters + rango 1..11 de Casa
+        Matriz. Devuelve (vista, IndiceFiltros de sus filas o None).
+        """
+        opc = filtros['opcion']
+        usa_modelo = self.modelo is not None and not self.pivot_service.en_servidor
+
+        # Plan: los filtros por atributo del producto (marcas, sublíneas,
+        # referencia) se evalúan antes del pivot si éste no está en caché y la
+        # columna tiene un solo valor por producto (si varía entre códigos de
+        # barras, el filtro es por fila y queda sobre el pivot)
+        plan = planificar_filtros(
+            filtros,
+            pivot_en_cache=self.pivot_service.en_cache(opc, huella),
+            columnas_producto=self.modelo.uniformes if usa_modelo else (),
+        )
+        self.plan_filtros = plan
+
+        if plan.empuja:
+            vacios = dict(opcion=opc, region='Todas', marca='', referencia='', exclude_marcas=None,
+                          solo_promo_1=False, exclude_sublineas=None)
+            productos = apply_filters(self.modelo.productos, **{**vacios, **plan.productos})
+            pivot_df = self._pivot_productos(opc, exclude_year, productos.index.to_numpy())
+        else:
+            pivot_df = self.pivot_service.get_pivot(
+                opc, df_base, self._post_pivot_servidor(exclude_year), huella=huella,
+                base_maestra=base_maestra if self.modelo is not None else None,
+            )
+        # las vistas del selector que falten (también ésta, si se empujaron
+        # filtros) se construyen completas en segundo plano
+        self._precalentar_vistas(opc, exclude_year, huella, base_maestra, incluir_actual=plan.empuja)
+
+        # Si no existe 'Referencia' en el pivot, no se filtra por referencia
+        posteriores = dict(plan.posteriores)
+        if 'Referencia' not in pivot_df.columns:
+            posteriores['referencia'] = ''  # evita filtrar por referencia si no está
+
+        # Filtros sobre el pivot (incluye exclude_sublineas si no se empujó),
+        # con el índice de filtros del pivot cacheado si lo hay
+        df_view, indice = self._filtrar_con_indice(pivot_df, self.pivot_service.indice_de(pivot_df), posteriores)
+
+        # Solo Casa Matriz con existencia 1..11 (si se activó)
+        if solo_matriz_exist_1_11:
+            df_view, indice = self._apply_only_matriz_exist_range(df_view, 1, 11), None
+        return df_view, indice
+
+    def _refinar(self, df: pd.DataFrame, indice, opc, extra: dict):
+        """Aplica a una vista ya filtrada sólo los predicados agregados (ver refinamiento)."""
+        extra = dict(extra)
+        solo_matriz = extra.pop('solo_matriz_exist_1_11', False)
+        if extra:
+            vacios = dict(opcion=opc, region='Todas', marca='', referencia='', exclude_marcas=None,
+                          solo_promo_1=False, exclude_sublineas=None)
+            df, indice = self._filtrar_con_indice(df, indice, {**vacios, **extra})
+        if solo_matriz:
+            df, indice = self._apply_only_matriz_exist_range(df, 1, 11), None
+        return df, indice
+
+    @staticmethod
+    def _duplicados_descuento(df: pd.DataFrame, indice, normalizados: dict) -> np.ndarray:
+        """
+        Marcas de (producto, Descuento) repetido en la vista filtrada `df`:
+        las calculadas una vez por pivot en su IndiceFiltros si `indice` sigue
+        alineado con `df`; si no, un bincount sobre la vista.
+        """
+        if indice is not None and indice.filas == len(df):
+            marcas = indice.duplicados_descuento(normalizados['solo_promo_1'])
+            if marcas is not None:
+                return marcas
+        producto = clave_producto(df)
+        if producto is None or 'Descuento' not in df.columns:
+            return np.zeros(len(df), dtype=bool)
+        return marcar_duplicados(producto, df['Descuento'])
+
+    @staticmethod
+    def _filtrar_con_indice(df: pd.DataFrame, indice, filtros: dict):
+        """
+        apply_filters(df, **filtros) resuelto con `indice` (IndiceFiltros de
+        `df`) cuando se puede. Devuelve (vista, índice de sus filas o None).
+        """
+        if indice is not None and indice.filas == len(df) and not df.empty:
+            conservar = mascara_filtros(indice, **filtros)
+            if conservar is not None:
+                return df[conservar], indice.recortar(conservar)
+        out = apply_filters(df, **filtros)
+        return out, (indice if out is df else None)
+
     def aplicar_filtros(
         self,
         opc,
@@ -271,40 +911,21 @@ class InventoryService:
         """
         Pipeline completo de filtros y composición de vista.
         """
-        if self.df_original is None:
+        if not self.hay_datos:
             return None
 
-        # Base
-        df_base = self.df_original
-
-        # Región (si existe)
-        if 'Region' in df_base.columns:
-            if opc == "Solo Sucursales":
-                df_base = df_base[df_base['Region'].str.contains('Sucursales', na=False)]
-            elif opc == "Solo Casa Matriz":
-                df_base = df_base[df_base['Region'].str.contains('Casa Matriz', na=False)]
-
-        # Excluir año ANTES del pivot
-        df_base = self._exclude_year_pre_pivot(df_base, exclude_year)
+        # Base pre-pivot (región + año + promo/desc sin stock), sólo si el pivot
+        # no está en caché; en modo servidor esto lo hace el propio PIVOT
+        # (año: ver _post_pivot_servidor)
+        def df_base():
+            return self._preparar_base(opc, exclude_year)
 
-        # <<< NUEVO: anular promo/desc cuando no hay stock (pre-pivot) >>>
-        df_base = self._normalize_discount_and_promo_by_stock(df_base)
+        # Pivot (caché por opción + versión del dataset + año excluido)
+        def base_maestra():
+            return self._preparar_base("Todo", exclude_year)
 
-        # Si cambió el año a excluir, invalida caché del pivot
-        if exclude_year != self._last_exclude_year:
-            self.pivot_service.clear()
-            self._last_exclude_year = exclude_year
-
-        # Pivot (cacheado)
-        pivot_df = self.pivot_service.get_pivot(opc, df_base)
-
-        # Si no existe 'Referencia' en el pivot, no se filtra por referencia
-        if 'Referencia' not in pivot_df.columns:
-            referencia = ''  # evita filtrar por referencia si no está
-
-        # Filtros base (incluye exclude_sublineas)
-        df_view = apply_filters(
-            pivot_df,
+        huella = self._huella_pre_pivot(exclude_year)
+        filtros = dict(
             opcion=opc,
             region=region,
             marca='',
@@ -312,40 +933,54 @@ class InventoryService:
             exclude_marcas=exclude_list,
             solo_promo_1=solo_1,
             exclude_sublineas=exclude_sublineas,
-        ).copy()
+        )
+        clave = (opc, self.pivot_service.version, huella)
+        normalizados = normalizar_filtros({**filtros, 'solo_matriz_exist_1_11': solo_matriz_exist_1_11})
 
-        # Solo Casa Matriz con existencia 1..11 (si se activó)
-        if solo_matriz_exist_1_11:
-            df_view = self._apply_only_matriz_exist_range(df_view, 1, 11)
-
-        # Merge catálogo de descuentos (si está disponible)
-        if self.catalogo_descuento is not None:
-            if 'Concatenar' in df_view.columns and 'Concatenar' in self.catalogo_descuento.columns:
-                df_view = df_view.merge(self.catalogo_descuento, how='left', on='Concatenar')
-
-                # Normalizar vacío/NaN y rellenar con 'Descuento' si está vacío
-                df_view['Descuento_Catalogo'] = (
-                    df_view['Descuento_Catalogo']
-                    .fillna("")
-                    .replace(["nan", "NaN"], "")
-                )
-                mask_vacio = df_view['Descuento_Catalogo'].astype(str).str.strip() == ""
-                if 'Descuento' in df_view.columns:
-                    df_view.loc[mask_vacio, 'Descuento_Catalogo'] = df_view.loc[mask_vacio, 'Descuento']
-
-                # Formatear como porcentaje entero (e.g., "23%")
-                def _formatea_pct(serie):
-                    s = serie.astype(str).str.replace('%', '', regex=False).str.strip()
-                    s_num = pd.to_numeric(s, errors='coerce')
-                    s_fmt = s_num.dropna().apply(lambda x: f"{int(round(x))}%")
-                    serie.update(s_fmt)
-                    return serie
-
-                df_view['Descuento_Catalogo'] = _formatea_pct(df_view['Descuento_Catalogo'])
-            else:
-                df_view['Descuento_Catalogo'] = ""
+        # Si los filtros sólo se restringieron, basta aplicar lo nuevo a la vista anterior
+        filtrada = None
+        if self._filtrada is not None and self._filtrada[0] == clave:
+            extra = refinamiento(self._filtrada[1], normalizados)
+            if extra is not None:
+                self.plan_filtros = PlanFiltros({}, extra, [f"refinamiento de la vista anterior: {extra or 'sin cambios'}"])
+                filtrada, indice = self._refinar(self._filtrada[2], self._filtrada[3], opc, extra)
+        if filtrada is None:
+            filtrada, indice = self._filtrar_pivot(filtros, solo_matriz_exist_1_11, exclude_year, huella,
+                                                   df_base, base_maestra)
+        self._filtrada = (clave, normalizados, filtrada, indice)
+
+        # La vista filtrada queda guardada (y sin filtros es el pivot cacheado):
+        # la copia superficial evita que las columnas agregadas abajo lleguen a
+        # ellos (con Copy-on-Write no se copia ningún dato).
+        df_view = filtrada.copy(deep=False)
+
+        # Duplicados por ('Concatenar', 'Descuento'); los filtros de abajo
+        # (catálogo, modo) quitan filas junto con su marca
+        if desc_dup_var:
+            df_view['_dup_desc'] = self._duplicados_descuento(filtrada, indice, normalizados)
         else:
+            df_view['_dup_desc'] = False
+
+        # Catálogo de descuentos (si está disponible): porcentaje por producto,
+        # o el Descuento de la fila si el producto no está en el catálogo
+        pct_catalogo = None
+        if self.catalogo_descuento is not None and 'Concatenar' in df_view.columns:
+            pct_catalogo = self._catalogo_de_vista(df_view)
+        pct_desc = porcentajes(df_view['Descuento']) if 'Descuento' in df_view.columns else None
+        if pct_catalogo is None:
             df_view['Descuento_Catalogo'] = ""
+        else:
+            sin_catalogo = np.isnan(pct_catalogo)
+            pct = np.where(sin_catalogo, pct_desc, pct_catalogo) if pct_desc is not None else pct_catalogo
+            if pct_desc is None or pd.api.types.is_numeric_dtype(df_view['Descuento'].dtype):
+                # entero como Descuento; 'NN%' sólo al mostrar (utils/formato.py)
+                df_view['Descuento_Catalogo'] = pd.array(pct, dtype='Int16')
+            else:
+                # Descuento en texto: se muestra igual que él
+                texto = formatear_porcentajes(pct)
+                crudo = np.isnan(pct)
+                texto[crudo] = df_view['Descuento'].to_numpy(dtype=object)[crudo]
+                df_view['Descuento_Catalogo'] = texto
 
         # Colocar 'Descuento_Catalogo' junto a 'Descuento' si ambas existen
         if 'Descuento' in df_view.columns and 'Descuento_Catalogo' in df_view.columns:
@@ -356,21 +991,15 @@ class InventoryService:
                 cols.insert(idx + 1, 'Descuento_Catalogo')
                 df_view = df_view[cols]
 
-        # Filtros de coincidencia / no coincidencia
-        if filter_solo_coincide and not filter_solo_no_coincide:
-            if 'Descuento' in df_view.columns and 'Descuento_Catalogo' in df_view.columns:
-                df_view = df_view[
-                    (df_view['Descuento_Catalogo'].notna()) &
-                    (df_view['Descuento'].notna()) &
-                    (df_view['Descuento_Catalogo'] == df_view['Descuento'])
-                ]
-        elif filter_solo_no_coincide and not filter_solo_coincide:
-            if 'Descuento' in df_view.columns and 'Descuento_Catalogo' in df_view.columns:
-                df_view = df_view[
-                    (df_view['Descuento_Catalogo'].isna()) |
-                    (df_view['Descuento'].isna()) |
-                    (df_view['Descuento_Catalogo'] != df_view['Descuento'])
-                ]
+        # Filtros de coincidencia / no coincidencia (porcentajes enteros; sin
+        # valor de catálogo coincide con el propio Descuento)
+        if (filter_solo_coincide != filter_solo_no_coincide) and pct_desc is not None:
+            if pct_catalogo is None:
+                coincide = np.zeros(len(df_view), dtype=bool)
+            else:
+                coincide = df_view['Descuento'].notna().to_numpy() & (
+                    np.isnan(pct_catalogo) | (pct_catalogo == pct_desc))
+            df_view = df_view[coincide if filter_solo_coincide else ~coincide]
 
         # Promocion -> 0/1 si es posible
         if 'Promocion' in df_view.columns:
@@ -386,19 +1015,13 @@ class InventoryService:
                 .astype(int, errors='ignore')
             )
 
-        # Marcar duplicados por ('Concatenar', 'Descuento')
-        if desc_dup_var and 'Concatenar' in df_view.columns and 'Descuento' in df_view.columns:
-            df_view['_dup_desc'] = df_view.duplicated(subset=['Concatenar', 'Descuento'], keep=False)
-        else:
-            df_view['_dup_desc'] = False
-
         # Aplicar modo de filtro (unique / dup)
         if filter_mode == 'unique':
             df_view = df_view[~df_view['_dup_desc']]
         elif filter_mode == 'dup':
             df_view = df_view[df_view['_dup_desc']]
 
-        self.df_actual = df_view.copy()
+        self.df_actual = df_view
         return self.df_actual
 
     # -----------------------
@@ -0,0 +1,197 @@
+# components/services/movimiento_service.py
+import time
+import numpy as np
+import pandas as pd
+from components.query import construir_ultimo_movimiento_sql
+from components.db_to_dataframe import leer_sql_por_bloques
+
+# Cada cuánto se relee la tabla completa en vez de sólo Numero > marca de
+# agua: una transferencia que pasa a Status 2 después de que otras con Numero
+# mayor subieran la marca no entra en ninguna lectura incremental.
+RELECTURA_COMPLETA_SEGUNDOS = 12 * 60 * 60  # 12 horas
+
+
+def lookup_vacio() -> pd.DataFrame:
+    """Tabla de consulta sin filas, con los tipos de una leída (Fecha datetime64)."""
+    return pd.DataFrame({
+        "Concatenar": pd.Series(dtype=object),
+        "Fecha": pd.Series(dtype="datetime64[ns]"),
+        "NumeroMax": pd.Series(dtype="int64"),
+    })
+
+
+class UltimoMovimientoService:
+    """
+    Tabla de consulta Concatenar -> fecha del último movimiento (transferencia).
+
+    Sustituye al CTE UltimoMovimiento de INVENTORY_SQL: se lee una vez, se
+    guarda como snapshot local y después sólo se piden las transferencias con
+    Numero mayor al último visto (con una relectura completa cada
+    RELECTURA_COMPLETA_SEGUNDOS). La unión con el inventario se hace en el
+    cliente por clave.
+    """
+
+    CLAVE_SNAPSHOT = "ultimo-movimiento"
+
+    def __init__(self, engine, snapshot_service=None, relectura_segundos: int = RELECTURA_COMPLETA_SEGUNDOS):
+        self.engine = engine
+        self.snapshots = snapshot_service
+        self.relectura_segundos = relectura_segundos
+        self.lookup = None        # DataFrame: Concatenar, Fecha (datetime), NumeroMax
+        self.numero_max = None    # marca de agua: mayor Numero de transferencia visto
+        self.leido_completo = 0   # time.time() de la última lectura completa
+
+    # -----------------------
+    # Persistencia
+    # -----------------------
+    def _clave(self):
+        url = getattr(self.engine, "url", None)
+        if url is None or self.snapshots is None:
+            return None
+        sql = construir_ultimo_movimiento_sql()
+        return self.snapshots.clave(url.host, url.database, sql) + "-" + self.CLAVE_SNAPSHOT
+
+    def _cargar_de_disco(self):
+        """
+        (lookup, numero_max, leido_completo) del snapshot local, sin
+        instalarlos; (None, None, 0) si no hay.
+        """
+        clave = self._clave()
+        if clave is None:
+            return None, None, 0
+        cargado = self.snapshots.cargar(clave, permitir_expirado=True)
+        if cargado is None:
+            return None, None, 0
+        df, meta = cargado
+        # snapshots anteriores a la relectura completa: se releen
+        return df, meta.get("numero_max"), meta.get("leido_completo", 0)
+
+    def _guardar_en_disco(self):
+        clave = self._clave()
+        if clave is None or self.lookup is None:
+            return
+        numero = self.numero_max
+        if isinstance(numero, np.generic):
+            numero = numero.item()
+        self.snapshots.guardar(clave, self.lookup, {"numero_max": numero, "leido_completo": self.leido_completo})
+
+    # -----------------------
+    # Lectura incremental
+    # -----------------------
+    @staticmethod
+    def _agrupar(df: pd.DataFrame) -> pd.DataFrame:
+        return (
+            df.groupby("Concatenar", sort=False, observed=True)
+            .agg(Fecha=("Fecha", "max"), NumeroMax=("NumeroMax", "max"))
+            .reset_index()
+        )
+
+    @staticmethod
+    def _fechas_distintas(previo: pd.DataFrame, nuevo: pd.DataFrame) -> set:
+        """Concatenar cuya fecha difiere entre dos tablas completas (o que sólo está en una)."""
+        a = pd.Series(pd.to_datetime(previo["Fecha"], errors="coerce").to_numpy(),
+                      index=previo["Concatenar"].astype(str).to_numpy())
+        b = pd.Series(nuevo["Fecha"].to_numpy(), index=nuevo["Concatenar"].to_numpy())
+        a, b = a.align(b)
+        distinta = ~((a == b) | (a.isna() & b.isna()))
+        return set(a.index[distinta.to_numpy()])
+
+    def actualizar(self, cancelacion=None) -> dict:
+        """
+        Trae de SQL Server las transferencias nuevas (Numero > marca de agua)
+        y las combina con la tabla actual SIN instalar el resultado (apto
+        para un hilo de trabajo). Si la última lectura completa tiene más de
+        `relectura_segundos`, relee la tabla entera y la reemplaza. Devuelve
+        un dict para confirmar():
+          - 'lookup' / 'numero_max': tabla y marca de agua nuevas.
+          - 'cambiados': Concatenar cuya fecha cambió, que aparecieron o
+            (relectura completa) que ya no tienen movimientos.
+        Mientras no se confirma (tarea cancelada, error, delta sin aplicar),
+        la marca de agua no avanza y la siguiente lectura vuelve a traerlas.
+        """
+        lookup, numero_max, leido_completo = self.lookup, self.numero_max, self.leido_completo
+        if lookup is None:
+            lookup, numero_max, leido_completo = self._cargar_de_disco()
+
+        incremental = (
+            lookup is not None and numero_max is not None
+            and time.time() - leido_completo < self.relectura_segundos
+        )
+        sql = construir_ultimo_movimiento_sql(incremental=incremental)
+        params = [numero_max] if incremental else None
+        inicio = time.time()
+        bloques = list(leer_sql_por_bloques(sql, self.engine, params=params, cancelacion=cancelacion))
+        if incremental and not bloques:
+            return {
+                "lookup": lookup,
+                "numero_max": numero_max,
+                "leido_completo": leido_completo,
+                "cambiados": set(),
+                "guardar": False,
+            }
+
+        nuevos = pd.concat(bloques, ignore_index=True) if bloques else lookup_vacio()
+        nuevos["Concatenar"] = nuevos["Concatenar"].astype(str)
+        nuevos["Fecha"] = pd.to_datetime(nuevos["Fecha"], errors="coerce")
+
+        if not incremental:
+            # relectura completa: la tabla nueva reemplaza a la anterior
+            nuevo_lookup = self._agrupar(nuevos)
+            if lookup is None:
+                cambiados = set(nuevo_lookup["Concatenar"])
+            else:
+                cambiados = self._fechas_distintas(lookup, nuevo_lookup)
+            leido_completo = inicio
+        else:
+            previo = lookup.set_index("Concatenar")["Fecha"]
+            fecha_prev = previo.reindex(nuevos["Concatenar"]).to_numpy()
+            cambia = ~(nuevos["Fecha"].to_numpy() <= fecha_prev)  # NaT (nuevo) -> cambia
+            cambiados = set(nuevos.loc[cambia, "Concatenar"])
+            nuevo_lookup = self._agrupar(pd.concat([lookup, nuevos], ignore_index=True))
+
+        return {
+            "lookup": nuevo_lookup,
+            "numero_max": nuevo_lookup["NumeroMax"].max() if not nuevo_lookup.empty else None,
+            "leido_completo": leido_completo,
+            "cambiados": cambiados,
+            "guardar": True,
+        }
+
+    def confirmar(self, actualizacion: dict):
+        """
+        Instala una actualización de actualizar() (en el hilo de Tk, junto con
+        el dataset o el delta que la usó) y guarda el snapshot si cambió.
+        """
+        if actualizacion is None:
+            return
+        self.lookup = actualizacion["lookup"]
+        self.numero_max = actualizacion["numero_max"]
+        self.leido_completo = actualizacion["leido_completo"]
+        if actualizacion.get("guardar"):
+            self._guardar_en_disco()
+
+    # -----------------------
+    # Unión en cliente
+    # -----------------------
+    def unir(self, df: pd.DataFrame, lookup: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        Agrega la columna 'Fecha' (dd/mm/aaaa, como CONVERT(..., 103)) al
+        inventario. Igual que el INNER JOIN original, descarta los productos
+        sin movimientos. `lookup` (de una actualización aún sin confirmar)
+        sustituye a la tabla instalada.
+        """
+        if lookup is None:
+            lookup = self.lookup
+        if df is None or lookup is None or 'Concatenar' not in df.columns:
+            return df
+        claves = pd.Index(lookup["Concatenar"].astype(str))
+        pos = claves.get_indexer(df["Concatenar"].astype(str))
+        encontrado = pos >= 0
+        out = df[encontrado].reset_index(drop=True)
+        # un snapshot antiguo de una tabla vacía puede traer Fecha sin tipo
+        fecha = pd.to_datetime(lookup["Fecha"], errors="coerce")
+        fechas = pd.Series(fecha.dt.strftime("%d/%m/%Y").to_numpy()).astype("category")
+        out["Fecha"] = pd.Categorical.from_codes(
+            fechas.cat.codes.to_numpy()[pos[encontrado]], fechas.cat.categories
+        )
+        return out
@@ -4,6 +4,7 @@ from reportlab.lib.pagesizes import letter, landscape
 from reportlab.lib.styles import getSampleStyleSheet
 import os
 import pandas as pd
+from utils.formato import formatear_para_vista
 
 
 def export_pdfs_descuentos(df_pivot, output_dir="reportes_descuentos"):
@@ -27,7 +28,7 @@ def export_pdfs_descuentos(df_pivot, output_dir="reportes_descuentos"):
         if col not in df_pivot.columns:
             raise ValueError(f"Falta la columna '{col}' en el DataFrame.")
 
-    data = [required_columns] + df_pivot[required_columns].fillna("").values.tolist()
+    data = [required_columns] + formatear_para_vista(df_pivot[required_columns]).fillna("").values.tolist()
 
     fname = os.path.join(output_dir, "Descuentos.pdf")
     # Cambiado a landscape para orientación horizontal
@@ -68,6 +69,7 @@ def export_pdfs_por_sucursal(df, sucursales, output_dir="reportes_sucursales"):
     print(sucursales)
     print("Confirmando que las columnas y sucursales coinciden con la selección del usuario...\n")
 
+    df = formatear_para_vista(df)
     columnas = df.columns.tolist()  # Export exactly columns present en df
 
     data = [columnas]  # Header row
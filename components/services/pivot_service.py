@@ -1,27 +1,285 @@
-# components/services/pivot_service.py
+import itertools
+import time
+import queue
+import threading
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
 from components.data_transformer import (
     pivot_existencias,
     pivot_existencias_sucursales_detallado,
-    pivot_existencias_casa_matriz_filtrado
+    pivot_existencias_casa_matriz_filtrado,
+    completar_pivot_existencias,
+    completar_pivot_sucursales,
+    completar_pivot_casa_matriz,
 )
+from components.campofijos import CAMPOS_FIJOS
+from components.db_to_dataframe import leer_sql_compacto
+from components.pivot_engine import a_disperso
+from components.query import TIENDAS_SQL, PIVOT_CAMPOS_SQL, construir_pivot_sql
+from components.services.filter_service import compilar_filtros_sql, IndiceFiltros
+
+# Columnas del pivot que no son existencias por tienda
+COLUMNAS_CALCULADAS = {
+    'Sucursal_Total', 'Casa_matriz_Total', 'Total_Existencia',
+    'Porcentaje_Existencia_CasaMatriz', 'Porcentaje_Existencia_Sucursales',
+    'Descuento_Sucursales', 'Descuento_CasaMatriz',
+}
+
+
+# Presupuesto de memoria por defecto de la caché de pivots
+PRESUPUESTO_CACHE_MB = 512
+
 
 class PivotService:
-    def __init__(self):
-        self.cache = {}  # opcion -> df_pivot
+    def __init__(self, engine=None, disperso: bool = False, presupuesto_mb: float = PRESUPUESTO_CACHE_MB):
+        # Caché LRU: (opcion, version, huella) -> (df_pivot, bytes, IndiceFiltros). `version` cambia
+        # con cada dataset/delta y `huella` resume las transformaciones pre-pivot
+        # (p. ej. el año excluido), así nunca se sirve un pivot de otros datos.
+        self.cache = OrderedDict()
+        self.presupuesto_bytes = int(presupuesto_mb * 1024 * 1024)
+        self.version = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.desalojos = 0
+        # columnas por tienda como pd.SparseDtype (la mayoría de productos está en pocas tiendas).
+        # Opcional: con ~5 de 40 tiendas por producto ahorra ~30% de la caché,
+        # pero cada cambio de filtros sobre el pivot cacheado tarda ~4x más.
+        self.disperso = disperso
+        # ModeloInventario del dataset activo (None: se pivotea el DataFrame largo)
+        self.modelo = None
+        # Modo "pivot en servidor": SQL Server devuelve el resultado ancho
+        self.engine = engine
+        self.en_servidor = False
+        self.tiendas = None            # DataFrame de TIENDAS_SQL (dimID_Tienda, NombreTienda, Region)
+        self.filtros_servidor = None   # filtros empujados al servidor (ver compilar_filtros_sql)
+        self.crudo = {}                # opcion -> resultado del PIVOT tal como llega del servidor
+        # Precalentado: un hilo de baja prioridad construye las vistas que aún
+        # no se pidieron. `_lock` protege la caché (el hilo construye sin él y
+        # sólo lo toma para consultar e insertar) y `_generacion` invalida las
+        # tareas encoladas o en curso al cambiar el dataset.
+        self._lock = threading.RLock()
+        self._cola = queue.PriorityQueue()
+        self._secuencia = itertools.count()
+        self._generacion = 0
+        self._hilo = None
+
+    def get_pivot(self, opcion: str, df_base, post_servidor=None, huella: tuple = (),
+                  base_maestra=None) -> pd.DataFrame:
+        """
+        Pivot cacheado de la vista `opcion` para las transformaciones pre-pivot
+        descritas por `huella` (tupla hashable). `df_base` puede ser un
+        DataFrame o una función que lo devuelve (sólo se llama si no hay
+        acierto). En modo servidor `df_base` se ignora y `post_servidor(df)`
+        (opcional) se aplica al resultado del servidor antes de totalizar
+        (p. ej. unir Fecha y excluir año).
+
+        Con ModeloInventario y `base_maestra` (función que devuelve los hechos
+        pre-pivot de TODAS las regiones) las tres vistas se derivan de una
+        única matriz maestra por versión + huella.
+        """
+        with self._lock:
+            clave = (opcion, self.version, huella)
+            entrada = self._buscar(clave)
+            if entrada is not None:
+                return entrada
+            return self._guardar(clave, self._construir_vista(opcion, df_base, post_servidor, huella, base_maestra))
+
+    def _construir_vista(self, opcion: str, df_base, post_servidor, huella: tuple, base_maestra) -> pd.DataFrame:
+        if self.en_servidor:
+            return self._construir_servidor(opcion, post_servidor)
+        modelo = self.modelo
+        if modelo is not None and base_maestra is not None:
+            maestra = self._maestra(modelo, huella, base_maestra)
+            resultado, columnas = modelo.pivot_desde_maestra(opcion, maestra)
+            return self._completar(opcion, resultado, columnas)
+        return self._construir(opcion, df_base() if callable(df_base) else df_base)
+
+    def en_cache(self, opcion: str, huella: tuple = ()) -> bool:
+        """¿Hay pivot de `opcion` para la versión actual y `huella`? (no cuenta como acierto)."""
+        with self._lock:
+            return (opcion, self.version, huella) in self.cache
+
+    def indice_de(self, df: pd.DataFrame):
+        """IndiceFiltros del pivot cacheado `df` (el mismo objeto), o None."""
+        with self._lock:
+            for entrada, _, indice in self.cache.values():
+                if entrada is df:
+                    return indice
+        return None
+
+    def pivot_productos(self, opcion: str, hechos: pd.DataFrame, perfil: tuple) -> pd.DataFrame:
+        """
+        Pivot (sin caché) de `hechos`, un subconjunto de productos de la vista
+        `opcion`; `perfil` = ModeloInventario.perfil_vista de la vista completa.
+        Da las mismas filas que filtrar el pivot completo por esos productos.
+        """
+        resultado, columnas = self.modelo.pivot(opcion, hechos, perfil)
+        return self._completar(opcion, resultado, columnas)
+
+    def _buscar(self, clave):
+        if clave in self.cache:
+            self.cache.move_to_end(clave)
+            self.aciertos += 1
+            return self.cache[clave][0]
+        self.fallos += 1
+        return None
+
+    def _maestra(self, modelo, huella: tuple, base_maestra):
+        """
+        Matriz maestra producto x tienda de `modelo` (cacheada con clave
+        (None, versión, huella)). El lock sólo se toma para la caché: desde el
+        hilo de precalentado se construye sin él.
+        """
+        with self._lock:
+            clave = (None, self.version, huella)
+            maestra = self._buscar(clave)
+        if maestra is None:
+            maestra = modelo.matriz_maestra(base_maestra())
+            with self._lock:
+                if clave[1] == self.version and modelo is self.modelo:
+                    self.cache[clave] = (maestra, maestra.nbytes, None)
+                    self._desalojar()
+        return maestra
+
+    def _entrada(self, df: pd.DataFrame):
+        """(df, bytes, IndiceFiltros) a guardar en la caché (no la toca)."""
+        if self.disperso:
+            df = a_disperso(df, self.columnas_tienda(df))
+        indice = IndiceFiltros(df)
+        return df, int(df.memory_usage(deep=True).sum()) + indice.nbytes, indice
 
-    def get_pivot(self, opcion: str, df_base: pd.DataFrame) -> pd.DataFrame:
-        if opcion in self.cache:
-            return self.cache[opcion]
+    def _insertar(self, clave, entrada):
+        self.cache[clave] = entrada
+        self.cache.move_to_end(clave)
+        self._desalojar()
+        return entrada[0]
 
+    def _guardar(self, clave, df: pd.DataFrame):
+        return self._insertar(clave, self._entrada(df))
+
+    def _desalojar(self):
+        """Saca entradas LRU hasta quedar dentro del presupuesto (la más reciente se conserva)."""
+        while len(self.cache) > 1 and self.uso_memoria() > self.presupuesto_bytes:
+            clave, _ = self.cache.popitem(last=False)
+            self.desalojos += 1
+            print(f"[PivotService] desalojado {clave[0]!r} {clave[2]} (v{clave[1]})")
+
+    def nueva_version(self):
+        """El dataset cambió: las entradas anteriores ya no pueden servirse."""
+        with self._lock:
+            self.version += 1
+            self.cache.clear()
+
+    # -----------------------
+    # Precalentado en segundo plano
+    # -----------------------
+    def precalentar(self, vistas, huella: tuple = (), base_maestra=None):
+        """
+        Encola en el hilo de precalentado las vistas `vistas` (lista de
+        (opcion, df_base), en orden de prioridad) que aún no están en caché,
+        para la versión actual y `huella`. Mismos argumentos que get_pivot.
+        """
+        if self.en_servidor:
+            return  # cada vista sería una consulta al servidor
+        with self._lock:
+            generacion = self._generacion
+            for prioridad, (opcion, df_base) in enumerate(vistas):
+                if (opcion, self.version, huella) in self.cache:
+                    continue
+                self._cola.put((prioridad, next(self._secuencia), generacion,
+                                opcion, huella, df_base, base_maestra))
+        if self._hilo is None or not self._hilo.is_alive():
+            self._hilo = threading.Thread(target=self._trabajar, name="precalentado-pivots", daemon=True)
+            self._hilo.start()
+
+    def cancelar_precalentado(self):
+        """
+        Descarta las vistas encoladas; la que se esté construyendo no se
+        guarda al terminar (no se espera por ella). Llamar antes de sustituir
+        el dataset / el modelo.
+        """
+        with self._lock:
+            self._generacion += 1
+            while True:
+                try:
+                    self._cola.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _trabajar(self):
+        while True:
+            _, _, generacion, opcion, huella, df_base, base_maestra = self._cola.get()
+            try:
+                with self._lock:
+                    clave = (opcion, self.version, huella)
+                    if generacion != self._generacion or clave in self.cache:
+                        continue
+                # se construye sin el lock: get_pivot / aplicar_filtros en el
+                # hilo de Tk no esperan a que termine otra vista
+                inicio = time.perf_counter()
+                entrada = self._entrada(self._construir_vista(opcion, df_base, None, huella, base_maestra))
+                with self._lock:
+                    # dataset cambiado / cancelado, o la vista ya se construyó en el hilo de Tk
+                    if generacion != self._generacion or clave[1] != self.version or clave in self.cache:
+                        continue
+                    self._insertar(clave, entrada)
+                print(f"[PivotService] precalentado {opcion!r} {huella} "
+                      f"en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+            except Exception as e:
+                print(f"[PivotService] precalentado de {opcion!r} falló: {e}")
+
+    def estadisticas(self) -> dict:
+        return {
+            "entradas": len(self.cache),
+            "bytes": self.uso_memoria(),
+            "presupuesto_bytes": self.presupuesto_bytes,
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "desalojos": self.desalojos,
+        }
+
+    @staticmethod
+    def columnas_tienda(df: pd.DataFrame) -> list:
+        """Columnas de existencia por tienda/región de un pivot ya construido."""
+        return [c for c in df.columns if c not in CAMPOS_FIJOS and c not in COLUMNAS_CALCULADAS]
+
+    def uso_memoria(self) -> int:
+        """Bytes ocupados por los pivots cacheados (memory_usage(deep=True) al guardarlos)."""
+        return sum(entrada[1] for entrada in self.cache.values())
+
+    def _construir(self, opcion: str, df_base: pd.DataFrame) -> pd.DataFrame:
+        if self.modelo is not None and 'producto_id' in df_base.columns:
+            return self._construir_modelo(opcion, df_base)
         if opcion == "Solo Sucursales":
             df = pivot_existencias_sucursales_detallado(df_base)
-            df = df.drop(columns=['Descuento_Sucursales'], errors='ignore')
         elif opcion == "Solo Casa Matriz":
             df = pivot_existencias_casa_matriz_filtrado(df_base)
-            df = df.drop(columns=['Descuento_CasaMatriz'], errors='ignore')
         else:
             df = pivot_existencias(df_base)
+        return self._ordenar_columnas(opcion, df)
+
+    def _construir_modelo(self, opcion: str, hechos: pd.DataFrame) -> pd.DataFrame:
+        """Pivot sobre los hechos del modelo (claves enteras); índice = producto_id."""
+        resultado, columnas = self.modelo.pivot(opcion, hechos)
+        return self._completar(opcion, resultado, columnas)
+
+    def _completar(self, opcion: str, resultado: pd.DataFrame, columnas: list) -> pd.DataFrame:
+        if opcion == "Solo Sucursales":
+            df = completar_pivot_sucursales(resultado, columnas)
+        elif opcion == "Solo Casa Matriz":
+            df = completar_pivot_casa_matriz(resultado, columnas)
+        else:
+            df = completar_pivot_existencias(resultado, columnas)
+        return self._ordenar_columnas(opcion, df)
+
+    @staticmethod
+    def _ordenar_columnas(opcion: str, df: pd.DataFrame) -> pd.DataFrame:
+        if opcion == "Solo Sucursales":
+            df = df.drop(columns=['Descuento_Sucursales'], errors='ignore')
+        elif opcion == "Solo Casa Matriz":
+            df = df.drop(columns=['Descuento_CasaMatriz'], errors='ignore')
+        else:
             cols = list(df.columns)
             if 'Sucursal_Total' in cols and 'Casa_matriz_Total' in cols:
                 idx = cols.index('Sucursal_Total')
@@ -32,9 +290,149 @@ class PivotService:
                 cols.remove('Descuento_CasaMatriz')
                 cols.insert(idx + 1, 'Descuento_CasaMatriz')
             df = df[cols]
+        return df
 
-        self.cache[opcion] = df
+    # -----------------------
+    # Pivot en SQL Server
+    # -----------------------
+    def configurar_servidor(self, tiendas: pd.DataFrame = None, filtros_servidor: dict = None):
+        """
+        Activa el modo servidor con la lista de tiendas `tiendas` (None lo
+        desactiva). Descarta los pivots cacheados y los resultados crudos.
+        """
+        self.cancelar_precalentado()
+        self.en_servidor = tiendas is not None
+        self.tiendas = tiendas
+        self.filtros_servidor = filtros_servidor if tiendas is not None else None
+        self.crudo = {}
+        self.nueva_version()
+
+    def cargar_tiendas(self, cancelacion=None) -> pd.DataFrame:
+        """Lee TIENDAS_SQL (no toca el estado; apto para un hilo de trabajo)."""
+        df = leer_sql_compacto(TIENDAS_SQL, self.engine, cancelacion=cancelacion)
+        for col in ('NombreTienda', 'Region'):
+            df[col] = df[col].astype(str)
         return df
 
+    def columnas_servidor(self, opcion: str, tiendas: pd.DataFrame = None) -> list:
+        """Etiquetas de columna del PIVOT de cada vista (mismas que el pivot de pandas)."""
+        tiendas = self.tiendas if tiendas is None else tiendas
+        if tiendas is None or tiendas.empty:
+            return []
+        region = tiendas['Region']
+        if opcion == "Solo Sucursales":
+            cols = tiendas.loc[region.str.contains('Sucursales', na=False), 'NombreTienda']
+        elif opcion == "Solo Casa Matriz":
+            cols = region[region.str.contains('Casa Matriz', na=False)]
+        else:
+            cols = region + ' - ' + tiendas['NombreTienda']
+        return sorted(cols.dropna().unique())
+
+    def leer_pivot_servidor(self, opcion: str, tiendas: pd.DataFrame = None, filtros: dict = None,
+                            on_progress=None, cancelacion=None) -> pd.DataFrame:
+        """
+        Ejecuta el PIVOT dinámico de `opcion` y devuelve el resultado ancho
+        sin totales (no toca el estado; apto para un hilo de trabajo).
+        Las columnas de tiendas sin ninguna fila se descartan, como en pandas.
+        """
+        columnas = self.columnas_servidor(opcion, tiendas)
+        filtro_productos, filtro_filas, params = compilar_filtros_sql(filtros)
+        if not columnas:
+            return pd.DataFrame()
+        sql = construir_pivot_sql(opcion, columnas, filtro_productos, filtro_filas)
+        # tipos fijos: un primer bloque con una tienda toda en NULL no debe volverla categórica
+        tipos = {c: 'category' for c in PIVOT_CAMPOS_SQL if c not in ('Concatenar', 'Referencia', 'Nombre')}
+        tipos['Promocion'] = 'integer'
+        tipos.update({c: 'float' for c in columnas})
+        df = leer_sql_compacto(sql, self.engine, params=params or None, on_progress=on_progress,
+                               cancelacion=cancelacion, tipos=tipos)
+        vacias = [c for c in columnas if c in df.columns and df[c].isna().all()]
+        return df.drop(columns=vacias)
+
+    def _construir_servidor(self, opcion: str, post_servidor=None) -> pd.DataFrame:
+        if opcion not in self.crudo:
+            self.crudo[opcion] = self.leer_pivot_servidor(opcion, filtros=self.filtros_servidor)
+        df = self.crudo[opcion]
+        columnas = [c for c in self.columnas_servidor(opcion) if c in df.columns]
+        if post_servidor is not None:
+            df = post_servidor(df)
+        if df.empty or not columnas:
+            return df
+
+        if opcion == "Solo Sucursales":
+            df = completar_pivot_sucursales(df, columnas)
+        elif opcion == "Solo Casa Matriz":
+            # el pivot de pandas de esta vista usa fill_value=0 (columnas enteras)
+            valores = df[columnas].fillna(0)
+            if (valores % 1 == 0).all().all():
+                df[columnas] = valores.astype('int64')
+            df = completar_pivot_casa_matriz(df, columnas)
+        else:
+            df = completar_pivot_existencias(df, columnas)
+        return self._ordenar_columnas(opcion, df.reset_index(drop=True))
+
+    def invalidar_productos(self, concatenar, base_por_opcion):
+        """
+        Recalcula en cada pivot cacheado sólo las filas de los productos
+        `concatenar`, a partir de la base pre-pivot que devuelve
+        base_por_opcion(opcion, huella), y pasa las entradas a la nueva versión
+        del dataset. Si el recálculo trae columnas nuevas (p. ej. una tienda
+        nueva) la entrada se descarta y se reconstruye completa en el próximo
+        get_pivot.
+        """
+        with self._lock:
+            self._invalidar_productos(set(concatenar), base_por_opcion)
+
+    def _invalidar_productos(self, concatenar: set, base_por_opcion):
+        previas = [(clave, df) for clave, (df, _, _) in self.cache.items()
+                   if clave[1] == self.version and clave[0] is not None]
+        self.nueva_version()
+        for (opcion, _, huella), df in previas:
+            base = base_por_opcion(opcion, huella)
+            por_id = df.index.name == 'producto_id' and 'producto_id' in base.columns
+            if por_id:
+                ids = self.modelo.ids_de(concatenar)
+                en_base = base['producto_id'].isin(ids)
+                en_pivot = df.index.isin(ids)
+            elif 'Concatenar' in df.columns and 'Concatenar' in base.columns:
+                en_base = base['Concatenar'].isin(concatenar)
+                en_pivot = df['Concatenar'].isin(concatenar)
+            else:
+                continue
+            parcial_base = base[en_base]
+            resto = df[~en_pivot]
+
+            partes = [resto]
+            if not parcial_base.empty:
+                parcial = self._construir(opcion, parcial_base)
+                if not set(parcial.columns) <= set(df.columns):
+                    continue
+                faltantes = [c for c in df.columns if c not in parcial.columns]
+                if faltantes:
+                    parcial = parcial.assign(**{c: 0 for c in faltantes})
+                # categorías nuevas del refresco: el resto pasa al tipo de la base
+                # nueva (concat de categorías distintas daría texto)
+                tipos = {c: parcial[c].dtype for c in parcial.columns
+                         if isinstance(parcial[c].dtype, pd.CategoricalDtype) and parcial[c].dtype != resto[c].dtype}
+                if tipos:
+                    partes[0] = resto.astype(tipos)
+                partes.append(parcial[list(df.columns)])
+
+            # mismo orden de filas que un pivot completo: primera aparición en la base
+            if por_id:
+                nuevo = pd.concat(partes)
+                orden = pd.Index(pd.unique(base['producto_id']))
+                pos = orden.get_indexer(nuevo.index)
+                nuevo = nuevo.iloc[np.argsort(pos, kind='stable')]
+            else:
+                nuevo = pd.concat(partes, ignore_index=True)
+                orden = pd.Index(base['Concatenar'].astype(str).unique())
+                pos = orden.get_indexer(nuevo['Concatenar'].astype(str))
+                nuevo = nuevo.iloc[np.argsort(pos, kind='stable')].reset_index(drop=True)
+            self._guardar((opcion, self.version, huella), nuevo)
+
     def clear(self):
-        self.cache.clear()
+        """Descarta los pivots cacheados (en modo servidor se conservan los resultados crudos)."""
+        self.cancelar_precalentado()
+        with self._lock:
+            self.cache.clear()
@@ -0,0 +1,119 @@
+# components/services/snapshot_service.py
+import hashlib
+import json
+import os
+import time
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # pyarrow es opcional: sin él no hay snapshots
+    feather = None
+
+SNAPSHOT_DIR = os.path.expanduser("~/.consultor_sql/snapshots")
+TTL_SEGUNDOS = 12 * 60 * 60  # 12 horas
+FORMATO_VERSION = 1
+
+
+class SnapshotService:
+    """
+    Guarda DataFrames en disco como archivos Arrow IPC (Feather v2) sin
+    compresión, de modo que puedan abrirse con memory-mapping. Cada snapshot
+    lleva un .json con metadatos (servidor, base, hash del SQL, fecha, TTL...).
+    """
+
+    def __init__(self, directorio: str = SNAPSHOT_DIR, ttl_segundos: int = TTL_SEGUNDOS):
+        self.directorio = directorio
+        self.ttl_segundos = ttl_segundos
+
+    @property
+    def disponible(self) -> bool:
+        return feather is not None
+
+    # -----------------------
+    # Claves y rutas
+    # -----------------------
+    @staticmethod
+    def hash_sql(sql: str, params=None) -> str:
+        texto = sql if not params else sql + "\n--params: " + repr(list(params))
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def clave(cls, server, database, sql: str, params=None) -> str:
+        base = f"{server or ''}|{database or ''}|{cls.hash_sql(sql, params)}"
+        return hashlib.sha256(base.encode("utf-8")).hexdigest()[:32]
+
+    def _rutas(self, clave: str):
+        base = os.path.join(self.directorio, clave)
+        return base + ".arrow", base + ".json"
+
+    # -----------------------
+    # Lectura / escritura
+    # -----------------------
+    def guardar(self, clave: str, df: pd.DataFrame, meta: dict = None) -> bool:
+        """Escribe el snapshot de forma atómica (archivo temporal + replace)."""
+        if not self.disponible or df is None:
+            return False
+        ruta_datos, ruta_meta = self._rutas(clave)
+        os.makedirs(self.directorio, exist_ok=True)
+        meta = dict(meta or {})
+        meta.update({
+            "clave": clave,
+            "formato": FORMATO_VERSION,
+            "creado": time.time(),
+            "ttl_segundos": self.ttl_segundos,
+            "filas": int(len(df)),
+            "columnas": [str(c) for c in df.columns],
+        })
+        try:
+            tmp = ruta_datos + ".tmp"
+            feather.write_feather(df.reset_index(drop=True), tmp, compression="uncompressed")
+            os.replace(tmp, ruta_datos)
+            with open(ruta_meta + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+            os.replace(ruta_meta + ".tmp", ruta_meta)
+            return True
+        except Exception as e:
+            print(f"[SnapshotService] No se pudo guardar snapshot {clave}: {e}")
+            return False
+
+    def metadatos(self, clave: str):
+        _, ruta_meta = self._rutas(clave)
+        if not os.path.exists(ruta_meta):
+            return None
+        try:
+            with open(ruta_meta, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return None
+
+    def vigente(self, meta: dict) -> bool:
+        if not meta or meta.get("formato") != FORMATO_VERSION:
+            return False
+        ttl = meta.get("ttl_segundos", self.ttl_segundos)
+        return (time.time() - meta.get("creado", 0)) < ttl
+
+    def cargar(self, clave: str, permitir_expirado: bool = False):
+        """
+        Devuelve (df, meta) o None si no existe, está expirado (salvo
+        permitir_expirado) o no se puede leer.
+        """
+        if not self.disponible:
+            return None
+        ruta_datos, _ = self._rutas(clave)
+        meta = self.metadatos(clave)
+        if meta is None or not os.path.exists(ruta_datos):
+            return None
+        if not permitir_expirado and not self.vigente(meta):
+            return None
+        try:
+            tabla = feather.read_table(ruta_datos, memory_map=True)
+            return tabla.to_pandas(), meta
+        except Exception as e:
+            print(f"[SnapshotService] No se pudo leer snapshot {clave}: {e}")
+            return None
+
+    def eliminar(self, clave: str):
+        for ruta in self._rutas(clave):
+            if os.path.exists(ruta):
+                os.remove(ruta)
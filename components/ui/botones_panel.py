@@ -7,7 +7,7 @@ class BotonesPanel(ctk.CTkFrame):
         self.callbacks = callbacks
 
         # Distribución de columnas uniforme
-        self.grid_columnconfigure((0, 1, 2, 3), weight=1, uniform="btns")
+        self.grid_columnconfigure((0, 1, 2, 3, 4), weight=1, uniform="btns")
 
         # Botones
         Button(self, text="Importar Datos",
@@ -18,6 +18,8 @@ class BotonesPanel(ctk.CTkFrame):
                command=self._cb("exportar_pdf")).grid(row=0, column=2)
         Button(self, text="Importar Catálogo Desc",
                command=self._cb("importar_catalogo_descuento")).grid(row=0, column=3)
+        Button(self, text="Actualizar Cambios", variant="neutral",
+               command=self._cb("refrescar_datos")).grid(row=0, column=4)
 
     def _cb(self, name: str):
         """Wrapper con print de tester y manejo seguro si falta el callback."""
@@ -1,6 +1,8 @@
+import numpy as np
 import tkinter.ttk as ttk
 import customtkinter as ctk
 from components.ui.treeview_renderer import render as render_tree
+from utils.formato import formatear_para_vista
 
 class DatosTreeview(ctk.CTkFrame):
     def __init__(self, master):
@@ -18,10 +20,11 @@ class DatosTreeview(ctk.CTkFrame):
     def render_data(self, df, highlight_dups=False):
         for item in self.tree.get_children():
             self.tree.delete(item)
-        render_tree(self.tree, df)
-        if highlight_dups:
+        tags = None
+        if highlight_dups and df is not None:
             self.tree.tag_configure('dup', background='#3E1E50')
             self.tree.tag_configure('uniq', background='#1E502E')
-            for item_id, (_, row) in zip(self.tree.get_children(), df.iterrows()):
-                tag = 'dup' if row.get('_dup_desc', False) else 'uniq'
-                self.tree.item(item_id, tags=(tag,))
+            # marcas de aplicar_filtros: el tag va en el insert, sin segunda pasada
+            dup = df['_dup_desc'].to_numpy(dtype=bool) if '_dup_desc' in df.columns else np.zeros(len(df), dtype=bool)
+            tags = np.where(dup, 'dup', 'uniq')
+        render_tree(self.tree, formatear_para_vista(df), tags)
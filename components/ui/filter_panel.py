@@ -1,6 +1,7 @@
 import customtkinter as ctk
 from components.ui.placeholder_combo import PlaceholderCombo
 from components.ui.button import Button
+from components.services.filter_service import SEPARADORES_REFERENCIA
 
 class FilterPanel(ctk.CTkFrame):
     def __init__(self, master, on_filter_change):
@@ -25,12 +26,13 @@ class FilterPanel(ctk.CTkFrame):
         self.pivot_selector.grid(row=row, column=0, padx=6, pady=(0,8), sticky="ew")
         row += 1
 
-        # Referencia (solo Enter)
-        ctk.CTkLabel(self, text="Referencia").grid(row=row, column=0, sticky="w", padx=6, pady=(0,2))
+        # Referencia (solo Enter; admite varias separadas por coma o pegar una lista)
+        ctk.CTkLabel(self, text="Referencia (una o varias)").grid(row=row, column=0, sticky="w", padx=6, pady=(0,2))
         row += 1
         self.referencia_entry = PlaceholderCombo(self, placeholder="Referencia", values=[""], state="normal")
         self.referencia_entry.grid(row=row, column=0, padx=6, pady=(0,8), sticky="ew")
         self.referencia_entry.bind("<Return>", lambda e: self._on_change())
+        self.referencia_entry.bind("<<Paste>>", self._pegar_referencias)
         row += 1
 
         # Excluir año (solo Enter)
@@ -118,6 +120,22 @@ class FilterPanel(ctk.CTkFrame):
         ).grid(row=row, column=0, padx=6, pady=(0,10), sticky="w")
         row += 1
 
+        # Importación desde SQL Server (aplica en el próximo import)
+        ctk.CTkLabel(self, text="Importación SQL").grid(row=row, column=0, sticky="w", padx=6, pady=(8,2))
+        row += 1
+        self.filtrar_en_servidor = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            self, text="Importar sólo lo filtrado",
+            variable=self.filtrar_en_servidor
+        ).grid(row=row, column=0, padx=6, pady=(0,4), sticky="w")
+        row += 1
+        self.pivot_en_servidor = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(
+            self, text="Pivot en el servidor",
+            variable=self.pivot_en_servidor
+        ).grid(row=row, column=0, padx=6, pady=(0,10), sticky="w")
+        row += 1
+
     # ---- helpers ----
     def _set_filter_mode(self, mode):
         self.filter_mode = None if self.filter_mode == mode else mode
@@ -126,6 +144,23 @@ class FilterPanel(ctk.CTkFrame):
     def _on_change(self):
         self.on_filter_change()
 
+    def _pegar_referencias(self, _event=None):
+        """
+        Pegar una lista de referencias (p. ej. una columna de la lista de un
+        proveedor): quedan separadas por coma en el campo y se aplica el filtro.
+        Una sola referencia se pega normalmente.
+        """
+        try:
+            texto = self.clipboard_get()
+        except Exception:
+            return None
+        if not SEPARADORES_REFERENCIA.search(texto.strip()):
+            return None
+        refs = [r.strip() for r in SEPARADORES_REFERENCIA.split(texto) if r.strip()]
+        self.referencia_entry.set_value(", ".join(refs))
+        self._on_change()
+        return "break"
+
     def _get_referencia_safe(self) -> str:
         val = self.referencia_entry.get_value()
         if not val:
@@ -161,6 +196,16 @@ class FilterPanel(ctk.CTkFrame):
             "exclude_year": self._get_exclude_year_safe(),
         }
 
+    def get_filtros_servidor(self):
+        """Filtros a empujar al servidor en el próximo import (None si está desactivado)."""
+        if not self.filtrar_en_servidor.get():
+            return None
+        return self.get_filters()
+
+    def get_pivot_en_servidor(self) -> bool:
+        """True si el próximo import debe pedir las vistas ya pivotadas a SQL Server."""
+        return bool(self.pivot_en_servidor.get())
+
     # setters (compatibles con InicioView; si se llama, no pasa nada)
     def set_region_values(self, values):
         pass
@@ -32,6 +32,12 @@ class PlaceholderCombo(ctk.CTkComboBox):
         """Devuelve '' si hay placeholder, o el valor real."""
         return "" if self._using_placeholder else self.get()
 
+    def set_value(self, value: str):
+        """Escribe `value` como valor real (quita el placeholder)."""
+        self.set(value)
+        self.configure(text_color=NORMAL_COLOR)
+        self._using_placeholder = False
+
     def reset_placeholder(self, values=None):
         if values is not None:
             self.configure(values=values)
@@ -3,10 +3,10 @@ from utils.treeview_utils import limpiar_treeview, cargar_dataframe_en_treeview
 import pandas as pd
 from tkinter import ttk
 
-def render(tree: ttk.Treeview, df: pd.DataFrame):
+def render(tree: ttk.Treeview, df: pd.DataFrame, tags=None):
     limpiar_treeview(tree)
     if df is None or df.empty:
         tree["columns"] = ["Sin datos"]
         tree.heading("Sin datos", text="Sin datos disponibles")
     else:
-        cargar_dataframe_en_treeview(tree, df)
+        cargar_dataframe_en_treeview(tree, df, tags)
@@ -3,6 +3,7 @@ import pandas as pd
 import streamlit as st
 from utils.db_utils import ConnectionManager
 from components.query import INVENTORY_SQL
+from components.services.movimiento_service import UltimoMovimientoService
 
 # Reutilizar el mismo engine creado en app.py
 conn_manager = None  # Se inicializa desde app.py
@@ -14,4 +15,6 @@ def load_inventory_data():
         return pd.DataFrame()
 
     df = pd.read_sql(INVENTORY_SQL, conn_manager.engine)
-    return df
+    movimientos = UltimoMovimientoService(conn_manager.engine)
+    movimientos.confirmar(movimientos.actualizar())
+    return movimientos.unir(df)
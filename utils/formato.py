@@ -0,0 +1,30 @@
+# utils/formato.py
+# Formato de presentación (Treeview, Excel, PDF). El pipeline de filtros
+# trabaja con números; sólo aquí se convierten a texto.
+import numpy as np
+import pandas as pd
+
+from components.descuento import formatear_porcentajes
+
+# Columnas de porcentaje entero que se muestran como 'NN%'
+COLUMNAS_PORCENTAJE = ('Descuento', 'Descuento_Catalogo')
+
+
+def formatear_para_vista(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    `df` con las columnas de porcentaje numéricas como texto 'NN%' (vacío
+    si no hay valor). Las demás columnas no se copian.
+    """
+    if df is None:
+        return df
+    cambios = {}
+    for col in COLUMNAS_PORCENTAJE:
+        if col not in df.columns:
+            continue
+        dtype = df[col].dtype
+        if not pd.api.types.is_numeric_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+            continue
+        texto = formatear_porcentajes(df[col].to_numpy(dtype=np.float64, na_value=np.nan))
+        texto[pd.isna(texto)] = ""
+        cambios[col] = texto
+    return df.assign(**cambios) if cambios else df
@@ -1,9 +1,15 @@
 def limpiar_treeview(tree):
     tree.delete(*tree.get_children())
 
-def cargar_dataframe_en_treeview(tree, df):
+def cargar_dataframe_en_treeview(tree, df, tags=None):
+    """`tags`: opcional, el tag (o tupla de tags) de cada fila de df, asignado al insertar."""
     tree["columns"] = list(df.columns)
     for col in df.columns:
         tree.heading(col, text=col)
-    for _, row in df.iterrows():
-        tree.insert("", "end", values=list(row))
+    filas = df.itertuples(index=False, name=None)
+    if tags is None:
+        for row in filas:
+            tree.insert("", "end", values=list(row))
+    else:
+        for row, tag in zip(filas, tags):
+            tree.insert("", "end", values=list(row), tags=tag)
@@ -2,6 +2,8 @@
 import sys
 import os
 import time
+import queue
+import threading
 from contextlib import contextmanager
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -11,6 +13,7 @@ from tkinter import messagebox
 
 from Style.styleInicioView import configure_ctk_style, configure_treeview_style
 from components.exporter import exportar_dataframe_a_excel, export_pdfs_por_sucursal
+from components.db_to_dataframe import Cancelacion, ImportacionCancelada
 from components.services.inventory_service import InventoryService
 
 # UI modular
@@ -18,6 +21,7 @@ from components.ui.filter_panel import FilterPanel
 from components.ui.botones_panel import BotonesPanel
 from components.ui.datos_treeview import DatosTreeview
 from components.ui.selector_pdf import SelectorPDF
+from components.ui.button import Button
 
 
 class InicioView(ctk.CTk):
@@ -32,6 +36,14 @@ class InicioView(ctk.CTk):
         self._last_filters = None
         self._is_updating = False
 
+        # Importación en segundo plano
+        self._import_thread = None
+        self._import_queue = None
+        self._cancelacion = None
+        self._import_start = None
+        self._import_texto = ""
+        self._import_al_terminar = None
+
         self.title("Inicio - Importación de Datos")
         # ventana un poco más ancha para el sidebar + tabla
         self.geometry("1200x700")
@@ -63,6 +75,7 @@ class InicioView(ctk.CTk):
         # Panel de botones con callbacks
         callbacks = {
             "importar_datos": self.importar_datos,
+            "refrescar_datos": self.refrescar_datos,
             "exportar_excel": self.exportar_excel,
             "exportar_pdf": self._open_pdf_selector,
             "importar_excel": self.importar_excel,
@@ -79,8 +92,23 @@ class InicioView(ctk.CTk):
         self.loading_label = ctk.CTkLabel(self.right_container, text="")
         self.loading_label.grid(row=2, column=0, pady=(0, 10))
 
+        # Botón cancelar (sólo visible durante una importación)
+        self.cancel_button = Button(
+            self.right_container,
+            text="Cancelar importación",
+            command=self._cancelar_importacion,
+            variant="danger",
+            size="sm",
+            full_width=False,
+        )
+        self.cancel_button.grid(row=3, column=0, pady=(0, 10))
+        self.cancel_button.grid_remove()
+
         self._style_treeview()
 
+        # Arranque en caliente desde el snapshot local (si existe)
+        self.after(0, self._arranque_en_caliente)
+
     # ========== Helpers de orquestación ==========
     @contextmanager
     def _busy(self, msg: str):
@@ -96,43 +124,28 @@ class InicioView(ctk.CTk):
 
     def _hydrate_filters_from_df(self):
         """Cargar valores (región/referencia) en el panel, según columnas disponibles."""
-        df = self.inventory_service.df_original
-        if df is None:
+        if not self.inventory_service.hay_datos:
             return
 
-        # Región (si existe)
-        if 'Region' in df.columns:
-            suc = df[df['Region'].str.contains('Sucursales', na=False)]
-            regiones = ["Todas"] + sorted(suc['Region'].dropna().unique())
-            print("[InicioView] set_region_values ->", regiones[:5], "..." if len(regiones) > 5 else "")
-            # si quitaste el filtro de región del FilterPanel, comenta la línea siguiente:
-            try:
-                self.filter_panel.set_region_values(regiones)
-            except Exception:
-                pass
-        else:
-            print("[InicioView] df_original sin 'Region' -> ['Todas']")
-            try:
-                self.filter_panel.set_region_values(["Todas"])
-            except Exception:
-                pass
-
-        # Referencia (si existe)
-        if 'Referencia' in df.columns:
-            refs = sorted(df['Referencia'].dropna().astype(str).unique())
-            print("[InicioView] set_referencia_values ->", refs[:5], "..." if len(refs) > 5 else "")
-            self.filter_panel.set_referencia_values(refs)
-        else:
-            print("[InicioView] df_original sin 'Referencia' -> ['']")
-            self.filter_panel.set_referencia_values([""])
+        regiones = ["Todas"] + self.inventory_service.valores_region()
+        print("[InicioView] set_region_values ->", regiones[:5], "..." if len(regiones) > 5 else "")
+        # si quitaste el filtro de región del FilterPanel, comenta la línea siguiente:
+        try:
+            self.filter_panel.set_region_values(regiones)
+        except Exception:
+            pass
+
+        refs = self.inventory_service.valores_referencia() or [""]
+        print("[InicioView] set_referencia_values ->", refs[:5], "..." if len(refs) > 5 else "")
+        self.filter_panel.set_referencia_values(refs)
 
     def _apply_filters_and_render(self, *, force: bool = False):
         """
         Toma los filtros, aplica en el service y renderiza la tabla.
         Usa cache (_last_filters) y anti-reentrada (_is_updating).
         """
-        if self.inventory_service.df_original is None:
-            print("[InicioView] _apply_filters_and_render: no hay df_original")
+        if not self.inventory_service.hay_datos:
+            print("[InicioView] _apply_filters_and_render: no hay datos")
             return
 
         if self._is_updating:
@@ -148,6 +161,12 @@ class InicioView(ctk.CTk):
 
             print("[InicioView] filtros actuales:", filters)
 
+            # Pivot en servidor: una vista que aún no se leyó se pide a SQL
+            # Server en segundo plano y se muestra al llegar
+            if self.inventory_service.falta_vista_servidor(filters.get("pivot")):
+                self._leer_vista_servidor(filters.get("pivot"))
+                return
+
             # Mostrar/ocultar botones de duplicados
             if filters["desc_dup"]:
                 self.filter_panel.btn_unique.grid()
@@ -192,19 +211,242 @@ class InicioView(ctk.CTk):
             self._apply_filters_and_render(force=True)
         messagebox.showinfo("Listo", success_msg)
 
+    def _arranque_en_caliente(self):
+        """
+        Carga el último snapshot local del inventario. Si no hay snapshot no se
+        hace nada (el usuario importa a demanda); si expiró, se muestra igual y
+        se refresca (incrementalmente) desde SQL Server en segundo plano.
+        """
+        meta, vigente = self.inventory_service.estado_snapshot()
+        if meta is None:
+            return
+        try:
+            with self._busy("Cargando snapshot local..."):
+                if not self.inventory_service.cargar_desde_snapshot(permitir_expirado=True):
+                    return
+                self._hydrate_filters_from_df()
+                self._apply_filters_and_render(force=True)
+        except Exception as e:
+            print(f"[InicioView] no se pudo cargar el snapshot: {e}")
+            return
+        creado = time.strftime("%d/%m/%Y %H:%M", time.localtime(meta.get("creado", 0)))
+        print(f"[InicioView] snapshot del {creado} ({meta.get('filas')} filas, vigente={vigente})")
+        if not vigente:
+            self.refrescar_datos()
+
+    # ========== Tareas SQL en segundo plano ==========
+    def _lanzar_en_segundo_plano(self, tarea, al_terminar, texto: str) -> bool:
+        """
+        Ejecuta tarea(on_progress, cancelacion) en un hilo de trabajo. El
+        progreso llega por una cola que se consulta con after(); al_terminar
+        (resultado) se ejecuta en el hilo de Tk cuando la tarea acaba.
+        Devuelve False si ya hay una tarea en curso.
+        """
+        if self._tarea_en_curso():
+            print("[InicioView] tarea SQL en curso; se ignora el clic")
+            return False
+
+        cola = queue.Queue()
+        cancelacion = Cancelacion()
+
+        def _worker():
+            try:
+                resultado = tarea(
+                    lambda filas, fps: cola.put(("progreso", filas, fps)),
+                    cancelacion,
+                )
+                cola.put(("listo", resultado))
+            except ImportacionCancelada:
+                cola.put(("cancelado",))
+            except Exception as e:
+                cola.put(("error", e))
+
+        self._import_queue = cola
+        self._cancelacion = cancelacion
+        self._import_texto = texto
+        self._import_al_terminar = al_terminar
+        self._import_thread = threading.Thread(target=_worker, name="tarea-sql", daemon=True)
+
+        self.loading_label.configure(text=f"{texto}...")
+        self.cancel_button.configure(state="normal")
+        self.cancel_button.grid()
+        self._import_start = time.time()
+        self._import_thread.start()
+        self.after(100, self._poll_importacion)
+        return True
+
+    def _tarea_en_curso(self) -> bool:
+        return self._import_thread is not None and self._import_thread.is_alive()
+
+    def _avisar_tarea_en_curso(self) -> bool:
+        """
+        Los imports de Excel / catálogo reemplazan el dataset (o el catálogo)
+        que la tarea SQL en curso va a sustituir o parchear al terminar: se
+        bloquean hasta que acabe. Devuelve True si hay una tarea en curso.
+        """
+        if not self._tarea_en_curso():
+            return False
+        messagebox.showwarning(
+            "Tarea en curso",
+            f"Hay una tarea de SQL Server en curso ({self._import_texto}). "
+            "Espera a que termine o cancélala antes de importar.",
+        )
+        return True
+
+    def _poll_importacion(self):
+        """Consume los mensajes del hilo de trabajo (se ejecuta en el hilo de Tk)."""
+        cola = self._import_queue
+        if cola is None:
+            return
+        try:
+            while True:
+                msg = cola.get_nowait()
+                tipo = msg[0]
+                if tipo == "progreso":
+                    _, filas, fps = msg
+                    self.loading_label.configure(
+                        text=f"{self._import_texto}... {filas:,} filas ({fps:,.0f} filas/s)"
+                    )
+                elif tipo == "listo":
+                    al_terminar = self._import_al_terminar
+                    self._fin_importacion()
+                    print(f"[InicioView] SQL leído en {round(time.time() - self._import_start, 2)}s")
+                    try:
+                        al_terminar(msg[1])
+                    except Exception as e:
+                        messagebox.showerror("Error al importar datos", str(e))
+                    return
+                elif tipo == "cancelado":
+                    self._fin_importacion()
+                    messagebox.showwarning("Importación cancelada", "Se canceló la importación de datos.")
+                    return
+                elif tipo == "error":
+                    self._fin_importacion()
+                    messagebox.showerror("Error al importar datos", str(msg[1]))
+                    return
+        except queue.Empty:
+            pass
+        self.after(100, self._poll_importacion)
+
+    def _cancelar_importacion(self):
+        if self._cancelacion is not None:
+            print("[InicioView] cancelando importación...")
+            self.loading_label.configure(text="Cancelando...")
+            self.cancel_button.configure(state="disabled")
+            self._cancelacion.cancelar()
+
+    def _fin_importacion(self):
+        self._import_queue = None
+        self._cancelacion = None
+        self._import_al_terminar = None
+        self.cancel_button.grid_remove()
+        self.loading_label.configure(text="")
+
     # ========== Acciones ==========
     def importar_datos(self):
+        """Importación completa desde SQL Server (en segundo plano)."""
         print("[InicioView] importar_datos()")
-        try:
+        filtros = self.filter_panel.get_filtros_servidor()
+        if filtros:
+            print("[InicioView] import filtrado en servidor:", filtros)
+
+        if self.filter_panel.get_pivot_en_servidor():
+            self._importar_pivot_servidor(filtros)
+            return
+
+        def _tarea(on_progress, cancelacion):
+            return self.inventory_service.cargar_inventario_sql(
+                on_progress=on_progress, cancelacion=cancelacion, filtros=filtros
+            )
+
+        def _instalar(resultado):
+            df, firmas, movimientos = resultado
             self._ingest_and_refresh(
-                ingest_callable=self.inventory_service.importar_datos_sql,
+                ingest_callable=lambda: self.inventory_service.establecer_dataset(
+                    df, firmas=firmas, filtros_servidor=filtros, movimientos=movimientos
+                ),
                 success_msg="Datos importados correctamente."
             )
-        except Exception as e:
-            messagebox.showerror("Error al importar datos", str(e))
+
+        self._lanzar_en_segundo_plano(_tarea, _instalar, "Importando datos")
+
+    def _importar_pivot_servidor(self, filtros):
+        """Modo pivot en servidor: se descarga sólo el resultado ancho de la vista actual."""
+        opcion = self.filter_panel.get_filters().get("pivot")
+
+        def _tarea(on_progress, cancelacion):
+            return self.inventory_service.preparar_pivot_servidor(
+                opcion, on_progress=on_progress, cancelacion=cancelacion, filtros=filtros
+            )
+
+        def _instalar(preparado):
+            self._ingest_and_refresh(
+                ingest_callable=lambda: self.inventory_service.activar_pivot_servidor(preparado),
+                success_msg="Pivot leído desde SQL Server."
+            )
+
+        self._lanzar_en_segundo_plano(_tarea, _instalar, "Pivot en servidor")
+
+    def _leer_vista_servidor(self, opcion):
+        """Modo pivot en servidor: lee la vista `opcion` (con los filtros del import) y la muestra."""
+        def _tarea(on_progress, cancelacion):
+            return self.inventory_service.leer_vista_servidor(
+                opcion, on_progress=on_progress, cancelacion=cancelacion
+            )
+
+        def _instalar(crudo):
+            self.inventory_service.agregar_vistas_servidor(crudo)
+            with self._busy("Aplicando filtros..."):
+                self._hydrate_filters_from_df()
+                self._apply_filters_and_render(force=True)
+
+        self._lanzar_en_segundo_plano(_tarea, _instalar, f"Pivot en servidor ({opcion})")
+
+    def refrescar_datos(self):
+        """
+        Refresco incremental: sólo relee los productos cuya firma cambió desde
+        el último import. Sin import previo con firmas, hace uno completo; en
+        modo pivot en servidor (sin firmas) se avisa antes de releer todo.
+        """
+        print("[InicioView] refrescar_datos()")
+        if self.inventory_service.pivot_en_servidor:
+            if messagebox.askyesno(
+                "Actualizar cambios",
+                "En modo pivot en servidor no hay refresco incremental: se volverá a "
+                "leer el pivot completo de la vista actual desde SQL Server. ¿Continuar?",
+            ):
+                self._importar_pivot_servidor(self.inventory_service.filtros_servidor)
+            return
+        if self.inventory_service.df_original is None or self.inventory_service.firmas is None:
+            self.importar_datos()
+            return
+
+        # el delta se calcula contra este dataset; sólo se aplica sobre él
+        dataset = self.inventory_service.df_original
+
+        def _tarea(on_progress, cancelacion):
+            return self.inventory_service.calcular_delta(on_progress=on_progress, cancelacion=cancelacion)
+
+        def _aplicar(delta):
+            if self.inventory_service.df_original is not dataset:
+                print("[InicioView] el dataset cambió durante la búsqueda; se descarta el delta")
+                return
+            if delta is None:
+                self.importar_datos()
+                return
+            with self._busy("Aplicando cambios..."):
+                cambiados = self.inventory_service.aplicar_delta(delta)
+                if cambiados:
+                    self._hydrate_filters_from_df()
+                    self._apply_filters_and_render(force=True)
+            messagebox.showinfo("Listo", f"Productos actualizados: {len(cambiados)}")
+
+        self._lanzar_en_segundo_plano(_tarea, _aplicar, "Buscando cambios")
 
     def importar_excel(self):
         print("[InicioView] importar_excel()")
+        if self._avisar_tarea_en_curso():
+            return
         try:
             from components.excelPy import run_excelPy
             df = run_excelPy()
@@ -224,6 +466,8 @@ class InicioView(ctk.CTk):
 
     def importar_catalogo_descuento(self):
         print("[InicioView] importar_catalogo_descuento()")
+        if self._avisar_tarea_en_curso():
+            return
         try:
             from components.excelPy import run_excelPy
             df_catalogo = run_excelPy()